@@ -0,0 +1,765 @@
+#!/usr/bin/env python3.9
+
+from jaccard import jaccard, jaccard_sorted, verify_candidates, weighted_jaccard
+from lsh import LSH
+from main import compute_signatures, read_csv, read_data, shingle_matrix
+from minhash import (
+    create_minhash,
+    MinHasher,
+    OnePermutationHasher,
+    WeightedMinHasher,
+)
+from shingle import (
+    convert_shingles_to_bytes,
+    get_ngrams,
+    HashedShingler,
+    ShingleSetGenerator,
+)
+from store import SignatureStore
+
+from argparse import ArgumentParser
+from collections.abc import Callable, Generator, Iterable, Iterator
+from contextlib import redirect_stdout
+from io import StringIO
+from itertools import islice
+from typing import Any, Optional
+
+from scipy.sparse import triu
+
+import json
+import numpy as np
+import time
+import tracemalloc
+
+
+def measure_index_memory(
+    signatures: np.ndarray, nr_bands: int, rows_per_band: int, storage: str
+) -> tuple[LSH, int]:
+    """
+    Builds an LSH data structure and measures how much memory it uses.
+
+    :param signatures: The signature matrix, with one row per document.
+
+    :param nr_bands: The number of bands.
+
+    :param rows_per_band: The number of rows per band.
+
+    :param storage: The storage type of the bands, see `LSH.__init__()`.
+
+    :return: A tuple containing the data structure, and the number of bytes
+    that were allocated for it (and not freed) as measured by `tracemalloc`.
+    """
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+
+    lsh = LSH(nr_bands, rows_per_band, storage=storage)
+    for signature in signatures:
+        lsh.add_document(signature)
+    for band in lsh.bands:
+        # Merges the pending documents of array-backed bands
+        len(band)
+
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return lsh, after - before
+
+
+def compare_storage_memory(
+    filename: str, n: int = 2, nr_bands: int = 25, rows_per_band: int = 5
+) -> dict[str, int]:
+    """
+    Compares the memory usage of the bands' storage types on a data set, and
+    checks that they give the same query results.
+
+    :param filename: The name of the CSV file containing the data set.
+
+    :param n: The size of the n-grams.
+
+    :param nr_bands: The number of bands.
+
+    :param rows_per_band: The number of rows per band.
+
+    :return: A mapping of each storage type to the number of bytes it uses.
+    """
+    shingle_sets = ShingleSetGenerator(read_data(read_csv(filename)), n)
+    signatures = MinHasher(nr_bands * rows_per_band).signature_matrix(shingle_sets)
+
+    memory = {}
+    results = []
+    for storage in ("dict", "array"):
+        lsh, memory[storage] = measure_index_memory(
+            signatures, nr_bands, rows_per_band, storage
+        )
+        results.append(lsh.query())
+
+    assert all(result == results[0] for result in results), "Results differ"
+    return memory
+
+
+def synthetic_corpus(
+    nr_documents: int,
+    words_per_document: int = 300,
+    vocabulary_size: int = 50000,
+    duplicate_fraction: float = 0.05,
+    seed: int = 1,
+) -> Generator[dict[str, str], None, None]:
+    """
+    Generates a synthetic corpus with the same columns as the article CSV
+    files. Most documents consist of random words, but some are near-duplicates
+    of an earlier document with a few words replaced. The documents are
+    generated one by one, so that the corpus can be arbitrarily large.
+
+    :param nr_documents: The number of documents.
+
+    :param words_per_document: The number of words in each document.
+
+    :param vocabulary_size: The number of distinct words.
+
+    :param duplicate_fraction: The fraction of documents that are a
+    near-duplicate of one of the (at most 1000) previous documents.
+
+    :param seed: The seed of the random number generator.
+
+    :return: A generator that yields each document as a dictionary with the
+    keys `"News_ID"` and `"article"`, i.e. like `read_csv()`.
+    """
+    generator = np.random.RandomState(seed)
+    recent: list[np.ndarray] = []
+
+    for document_id in range(nr_documents):
+        if recent and generator.random_sample() < duplicate_fraction:
+            words = recent[generator.randint(len(recent))].copy()
+            nr_changes = generator.randint(1, max(2, words_per_document // 20))
+            positions = generator.randint(0, words_per_document, nr_changes)
+            words[positions] = generator.randint(0, vocabulary_size, nr_changes)
+        else:
+            words = generator.randint(0, vocabulary_size, words_per_document)
+
+        recent.append(words)
+        if len(recent) > 1000:
+            del recent[0]
+
+        article = " ".join(f"w{word}" for word in words.tolist())
+        yield {"News_ID": str(document_id), "article": article}
+
+
+class SyntheticCorpus:
+    """
+    A synthetic corpus that can be iterated several times without keeping it
+    in memory, since each iteration generates the same documents again.
+    """
+
+    nr_documents: int
+    # The other arguments of `synthetic_corpus()`
+    _kwargs: dict[str, Any]
+
+    def __init__(self, nr_documents: int, **kwargs) -> None:
+        """
+        Initialises the corpus.
+
+        :param nr_documents: The number of documents.
+
+        :param kwargs: The other arguments of `synthetic_corpus()`.
+        """
+        self.nr_documents = nr_documents
+        self._kwargs = kwargs
+
+    def __iter__(self) -> Iterator[dict[str, str]]:
+        return synthetic_corpus(self.nr_documents, **self._kwargs)
+
+    def __len__(self) -> int:
+        return self.nr_documents
+
+
+def _time_stage(
+    results: dict[str, dict[str, Any]],
+    name: str,
+    function: Callable[[], Any],
+    count: Callable[[Any], int],
+    trace_memory: bool = True,
+) -> Any:
+    """
+    Runs and times a single stage of the pipeline, and stores its metrics.
+
+    :param results: The mapping in which the stage's metrics are stored.
+
+    :param name: The name of the stage.
+
+    :param function: The function that runs the stage.
+
+    :param count: A function that computes the number of processed items from
+    the stage's output, which is used to compute its throughput.
+
+    :param trace_memory: Whether to measure the stage's peak memory usage with
+    `tracemalloc`. Since tracing slows down stages that allocate many Python
+    objects, the stage is then run twice: once to trace it, and once to time
+    it.
+
+    :return: The stage's output.
+    """
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        with redirect_stdout(StringIO()):
+            function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak -= before
+
+    start = time.perf_counter()
+    with redirect_stdout(StringIO()):
+        output = function()
+    seconds = time.perf_counter() - start
+
+    items = count(output)
+    results[name] = {
+        "seconds": seconds,
+        "items": items,
+        "items_per_second": items / seconds if seconds > 0 else None,
+        "peak_bytes": peak,
+    }
+    return output
+
+
+def benchmark_pipeline(
+    rows: Iterable[dict[str, str]],
+    n: int = 2,
+    nr_bands: int = 25,
+    rows_per_band: int = 5,
+    seed: int = 1,
+    datasketch: bool = True,
+    sample_size: Optional[int] = None,
+    trace_memory: bool = True,
+    chunk_size: int = 10000,
+    storage: str = "dict",
+) -> dict[str, Any]:
+    """
+    Benchmarks each stage of the pipeline separately, and the pipeline as a
+    whole. The input of each stage is computed (and kept in memory) before the
+    stage is timed, so each timing only covers a single stage. To keep this
+    feasible for large corpora, the separate stages can be run on a sample of
+    the rows, while the whole pipeline streams over all of them in chunks, with
+    the `HashedShingler` as in `main.compute_signatures()`.
+
+    :param rows: The input rows, i.e. as returned by `read_csv()`. These are
+    read twice, so this shouldn't be a generator, but it can be a lazy
+    `SyntheticCorpus`.
+
+    :param n: The size of the n-grams.
+
+    :param nr_bands: The number of bands.
+
+    :param rows_per_band: The number of rows per band.
+
+    :param seed: The seed of the minhash permutations.
+
+    :param datasketch: Whether to benchmark the (slow) `create_minhash()`
+    function, which uses datasketch, and the conversion of its input.
+
+    :param sample_size: If given, the separate stages only use this many of the
+    first rows.
+
+    :param trace_memory: Whether to measure the peak memory usage of each stage,
+    see `_time_stage()`.
+
+    :param chunk_size: The number of documents whose signatures are computed at
+    once by the whole pipeline.
+
+    :param storage: The storage type of the bands of the whole pipeline, see
+    `LSH.__init__()`. The `"array"` storage uses far less memory for large
+    corpora.
+
+    :return: A JSON-serialisable dictionary containing, for each stage, its
+    duration in seconds, the number of processed items, the throughput, and
+    the peak number of bytes that it allocated; the number of candidate pairs
+    of the sample; and the duration of the whole pipeline.
+    """
+    nr_rows = nr_bands * rows_per_band
+    stages: dict[str, dict[str, Any]] = {}
+    sample = list(islice(rows, sample_size))
+
+    def time_stage(
+        name: str, function: Callable[[], Any], count: Callable[[Any], int]
+    ) -> Any:
+        return _time_stage(stages, name, function, count, trace_memory)
+
+    documents = time_stage("read_data", lambda: list(read_data(sample)), len)
+    time_stage(
+        "get_ngrams",
+        lambda: sum(1 for words in documents for _ in get_ngrams(words, n)),
+        lambda nr_ngrams: nr_ngrams,
+    )
+    shingle_sets = time_stage(
+        "ShingleSetGenerator",
+        lambda: list(ShingleSetGenerator(documents, n)),
+        lambda sets: sum(len(shingles) for shingles in sets),
+    )
+    time_stage(
+        "HashedShingler",
+        lambda: list(HashedShingler(n)(row["article"] for row in sample)),
+        lambda arrays: sum(len(shingles) for shingles in arrays),
+    )
+    if datasketch:
+        byte_strings = time_stage(
+            "convert_shingles_to_bytes",
+            lambda: [
+                list(convert_shingles_to_bytes(shingles)) for shingles in shingle_sets
+            ],
+            lambda lists: sum(len(strings) for strings in lists),
+        )
+        time_stage("create_minhash", lambda: create_minhash(byte_strings, nr_rows), len)
+        del byte_strings
+
+    signatures = time_stage(
+        "MinHasher.signature_matrix",
+        lambda: MinHasher(nr_rows, seed).signature_matrix(shingle_sets),
+        len,
+    )
+    del documents, shingle_sets
+
+    def add_documents() -> LSH:
+        lsh = LSH(nr_bands, rows_per_band)
+        for signature in signatures:
+            lsh.add_document(signature)
+        return lsh
+
+    lsh = time_stage("LSH.add_document", add_documents, lambda _: len(signatures))
+    candidates = time_stage("LSH.query", lsh.query, len)
+    del lsh
+
+    def end_to_end() -> int:
+        minhasher = MinHasher(nr_rows, seed)
+        articles = (row["article"] for row in rows)
+        lsh = LSH(nr_bands, rows_per_band, fast_hashing=True, storage=storage)
+        nr_documents = 0
+        while chunk := list(islice(articles, chunk_size)):
+            lsh.add_documents(compute_signatures(chunk, n, minhasher))
+            nr_documents += len(chunk)
+        len(lsh.query())
+        return nr_documents
+
+    nr_documents = time_stage("end_to_end", end_to_end, lambda count: count)
+
+    return {
+        "parameters": {
+            "nr_documents": nr_documents,
+            "sample_size": len(sample),
+            "n": n,
+            "nr_bands": nr_bands,
+            "rows_per_band": rows_per_band,
+            "seed": seed,
+        },
+        "stages": stages,
+        "candidate_pairs": len(candidates),
+    }
+
+
+def compare_signature_modes(
+    rows: Iterable[dict[str, str]],
+    n: int = 2,
+    nr_bands: int = 25,
+    rows_per_band: int = 5,
+    min_similarity: float = 0.8,
+    seed: int = 1,
+) -> dict[str, dict[str, Any]]:
+    """
+    Compares set-based minhash signatures with weighted minhash signatures,
+    which weigh each shingle by its number of occurrences. For each mode, the
+    candidate pairs with an approximated similarity of at least
+    `min_similarity` are evaluated against the exact similarity of that mode,
+    i.e. the Jaccard similarity of the shingle sets or the weighted Jaccard
+    similarity of the shingle counts.
+
+    :param rows: The input rows, i.e. as returned by `read_csv()`.
+
+    :param n: The size of the n-grams.
+
+    :param nr_bands: The number of bands.
+
+    :param rows_per_band: The number of rows per band.
+
+    :param min_similarity: The similarity threshold.
+
+    :param seed: The seed of the minhash permutations.
+
+    :return: A JSON-serialisable dictionary containing, for each mode, the
+    time it took to compute the signatures, the number of candidate pairs, the
+    number of them whose exact similarity is at least `min_similarity`, and the
+    precision, i.e. the fraction of such candidates.
+    """
+    shingler = HashedShingler(n)
+    counts = [
+        shingler.shingle_counts(shingler.tokenize(row["article"])) for row in rows
+    ]
+    nr_rows = nr_bands * rows_per_band
+
+    modes = {
+        "set": (
+            MinHasher(nr_rows, seed),
+            [shingles for shingles, _ in counts],
+            lambda i, j: jaccard_sorted(counts[i][0], counts[j][0]),
+        ),
+        "weighted": (
+            WeightedMinHasher(nr_rows, seed),
+            counts,
+            lambda i, j: weighted_jaccard(*counts[i], *counts[j]),
+        ),
+    }
+
+    results = {}
+    for mode, (minhasher, documents, similarity) in modes.items():
+        start = time.perf_counter()
+        signatures = minhasher.signature_matrix(documents)
+        seconds = time.perf_counter() - start
+
+        lsh = LSH(nr_bands, rows_per_band, fast_hashing=True)
+        lsh.add_documents(signatures)
+        candidates = [pair for pair, _ in lsh.candidate_pairs(min_similarity)]
+        true_positives = sum(
+            1 for i, j in candidates if similarity(i, j) >= min_similarity
+        )
+        results[mode] = {
+            "signature_seconds": seconds,
+            "candidate_pairs": len(candidates),
+            "true_positives": true_positives,
+            "precision": true_positives / len(candidates) if candidates else None,
+        }
+    return results
+
+
+def _similar_pairs(
+    shingle_sets: list[set[int]], min_similarity: float
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the pairs of documents whose exact Jaccard similarity is at least a
+    threshold, with a sparse matrix product.
+
+    :param shingle_sets: The shingle sets of the documents.
+
+    :param min_similarity: The threshold, which should be above 0.
+
+    :return: A tuple of arrays containing the first and second document of each
+    pair (with the first being the smallest), and their similarity.
+    """
+    matrix = shingle_matrix(shingle_sets)
+    sizes = np.asarray(matrix.getnnz(axis=1))
+
+    intersections = triu(matrix @ matrix.T, k=1).tocoo()
+    unions = sizes[intersections.row] + sizes[intersections.col] - intersections.data
+    similarities = intersections.data / unions
+    similar = similarities >= min_similarity
+    return (
+        intersections.row[similar],
+        intersections.col[similar],
+        similarities[similar],
+    )
+
+
+def compare_minhash_accuracy(
+    rows: Iterable[dict[str, str]],
+    n: int = 2,
+    nr_permutations: int = 125,
+    min_similarity: float = 0.1,
+    nr_random_pairs: int = 1000,
+    seed: int = 1,
+    datasketch: bool = True,
+) -> dict[str, dict[str, Any]]:
+    """
+    Compares the accuracy and speed of the signature implementations: the
+    datasketch-based `create_minhash()`, the `MinHasher` and the
+    `OnePermutationHasher`. The similarity estimates of the signatures are
+    compared to the exact Jaccard similarities of two groups of pairs: the
+    pairs whose similarity is at least `min_similarity`, which are found with a
+    sparse matrix product, and randomly chosen pairs.
+
+    :param rows: The input rows, i.e. as returned by `read_csv()`.
+
+    :param n: The size of the n-grams.
+
+    :param nr_permutations: The number of permutations of each implementation.
+
+    :param min_similarity: The minimal similarity of the similar pairs.
+
+    :param nr_random_pairs: The number of random pairs.
+
+    :param seed: The seed of the permutations and the random pairs.
+
+    :param datasketch: Whether to include the (slow) `create_minhash()`.
+
+    :return: A JSON-serialisable dictionary containing, for each
+    implementation, the time it took to compute the signatures, and for each
+    group of pairs, the number of pairs and the mean absolute error, the root
+    mean squared error and the mean error (i.e. the bias) of the estimates.
+    """
+    shingle_sets = list(ShingleSetGenerator(read_data(rows), n))
+    first, second, similarities = _similar_pairs(shingle_sets, min_similarity)
+
+    generator = np.random.RandomState(seed)
+    random_pairs = generator.randint(0, len(shingle_sets), (nr_random_pairs, 2))
+    random_pairs = random_pairs[random_pairs[:, 0] != random_pairs[:, 1]]
+    groups = {
+        "similar": (first, second, similarities),
+        "random": (
+            random_pairs[:, 0],
+            random_pairs[:, 1],
+            np.array(
+                [jaccard(shingle_sets[i], shingle_sets[j]) for i, j in random_pairs]
+            ),
+        ),
+    }
+
+    implementations = {
+        "MinHasher": lambda: MinHasher(nr_permutations, seed).signature_matrix(
+            shingle_sets
+        ),
+        "OnePermutationHasher": lambda: OnePermutationHasher(
+            nr_permutations, seed
+        ).signature_matrix(shingle_sets),
+    }
+    if datasketch:
+        byte_strings = [
+            list(convert_shingles_to_bytes(shingles)) for shingles in shingle_sets
+        ]
+        implementations["create_minhash"] = lambda: np.array(
+            [
+                minhash.hashvalues
+                for minhash in create_minhash(byte_strings, nr_permutations)
+            ]
+        )
+
+    results = {}
+    for name, compute in implementations.items():
+        start = time.perf_counter()
+        with redirect_stdout(StringIO()):
+            signatures = compute()
+        results[name] = {"seconds": time.perf_counter() - start}
+
+        for group, (first, second, exact) in groups.items():
+            estimates = (signatures[first] == signatures[second]).mean(axis=1)
+            errors = estimates - exact
+            results[name][group] = {
+                "pairs": len(errors),
+                "mean_absolute_error": float(np.abs(errors).mean())
+                if len(errors)
+                else None,
+                "root_mean_squared_error": (
+                    float(np.sqrt((errors ** 2).mean())) if len(errors) else None
+                ),
+                "mean_error": float(errors.mean()) if len(errors) else None,
+            }
+    return results
+
+
+def compare_signature_bits(
+    rows: Iterable[dict[str, str]],
+    n: int = 2,
+    nr_bands: int = 25,
+    rows_per_band: int = 5,
+    min_similarity: float = 0.8,
+    bits: Iterable[int] = (64, 32, 16, 8, 4, 2, 1),
+    seed: int = 1,
+) -> dict[str, dict[str, Any]]:
+    """
+    Compares the memory usage and accuracy of `MinHasher` signatures that are
+    stored in full (64 bits) or in a `SignatureStore` with fewer bits. For each
+    number of bits, the stored signatures are banded by an `LSH` with the same
+    bands and rows, and the candidates are verified on the stored signatures.
+    The verified pairs are then compared to the pairs whose exact Jaccard
+    similarity is at least `min_similarity`.
+
+    :param rows: The input rows, i.e. as returned by `read_csv()`.
+
+    :param n: The size of the n-grams.
+
+    :param nr_bands: The number of bands.
+
+    :param rows_per_band: The number of rows per band.
+
+    :param min_similarity: The similarity threshold.
+
+    :param bits: The numbers of bits to compare, where 64 stands for the full
+    `uint64` signature matrix.
+
+    :param seed: The seed of the minhash permutations.
+
+    :return: A JSON-serialisable dictionary containing, for each number of
+    bits, the size of the signatures in bytes, the number of candidate pairs
+    of the bands, the number of verified pairs, their precision and recall,
+    and the mean absolute error of the estimated similarities of the exactly
+    similar pairs.
+    """
+    shingle_sets = list(ShingleSetGenerator(read_data(rows), n))
+    first, second, exact = _similar_pairs(shingle_sets, min_similarity)
+    similar_pairs = set(zip(first.tolist(), second.tolist()))
+    signatures = MinHasher(nr_bands * rows_per_band, seed).signature_matrix(
+        shingle_sets
+    )
+
+    results = {}
+    for nr_bits in bits:
+        if nr_bits == 64:
+            store = signatures
+            chunks = [signatures]
+            estimates = (signatures[first] == signatures[second]).mean(axis=1)
+        else:
+            store = SignatureStore(signatures.shape[1], nr_bits, signatures)
+            chunks = store.chunks()
+            estimates = store.similarities(np.column_stack([first, second]))
+
+        lsh = LSH(nr_bands, rows_per_band, fast_hashing=True)
+        for chunk in chunks:
+            lsh.add_documents(chunk)
+        nr_candidates = 0
+
+        def candidates() -> Generator[tuple[tuple[int, int], float], None, None]:
+            nonlocal nr_candidates
+            for candidate in lsh.candidate_pairs():
+                nr_candidates += 1
+                yield candidate
+
+        verified = {
+            pair
+            for pair, _ in verify_candidates(
+                candidates(), signatures=store, min_similarity=min_similarity
+            )
+        }
+        true_positives = len(verified & similar_pairs)
+        results[str(nr_bits)] = {
+            "signature_bytes": store.nbytes,
+            "compression": signatures.nbytes / store.nbytes,
+            "candidate_pairs": nr_candidates,
+            "verified_pairs": len(verified),
+            "precision": true_positives / len(verified) if verified else None,
+            "recall": true_positives / len(similar_pairs) if similar_pairs else None,
+            "mean_absolute_error": float(np.abs(estimates - exact).mean())
+            if len(exact)
+            else None,
+        }
+    return results
+
+
+def main(arguments: Optional[list[str]] = None) -> dict[str, Any]:
+    """
+    Runs the benchmarks from the command line, and prints the results as JSON.
+
+    :param arguments: The command line arguments, by default `sys.argv[1:]`.
+
+    :return: The results, as a mapping of data set names to their benchmarks.
+    """
+    parser = ArgumentParser(description="Benchmarks the stages of the pipeline.")
+    parser.add_argument(
+        "--data",
+        nargs="*",
+        default=["data/news_articles_small.csv", "data/news_articles_small_dup.csv"],
+        help="The CSV files to benchmark on.",
+    )
+    parser.add_argument(
+        "--synthetic",
+        nargs="*",
+        type=int,
+        default=[],
+        help="The sizes of the synthetic corpora to benchmark on.",
+    )
+    parser.add_argument("--n", type=int, default=2, help="The size of the n-grams.")
+    parser.add_argument("--bands", type=int, default=25, help="The number of bands.")
+    parser.add_argument("--rows", type=int, default=5, help="The rows per band.")
+    parser.add_argument("--seed", type=int, default=1, help="The minhash seed.")
+    parser.add_argument(
+        "--no-datasketch",
+        action="store_true",
+        help="Don't benchmark the datasketch-based `create_minhash()`.",
+    )
+    parser.add_argument(
+        "--storage-memory",
+        action="store_true",
+        help="Also compare the memory usage of the LSH storage types.",
+    )
+    parser.add_argument(
+        "--signature-modes",
+        action="store_true",
+        help="Also compare the precision of set-based and weighted signatures.",
+    )
+    parser.add_argument(
+        "--minhash-accuracy",
+        action="store_true",
+        help="Also compare the accuracy of the signature implementations.",
+    )
+    parser.add_argument(
+        "--signature-bits",
+        action="store_true",
+        help="Also compare the accuracy of signatures with fewer bits.",
+    )
+    parser.add_argument(
+        "--sample-size",
+        type=int,
+        default=10000,
+        help="The number of documents of the separate stages and comparisons; "
+        "the whole pipeline always runs on all documents.",
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        action="store_true",
+        help="Don't measure the peak memory usage of each stage.",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=["dict", "array"],
+        default="dict",
+        help="The storage type of the bands of the whole pipeline.",
+    )
+    parser.add_argument("--output", help="The file to write the results to.")
+    options = parser.parse_args(arguments)
+
+    datasets = {
+        filename: lambda f=filename: list(read_csv(f)) for filename in options.data
+    }
+    for size in options.synthetic:
+        datasets[f"synthetic-{size}"] = lambda s=size: SyntheticCorpus(s)
+
+    results = {}
+    for name, load in datasets.items():
+        results[name] = benchmark_pipeline(
+            load(),
+            options.n,
+            options.bands,
+            options.rows,
+            options.seed,
+            not options.no_datasketch,
+            options.sample_size,
+            not options.no_trace_memory,
+            storage=options.storage,
+        )
+        sample = list(islice(load(), options.sample_size))
+        if options.storage_memory and name in options.data:
+            results[name]["storage_memory_bytes"] = compare_storage_memory(
+                name, options.n, options.bands, options.rows
+            )
+        if options.minhash_accuracy:
+            results[name]["minhash_accuracy"] = compare_minhash_accuracy(
+                sample,
+                options.n,
+                options.bands * options.rows,
+                seed=options.seed,
+                datasketch=not options.no_datasketch,
+            )
+        if options.signature_modes:
+            results[name]["signature_modes"] = compare_signature_modes(
+                sample, options.n, options.bands, options.rows, seed=options.seed
+            )
+        if options.signature_bits:
+            results[name]["signature_bits"] = compare_signature_bits(
+                sample, options.n, options.bands, options.rows, seed=options.seed
+            )
+
+    output = json.dumps(results, indent=2)
+    if options.output:
+        with open(options.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3.9
+
+from minhash import MinHasher, OnePermutationHasher, WeightedMinHasher
+from shingle import HashedShingler
+
+from collections.abc import Callable, Iterable
+from hashlib import blake2b
+from typing import Any, Union
+
+import metrics
+import numpy as np
+import sqlite3
+
+
+# The signature implementations whose signatures can be cached
+Hasher = Union[MinHasher, OnePermutationHasher, WeightedMinHasher]
+
+
+class SignatureCache:
+    """
+    A persistent cache of minhash signatures, stored in an SQLite database. Each
+    signature is identified by a hash of the normalised text of its article
+    (i.e. its lowercase words, as split by `HashedShingler.tokenize()`) and of
+    the parameters that the signature depends on: the size of the n-grams, the
+    signature implementation, its number of permutations and its seed. The
+    signatures of unchanged articles are thus found again in later runs, while
+    changing any parameter invalidates them.
+
+    The cache holds at most `max_entries` signatures. When it's full, the least
+    recently used signatures are evicted.
+    """
+
+    filename: str
+    max_entries: int
+
+    # The connection to the database
+    _connection: sqlite3.Connection
+    # The number of signatures in the cache
+    _size: int
+    # The last value of the counter that orders the signatures by their use
+    _clock: int
+
+    # The maximal number of keys per SQL statement
+    _chunk_size = 500
+
+    def __init__(self, filename: str, max_entries: int = 1000000) -> None:
+        """
+        Opens the cache, creating the database if it doesn't exist yet.
+
+        :param filename: The name of the database file, or `":memory:"` for a
+        cache that isn't persistent.
+
+        :param max_entries: The maximal number of signatures in the cache.
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self._connection = sqlite3.connect(filename)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "key BLOB PRIMARY KEY, signature BLOB NOT NULL, last_used INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS signatures_last_used ON signatures (last_used)"
+        )
+        self._connection.commit()
+        self._size, clock = self._connection.execute(
+            "SELECT COUNT(*), MAX(last_used) FROM signatures"
+        ).fetchone()
+        self._clock = clock or 0
+        self._evict()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __enter__(self) -> "SignatureCache":
+        return self
+
+    def __exit__(self, *exception: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Closes the database.
+        """
+        self._connection.close()
+
+    @staticmethod
+    def keys(texts: Iterable[str], n: int, minhasher: Hasher) -> list[bytes]:
+        """
+        Computes the keys of the signatures of several articles.
+
+        :param texts: The texts of the articles.
+
+        :param n: The size of the n-grams.
+
+        :param minhasher: The object that computes the signatures.
+
+        :return: The 16-byte key of each article, in the same order.
+        """
+        shingler = HashedShingler(n)
+        parameters = (
+            f"{type(minhasher).__name__}:{n}:{minhasher.nr_permutations}:"
+            f"{minhasher.seed}\n"
+        ).encode()
+        return [
+            blake2b(
+                parameters + " ".join(shingler.tokenize(text)).encode(), digest_size=16
+            ).digest()
+            for text in texts
+        ]
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        """
+        Looks up several signatures, and marks them as recently used.
+
+        :param keys: The keys of the signatures, see `keys()`.
+
+        :return: A mapping of the keys that are in the cache to their
+        signatures, as `uint64` arrays.
+        """
+        found = {}
+        for start in range(0, len(keys), self._chunk_size):
+            chunk = keys[start : start + self._chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self._connection.execute(
+                f"SELECT key, signature FROM signatures WHERE key IN ({placeholders})",
+                chunk,
+            )
+            for key, signature in rows:
+                found[key] = np.frombuffer(signature, dtype=np.uint64)
+
+        if found:
+            self._clock += 1
+            self._connection.executemany(
+                "UPDATE signatures SET last_used = ? WHERE key = ?",
+                ((self._clock, key) for key in found),
+            )
+            self._connection.commit()
+        metrics.count("cache_hits", len(found))
+        metrics.count("cache_misses", len(set(keys)) - len(found))
+        return found
+
+    def put_many(self, keys: list[bytes], signatures: np.ndarray) -> None:
+        """
+        Adds several signatures, and evicts the least recently used signatures
+        if the cache is then too large.
+
+        :param keys: The keys of the signatures, see `keys()`.
+
+        :param signatures: The signatures, with one row per key.
+        """
+        if len(keys) == 0:
+            return
+
+        self._clock += 1
+        signatures = np.asarray(signatures, dtype=np.uint64)
+        cursor = self._connection.executemany(
+            "INSERT OR IGNORE INTO signatures VALUES (?, ?, ?)",
+            (
+                (key, signature.tobytes(), self._clock)
+                for key, signature in zip(keys, signatures)
+            ),
+        )
+        self._size += cursor.rowcount
+        self._evict()
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used signatures until there are at most
+        `max_entries` left.
+        """
+        if self._size > self.max_entries:
+            self._connection.execute(
+                "DELETE FROM signatures WHERE key IN ("
+                "SELECT key FROM signatures ORDER BY last_used LIMIT ?"
+                ")",
+                (self._size - self.max_entries,),
+            )
+            metrics.count("cache_evictions", self._size - self.max_entries)
+            self._size = self.max_entries
+        self._connection.commit()
+
+    def signatures(
+        self,
+        texts: list[str],
+        n: int,
+        minhasher: Hasher,
+        compute: Callable[[list[str], int, Hasher], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Computes the signatures of several articles, only computing those that
+        aren't in the cache yet (and adding them to it).
+
+        :param texts: The texts of the articles.
+
+        :param n: The size of the n-grams.
+
+        :param minhasher: The object that computes the signatures.
+
+        :param compute: The function that computes the signatures of a list of
+        texts, e.g. `main.compute_signatures()`.
+
+        :return: The signature matrix, with one row per article. It's the same
+        as the result of `compute(texts, n, minhasher)`.
+        """
+        keys = self.keys(texts, n, minhasher)
+        found = self.get_many(keys)
+
+        signatures = np.empty((len(texts), minhasher.nr_permutations), dtype=np.uint64)
+        missing = [index for index, key in enumerate(keys) if key not in found]
+        for index, key in enumerate(keys):
+            if key in found:
+                signatures[index] = found[key]
+
+        if missing:
+            computed = compute([texts[index] for index in missing], n, minhasher)
+            signatures[missing] = computed
+            self.put_many([keys[index] for index in missing], computed)
+        return signatures
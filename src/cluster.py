@@ -0,0 +1,226 @@
+#!/usr/bin/env python3.9
+
+from array import array
+from collections.abc import Generator, Iterable
+from typing import Optional, Union
+
+import numpy as np
+
+
+class UnionFind:
+    """
+    A union-find (i.e. disjoint-set) data structure that groups documents into
+    clusters of near-duplicates, one pair at a time. The documents are numbered
+    by a dense index in order of their arrival, and it is backed by four arrays
+    of 64-bit integers, indexed by this index: the document ID of each
+    document, its parent, the size of each cluster, and the smallest document
+    ID of each cluster. Its memory usage is thus linear in the number of
+    documents, regardless of how large their IDs are, and doesn't depend on the
+    number of pairs, which can be streamed into it.
+
+    The clusters are merged by size and the paths are halved on each lookup,
+    so each operation takes nearly constant amortised time. The document IDs
+    `0` to `nr_documents - 1` are their own index, so that column numbers don't
+    need a mapping; other IDs are mapped to their index by a dictionary.
+    """
+
+    # The number of document IDs that are their own index
+    _nr_dense: int
+    # The indices of the other document IDs
+    _indices: dict[int, int]
+    # The document ID of each index
+    _document_ids: array
+    # The parent of each document, or the document itself for a root
+    _parents: array
+    # The number of documents in the cluster of each root
+    _sizes: array
+    # The smallest document ID in the cluster of each root
+    _minimums: array
+
+    def __init__(self, documents: Union[int, Iterable[int]] = 0) -> None:
+        """
+        Initialises the data structure, with each document in its own cluster.
+
+        :param documents: Either the number of documents, whose IDs are then
+        `0` to `documents - 1`, or the IDs of the documents. Other documents are
+        added when they're first merged.
+        """
+        self._indices = {}
+        if isinstance(documents, int):
+            self._nr_dense = documents
+            self._document_ids = array("q", range(documents))
+            self._parents = array("q", range(documents))
+            self._sizes = array("q", [1]) * documents
+            self._minimums = array("q", range(documents))
+        else:
+            self._nr_dense = 0
+            self._document_ids = array("q")
+            self._parents = array("q")
+            self._sizes = array("q")
+            self._minimums = array("q")
+            for document_id in documents:
+                self._index(document_id, True)
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    @property
+    def document_ids(self) -> np.ndarray:
+        """
+        Returns the IDs of the documents, in the order of their indices.
+        """
+        return np.frombuffer(self._document_ids, dtype=np.int64).copy()
+
+    def _index(self, document_id: int, add: bool = False) -> Optional[int]:
+        """
+        Looks up the index of a document.
+
+        :param document_id: The document ID.
+
+        :param add: Whether to add the document, as a singleton cluster, if it
+        isn't known yet.
+
+        :return: The document's index, or `None` if it isn't known (and isn't
+        added).
+        """
+        if 0 <= document_id < self._nr_dense:
+            return document_id
+        index = self._indices.get(document_id)
+        if index is None and add:
+            index = len(self._parents)
+            self._indices[document_id] = index
+            self._document_ids.append(document_id)
+            self._parents.append(index)
+            self._sizes.append(1)
+            self._minimums.append(document_id)
+        return index
+
+    def _find(self, index: int) -> int:
+        """
+        Finds the index of the root of a document's cluster, and halves the path
+        to it.
+
+        :param index: The document's index.
+
+        :return: The index of the cluster's root.
+        """
+        parents = self._parents
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    def find(self, document_id: int) -> int:
+        """
+        Finds the root of a document's cluster, and halves the path to it.
+
+        :param document_id: The document ID.
+
+        :return: The document ID of the cluster's root. This is an internal
+        identifier, see `representative()` for a canonical one.
+        """
+        index = self._index(document_id)
+        if index is None:
+            return document_id
+        return self._document_ids[self._find(index)]
+
+    def union(self, document_id_1: int, document_id_2: int) -> int:
+        """
+        Merges the clusters of two documents.
+
+        :param document_id_1:
+        :param document_id_2: The document IDs.
+
+        :return: The document ID of the root of the merged cluster.
+        """
+        root_1 = self._find(self._index(document_id_1, True))
+        root_2 = self._find(self._index(document_id_2, True))
+        if root_1 != root_2:
+            if self._sizes[root_1] < self._sizes[root_2]:
+                root_1, root_2 = root_2, root_1
+            self._parents[root_2] = root_1
+            self._sizes[root_1] += self._sizes[root_2]
+            self._minimums[root_1] = min(self._minimums[root_1], self._minimums[root_2])
+        return self._document_ids[root_1]
+
+    def union_pairs(
+        self,
+        pairs: Iterable[Union[tuple[int, int], tuple[tuple[int, int], float]]],
+    ) -> None:
+        """
+        Merges the clusters of each pair of documents.
+
+        :param pairs: The pairs, either as tuples `(id_1, id_2)` or as tuples
+        `((id_1, id_2), similarity)`, i.e. as yielded by `LSH.candidate_pairs()`
+        or `verify_candidates()`. The pairs are consumed one by one.
+        """
+        for pair in pairs:
+            if isinstance(pair[0], tuple):
+                pair = pair[0]
+            self.union(pair[0], pair[1])
+
+    def representative(self, document_id: int) -> int:
+        """
+        Returns the canonical representative of a document's cluster, which is
+        its smallest document ID. Unlike the root, this doesn't depend on the
+        order in which the pairs were merged.
+
+        :param document_id: The document ID.
+
+        :return: The smallest document ID in the cluster.
+        """
+        index = self._index(document_id)
+        if index is None:
+            return document_id
+        return self._minimums[self._find(index)]
+
+    def size(self, document_id: int) -> int:
+        """
+        Returns the size of a document's cluster.
+
+        :param document_id: The document ID.
+
+        :return: The number of documents in the cluster.
+        """
+        index = self._index(document_id)
+        if index is None:
+            return 1
+        return self._sizes[self._find(index)]
+
+    def labels(self) -> np.ndarray:
+        """
+        Computes the cluster ID of each document, i.e. the canonical
+        representative of its cluster. All paths are compressed at once, by
+        repeatedly replacing each parent by its own parent.
+
+        :return: An `int64` array containing the cluster ID of each document, in
+        the same order as `document_ids`. With the IDs `0` to `n - 1`, this is
+        indexed by document ID.
+        """
+        roots = np.frombuffer(self._parents, dtype=np.int64).copy()
+        while True:
+            grandparents = roots[roots]
+            if np.array_equal(grandparents, roots):
+                break
+            roots = grandparents
+
+        self._parents = array("q", roots.tobytes())
+        return np.frombuffer(self._minimums, dtype=np.int64)[roots]
+
+    def clusters(self, min_size: int = 2) -> Generator[np.ndarray, None, None]:
+        """
+        Yields the clusters of documents, ordered by their representatives.
+
+        :param min_size: The minimal number of documents in the clusters that
+        are yielded. By default, singletons are skipped.
+
+        :return: A generator that yields each cluster as a sorted array of
+        document IDs, whose first element is the cluster's representative.
+        """
+        labels = self.labels()
+        document_ids = self.document_ids
+        order = np.lexsort((document_ids, labels))
+        boundaries = np.flatnonzero(labels[order][1:] != labels[order][:-1]) + 1
+        for cluster in np.split(order, boundaries):
+            if len(cluster) >= min_size:
+                yield document_ids[cluster]
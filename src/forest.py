@@ -0,0 +1,296 @@
+#!/usr/bin/env python3.9
+
+from collections.abc import Iterable
+from typing import Optional
+
+import numpy as np
+
+
+def _search(
+    column: np.ndarray,
+    values: np.ndarray,
+    start: np.ndarray,
+    end: np.ndarray,
+    side: str,
+) -> np.ndarray:
+    """
+    Performs a binary search for several values at once, each within its own
+    sorted range of a column, like `numpy.searchsorted()` does for one range.
+
+    :param column: The column to search, which is sorted within each range.
+
+    :param values: The value to search for in each range.
+
+    :param start:
+    :param end: The start (inclusive) and end (exclusive) of each range.
+
+    :param side: With `"left"`, the first position whose value is at least the
+    searched value is returned; with `"right"`, the first position whose value
+    is greater than it.
+
+    :return: The found position within each range.
+    """
+    start = start.copy()
+    end = end.copy()
+    while True:
+        active = start < end
+        if not active.any():
+            return start
+
+        middle = np.minimum((start + end) // 2, len(column) - 1)
+        if side == "left":
+            go_right = column[middle] < values
+        else:
+            go_right = column[middle] <= values
+
+        start = np.where(active & go_right, middle + 1, start)
+        end = np.where(active & ~go_right, middle, end)
+
+
+class LSHForest:
+    """
+    A native implementation of the LSH Forest, for top-k similarity searches
+    over the same minhash signatures as the `LSH` data structure. The signature
+    matrix M is partitioned into `nr_trees` groups of `rows_per_tree` rows, like
+    the bands of LSH. For each group (i.e. tree), the documents are sorted by
+    their rows in lexicographic order, so that the documents whose signatures
+    share a prefix of the group form a contiguous range, which is found by
+    binary search. A query starts with the longest prefixes, and shortens them
+    until enough candidates are found; these are then ranked by the similarity
+    of their full signatures.
+
+    Unlike `minhash.get_minforest()`, no second index is built with its own
+    tokenizer, and queries don't need datasketch or pandas.
+    """
+
+    nr_trees: int
+    rows_per_tree: int
+
+    # The signatures of the documents, with one row per document
+    _signatures: np.ndarray
+    # The IDs of the documents, in the same order as the signatures
+    _document_ids: np.ndarray
+    # The signature chunks that haven't been indexed yet, with their IDs
+    _pending: list[tuple[np.ndarray, np.ndarray]]
+    # For each tree, the positions of the documents in lexicographic order
+    _orders: list[np.ndarray]
+    # For each tree, the tree's rows of the signatures, in the same order
+    _sorted_rows: list[np.ndarray]
+    # The next unused document ID
+    _next_doc_id: int
+
+    def __init__(self, nr_trees: int = 8, rows_per_tree: int = 16) -> None:
+        """
+        Initialises an empty forest.
+
+        :param nr_trees: The number of trees `l`. More trees give a higher
+        recall, at the cost of memory and query time.
+
+        :param rows_per_tree: The maximal prefix length `k` of each tree. The
+        signatures should have at least `nr_trees * rows_per_tree` rows.
+        """
+        self.nr_trees = nr_trees
+        self.rows_per_tree = rows_per_tree
+        self._signatures = np.empty((0, self.nr_rows), dtype=np.uint64)
+        self._document_ids = np.empty(0, dtype=np.int64)
+        self._pending = []
+        self._orders = []
+        self._sorted_rows = []
+        self._next_doc_id = 0
+
+    @property
+    def nr_rows(self) -> int:
+        """
+        Returns the number of rows of the signatures that are used.
+        """
+        return self.nr_trees * self.rows_per_tree
+
+    def __len__(self) -> int:
+        return len(self._document_ids) + sum(len(ids) for _, ids in self._pending)
+
+    def add_documents(
+        self, signatures: np.ndarray, document_ids: Optional[Iterable[int]] = None
+    ) -> np.ndarray:
+        """
+        Adds several documents. They are indexed by `index()`, which is called
+        by the first query after them.
+
+        :param signatures: The signature matrix, with one row per document, e.g.
+        as computed by `MinHasher.signature_matrix()`.
+
+        :param document_ids: The IDs of the documents, e.g. their `News_ID`. By
+        default, the next unused column numbers are used.
+
+        :return: The IDs of the new documents, in the same order.
+        """
+        signatures = np.asarray(signatures, dtype=np.uint64)[:, : self.nr_rows]
+        if signatures.shape[1] < self.nr_rows:
+            raise ValueError(f"The signatures should have {self.nr_rows} rows")
+
+        if document_ids is None:
+            first_id = self._next_doc_id
+            document_ids = np.arange(first_id, first_id + len(signatures))
+        else:
+            document_ids = np.asarray(document_ids, dtype=np.int64)
+            if len(document_ids) != len(signatures):
+                raise ValueError("There should be one document ID per signature")
+
+        self._pending.append((signatures, document_ids))
+        if len(document_ids) > 0:
+            self._next_doc_id = max(self._next_doc_id, int(document_ids.max()) + 1)
+        return document_ids
+
+    def add_document(
+        self, minhash_values: Iterable[int], document_id: Optional[int] = None
+    ) -> int:
+        """
+        Adds a single document, see `add_documents()`.
+
+        :param minhash_values: The document's minhash signature.
+
+        :param document_id: The ID of the document.
+
+        :return: The document's ID.
+        """
+        signature = np.asarray(minhash_values, dtype=np.uint64).reshape(1, -1)
+        document_ids = None if document_id is None else [document_id]
+        return int(self.add_documents(signature, document_ids)[0])
+
+    def index(self) -> None:
+        """
+        Indexes the pending documents, by sorting all documents again for each
+        tree.
+        """
+        if not self._pending:
+            return
+
+        self._signatures = np.vstack(
+            [self._signatures] + [signatures for signatures, _ in self._pending]
+        )
+        self._document_ids = np.concatenate(
+            [self._document_ids] + [document_ids for _, document_ids in self._pending]
+        )
+        self._pending = []
+
+        self._orders = []
+        self._sorted_rows = []
+        for tree in range(self.nr_trees):
+            rows = self._signatures[
+                :, tree * self.rows_per_tree : (tree + 1) * self.rows_per_tree
+            ]
+            # `lexsort()` sorts on the last key first
+            order = np.lexsort(rows.T[::-1])
+            self._orders.append(order)
+            self._sorted_rows.append(np.ascontiguousarray(rows[order]))
+
+    def _prefix_ranges(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        Finds the ranges of documents that share a prefix with each query, for
+        each tree and each prefix length.
+
+        :param signatures: The signatures of the queries.
+
+        :return: An `int64` array of shape `(queries, trees, rows_per_tree, 2)`
+        containing the start and end of each range, in the sorted order of the
+        tree. The range of prefix length `p` is at index `p - 1`.
+        """
+        nr_queries = len(signatures)
+        ranges = np.empty(
+            (nr_queries, self.nr_trees, self.rows_per_tree, 2), dtype=np.int64
+        )
+
+        for tree, sorted_rows in enumerate(self._sorted_rows):
+            start = np.zeros(nr_queries, dtype=np.int64)
+            end = np.full(nr_queries, len(sorted_rows), dtype=np.int64)
+            for row in range(self.rows_per_tree):
+                column = sorted_rows[:, row]
+                values = signatures[:, tree * self.rows_per_tree + row]
+                start, end = (
+                    _search(column, values, start, end, "left"),
+                    _search(column, values, start, end, "right"),
+                )
+                ranges[:, tree, row, 0] = start
+                ranges[:, tree, row, 1] = end
+
+        return ranges
+
+    def _candidates(self, ranges: np.ndarray, k: int) -> np.ndarray:
+        """
+        Gathers the candidates of a single query, starting with the longest
+        prefixes, until there are at least `k` of them.
+
+        :param ranges: The query's ranges, as returned by `_prefix_ranges()`.
+
+        :param k: The number of candidates to gather.
+
+        :return: The positions of the candidates in `self._signatures`.
+        """
+        candidates = np.empty(0, dtype=np.int64)
+        for row in range(self.rows_per_tree - 1, -1, -1):
+            candidates = np.unique(
+                np.concatenate(
+                    [
+                        order[start:end]
+                        for order, (start, end) in zip(self._orders, ranges[:, row])
+                    ]
+                )
+            )
+            if len(candidates) >= k:
+                break
+        return candidates
+
+    def query_many(
+        self, signatures: np.ndarray, k: int = 10
+    ) -> list[list[tuple[int, float]]]:
+        """
+        Finds the `k` most similar documents for several queries at once. The
+        binary searches are performed for all queries together.
+
+        :param signatures: The signatures of the queries, with one row per query.
+
+        :param k: The number of results per query.
+
+        :return: For each query, a list of at most `k` tuples `(document_id,
+        similarity)`, ordered by decreasing similarity (and then by position).
+        The similarity is estimated from the signatures' first `self.nr_rows`
+        rows, like `LSH` does with its bands. Fewer results are
+        returned if not enough documents share a prefix with the query.
+        """
+        self.index()
+        signatures = np.asarray(signatures, dtype=np.uint64)[:, : self.nr_rows]
+        if signatures.shape[1] < self.nr_rows:
+            raise ValueError(f"The signatures should have {self.nr_rows} rows")
+        if len(self._document_ids) == 0 or k <= 0:
+            return [[] for _ in signatures]
+
+        ranges = self._prefix_ranges(signatures)
+        results = []
+        for signature, query_ranges in zip(signatures, ranges):
+            candidates = self._candidates(query_ranges, k)
+            similarities = (self._signatures[candidates] == signature).mean(axis=1)
+            best = np.argsort(-similarities, kind="stable")[:k]
+            results.append(
+                list(
+                    zip(
+                        self._document_ids[candidates[best]].tolist(),
+                        similarities[best].tolist(),
+                    )
+                )
+            )
+        return results
+
+    def query(
+        self, minhash_values: Iterable[int], k: int = 10
+    ) -> list[tuple[int, float]]:
+        """
+        Finds the `k` most similar documents of a single query, see
+        `query_many()`.
+
+        :param minhash_values: The query's minhash signature.
+
+        :param k: The number of results.
+
+        :return: A list of at most `k` tuples `(document_id, similarity)`.
+        """
+        signature = np.asarray(minhash_values, dtype=np.uint64).reshape(1, -1)
+        return self.query_many(signature, k)[0]
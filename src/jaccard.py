@@ -1,21 +1,171 @@
 #!/usr/bin/env python3.9
 
-from typing import TypeVar
+from store import SignatureStore
+
+from collections.abc import Generator, Iterable
+from itertools import islice
+from typing import Optional, TypeVar, Union
+
+import metrics
+import numpy as np
 
 
 Shingle = TypeVar("Shingle")
 
 
-def jaccard(set_1: set[Shingle], set_2: set[Shingle]) -> float:
+def jaccard(
+    set_1: Union[set[Shingle], np.ndarray], set_2: Union[set[Shingle], np.ndarray]
+) -> float:
     """
     Computes the Jaccard similarity between two sets.
 
     :param set_1:
-    :param set_2: The sets for which the similarity should be computed.
+    :param set_2: The sets for which the similarity should be computed. These
+    can also be sorted arrays without duplicates, i.e. as returned by
+    `to_sorted_array()`, in which case `jaccard_sorted()` is used.
 
     :return: The Jaccard similarity, which is computed as
     `|set_1 ∩ set_2| / |set_1 ∪ set_2|`.
     """
+    if isinstance(set_1, np.ndarray) and isinstance(set_2, np.ndarray):
+        return jaccard_sorted(set_1, set_2)
     if not set_1 and not set_2:
         return 0.0
     return len(set_1 & set_2) / len(set_1 | set_2)
+
+
+def to_sorted_array(shingles: Iterable[int]) -> np.ndarray:
+    """
+    Converts a set of integer shingles to a compact representation: a sorted
+    array without duplicates. This takes 4 bytes per shingle if all of them fit
+    in 32 bits, and 8 bytes otherwise, instead of the ~60 bytes of a Python set.
+
+    :param shingles: The shingle IDs.
+
+    :return: A sorted `uint32` or `uint64` array containing each shingle once.
+    """
+    array = np.unique(np.fromiter(shingles, dtype=np.uint64))
+    if array.size == 0 or array[-1] <= np.iinfo(np.uint32).max:
+        return array.astype(np.uint32)
+    return array
+
+
+def jaccard_sorted(array_1: np.ndarray, array_2: np.ndarray) -> float:
+    """
+    Computes the Jaccard similarity between two sets that are represented as
+    sorted arrays without duplicates. The intersection is computed by a binary
+    search for each element of the smallest array in the largest one.
+
+    :param array_1:
+    :param array_2: The sorted arrays.
+
+    :return: The Jaccard similarity, with `0.0` for two empty sets.
+    """
+    if len(array_1) > len(array_2):
+        array_1, array_2 = array_2, array_1
+    if len(array_2) == 0:
+        return 0.0
+
+    positions = np.searchsorted(array_2, array_1)
+    positions[positions == len(array_2)] = 0
+    intersection = int(np.count_nonzero(array_2[positions] == array_1))
+    return intersection / (len(array_1) + len(array_2) - intersection)
+
+
+def weighted_jaccard(
+    shingles_1: np.ndarray,
+    weights_1: np.ndarray,
+    shingles_2: np.ndarray,
+    weights_2: np.ndarray,
+) -> float:
+    """
+    Computes the weighted Jaccard similarity between two weighted sets, which
+    are represented as sorted arrays without duplicates and the weight of each
+    element.
+
+    :param shingles_1:
+    :param shingles_2: The sorted arrays, e.g. as returned by
+    `HashedShingler.shingle_counts()`.
+
+    :param weights_1:
+    :param weights_2: The weights of the elements of each array.
+
+    :return: The weighted Jaccard similarity, which is computed as
+    `sum(min(w_1, w_2)) / sum(max(w_1, w_2))` over all elements, with `0.0` for
+    two empty sets.
+    """
+    _, indices_1, indices_2 = np.intersect1d(
+        shingles_1, shingles_2, assume_unique=True, return_indices=True
+    )
+    minimum = float(np.minimum(weights_1[indices_1], weights_2[indices_2]).sum())
+    maximum = float(np.sum(weights_1)) + float(np.sum(weights_2)) - minimum
+    return minimum / maximum if maximum > 0 else 0.0
+
+
+def minhash_similarity(signature_1: np.ndarray, signature_2: np.ndarray) -> float:
+    """
+    Estimates the Jaccard similarity of two documents from their full minhash
+    signatures, as the fraction of the rows in which they're equal.
+
+    :param signature_1:
+    :param signature_2: The signatures, which should have the same length.
+
+    :return: The estimated Jaccard similarity.
+    """
+    return float(np.mean(np.asarray(signature_1) == np.asarray(signature_2)))
+
+
+def verify_candidates(
+    candidates: Iterable[tuple[tuple[int, int], float]],
+    documents: Optional[list[Union[set[int], np.ndarray]]] = None,
+    signatures: Optional[Union[np.ndarray, SignatureStore]] = None,
+    min_similarity: float = 0.0,
+    batch_size: int = 10000,
+) -> Generator[tuple[tuple[int, int], float], None, None]:
+    """
+    Re-scores candidate pairs, e.g. as yielded by `LSH.candidate_pairs()`,
+    either with their exact Jaccard similarity or with the minhash estimate of
+    their full signatures, and filters them on the new score. The candidates
+    are consumed in batches, so only a single batch is in memory at any time.
+
+    :param candidates: The candidate pairs and their approximated similarity,
+    which is ignored.
+
+    :param documents: The shingle sets of the documents, indexed by document ID.
+    Sorted arrays (see `to_sorted_array()`) use far less memory than sets. If
+    given, the exact Jaccard similarity is computed.
+
+    :param signatures: The signature matrix, with one row per document ID. If
+    given (and `documents` isn't), the similarity is estimated from the
+    signatures, for a whole batch at once. The signatures can also be a compact
+    `SignatureStore`, whose estimates are corrected for its b-bit values.
+
+    :param min_similarity: The minimal similarity of the pairs that are yielded.
+
+    :param batch_size: The number of candidates that are processed at once.
+
+    :return: A generator that yields tuples `((id_1, id_2), similarity)`, in the
+    same order as the candidates.
+    """
+    if documents is None and signatures is None:
+        raise ValueError("Either the documents or the signatures are required")
+
+    candidates = iter(candidates)
+    while batch := [pair for pair, _ in islice(candidates, batch_size)]:
+        with metrics.timed("verification"):
+            if documents is not None:
+                similarities = [jaccard(documents[i], documents[j]) for i, j in batch]
+            elif isinstance(signatures, SignatureStore):
+                similarities = signatures.similarities(batch).tolist()
+            else:
+                pairs = np.array(batch, dtype=np.int64)
+                equal = signatures[pairs[:, 0]] == signatures[pairs[:, 1]]
+                similarities = equal.mean(axis=1).tolist()
+            verified = [
+                (pair, similarity)
+                for pair, similarity in zip(batch, similarities)
+                if similarity >= min_similarity
+            ]
+        metrics.count("verified_candidates", len(batch))
+        metrics.count("verified_pairs", len(verified))
+        yield from verified
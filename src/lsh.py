@@ -1,14 +1,484 @@
 #!/usr/bin/env python3.9
 
-from minhash import create_minhash
+from cluster import UnionFind
+from minhash import create_minhash, mix_bits
 from shingle import convert_shingles_to_bytes, Token
+from store import SignatureStore
 
 from datasketch import MinHash
 
-from collections.abc import Callable, Iterable
-from hashlib import sha1
-from itertools import combinations
-from typing import TypeVar, Union
+from collections import OrderedDict
+from collections.abc import Callable, Generator, Iterable, Iterator, Mapping
+from functools import partial
+from hashlib import new, sha1
+from math import ceil
+from os import makedirs, path, remove
+from typing import Optional, TypeVar, Union
+
+import json
+import metrics
+import numpy as np
+import time
+
+
+def hash_bands(signatures: np.ndarray, nr_bands: int, rows_per_band: int) -> np.ndarray:
+    """
+    Computes 64-bit hash values for all bands of a signature matrix at once. The
+    rows of a band are combined one by one, by mixing the running hash value
+    with the next row's values. This is a fast, non-cryptographic alternative
+    to hashing the bytes of each band.
+
+    :param signatures: The signature matrix, with one row per document and at
+    least `nr_bands * rows_per_band` columns.
+
+    :param nr_bands: The number of bands.
+
+    :param rows_per_band: The number of rows per band.
+
+    :return: A `uint64` array with one row per document and one column per band.
+    """
+    signatures = np.asarray(signatures, dtype=np.uint64)
+    bands = signatures[:, : nr_bands * rows_per_band].reshape(
+        len(signatures), nr_bands, rows_per_band
+    )
+
+    hash_values = np.zeros((len(signatures), nr_bands), dtype=np.uint64)
+    for row in range(rows_per_band):
+        hash_values ^= bands[:, :, row]
+        mix_bits(hash_values)
+    return hash_values
+
+
+def band_key(hash_value: Union[bytes, int]) -> int:
+    """
+    Converts a band hash to a 64-bit integer key, as used by the array-backed
+    bands.
+
+    :param hash_value: The band hash, either a digest as computed by
+    `LSH.band_hashes()`, or an integer key.
+
+    :return: The first 8 bytes of the digest as an unsigned integer, or the
+    integer key itself.
+    """
+    if isinstance(hash_value, bytes):
+        return int.from_bytes(hash_value[:8], "big")
+    return int(hash_value)
+
+
+class SortedBand(Mapping):
+    """
+    A read-only band of the LSH data structure that is stored as two arrays
+    instead of a dictionary of sets: the 64-bit keys of the documents' buckets,
+    in sorted order, and the IDs of the documents in the same order. A bucket is
+    thus a contiguous range of both arrays, which is found by binary search.
+    Since the arrays can be memory-mapped, a band doesn't have to be loaded into
+    memory before it can be used.
+    """
+
+    # The bucket keys of the documents, sorted in increasing order
+    keys: np.ndarray
+    # The document IDs, ordered by their bucket keys
+    document_ids: np.ndarray
+
+    def __init__(self, keys: np.ndarray, document_ids: np.ndarray) -> None:
+        """
+        Initialises the band.
+
+        :param keys: The (sorted) bucket keys, as a `uint64` array.
+
+        :param document_ids: The document IDs, in the same order as the keys.
+        """
+        self.keys = keys
+        self.document_ids = document_ids
+
+    def _bucket(self, hash_value: Union[bytes, int]) -> np.ndarray:
+        """
+        Looks up the document IDs of a bucket.
+
+        :param hash_value: The band hash of the bucket.
+
+        :return: The document IDs in the bucket, which is empty if the bucket
+        doesn't exist.
+        """
+        key = np.uint64(band_key(hash_value))
+        start = np.searchsorted(self.keys, key, "left")
+        end = np.searchsorted(self.keys, key, "right")
+        return self.document_ids[start:end]
+
+    def __getitem__(self, hash_value: Union[bytes, int]) -> set[int]:
+        document_ids = self._bucket(hash_value)
+        if len(document_ids) == 0:
+            raise KeyError(hash_value)
+        return set(document_ids.tolist())
+
+    def __contains__(self, hash_value: object) -> bool:
+        return len(self._bucket(hash_value)) > 0
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(np.unique(self.keys).tolist())
+
+    def __len__(self) -> int:
+        return len(np.unique(self.keys))
+
+    def _boundaries(self) -> np.ndarray:
+        """
+        Returns the indices at which a new bucket starts, excluding the first.
+        """
+        return np.flatnonzero(self.keys[1:] != self.keys[:-1]) + 1
+
+    def values(self) -> Generator[set[int], None, None]:
+        for document_ids in np.split(np.asarray(self.document_ids), self._boundaries()):
+            if len(document_ids) > 0:
+                yield set(document_ids.tolist())
+
+    def items(self) -> Generator[tuple[int, set[int]], None, None]:
+        if len(self.keys) == 0:
+            return
+        starts = np.concatenate(([0], self._boundaries()))
+        yield from zip(self.keys[starts].tolist(), self.values())
+
+    def add(self, hash_value: Union[bytes, int], document_id: int) -> None:
+        """
+        Adds a document to a bucket, which isn't supported by this class.
+
+        :raise TypeError: Always, since the band is read-only.
+        """
+        raise TypeError("Documents can't be added to a read-only band")
+
+    def add_many(
+        self, hash_values: Iterable[Union[bytes, int]], document_ids: np.ndarray
+    ) -> None:
+        """
+        Adds several documents, which isn't supported by this class.
+
+        :raise TypeError: Always, since the band is read-only.
+        """
+        raise TypeError("Documents can't be added to a read-only band")
+
+
+class ArrayBand(SortedBand):
+    """
+    A band that stores its buckets in sorted arrays, like a `SortedBand`, but
+    to which documents can be added. New documents are first collected in a
+    small dictionary, which is sorted and merged into the arrays once it has
+    grown to a fraction of their size. Adding a document thus takes
+    amortised logarithmic time, while most of the memory is used by the arrays,
+    i.e. 16 bytes per document.
+    """
+
+    # The minimal number of pending documents before they're merged
+    MIN_PENDING = 1024
+
+    # The bucket keys and document IDs that haven't been merged yet
+    _pending: dict[int, list[int]]
+    # The number of document IDs in `_pending`
+    _nr_pending: int
+
+    def __init__(self) -> None:
+        """
+        Initialises an empty band.
+        """
+        super().__init__(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64))
+        self._pending = {}
+        self._nr_pending = 0
+
+    def _max_pending(self) -> int:
+        """
+        Returns the number of pending documents at which they're merged.
+        """
+        return max(self.MIN_PENDING, len(self.keys) // 8)
+
+    def add(self, hash_value: Union[bytes, int], document_id: int) -> None:
+        """
+        Adds a document to a bucket.
+
+        :param hash_value: The band hash of the bucket.
+
+        :param document_id: The ID of the document.
+        """
+        key = band_key(hash_value)
+        if key not in self._pending:
+            self._pending[key] = [document_id]
+        else:
+            self._pending[key].append(document_id)
+
+        self._nr_pending += 1
+        if self._nr_pending >= self._max_pending():
+            self.merge()
+
+    def add_many(
+        self, hash_values: Iterable[Union[bytes, int]], document_ids: np.ndarray
+    ) -> None:
+        """
+        Adds several documents to their buckets at once. Small batches are added
+        to the pending documents, like `add()`, while larger ones are merged
+        into the arrays together with the pending documents.
+
+        :param hash_values: The band hashes of the documents' buckets, e.g. a
+        `uint64` array of keys.
+
+        :param document_ids: The IDs of the documents, in the same order.
+        """
+        if isinstance(hash_values, np.ndarray) and hash_values.dtype == np.uint64:
+            keys = hash_values
+        else:
+            keys = np.fromiter((band_key(value) for value in hash_values), np.uint64)
+        document_ids = np.asarray(document_ids, dtype=np.int64)
+
+        if self._nr_pending + len(keys) < self._max_pending():
+            for key, document_id in zip(keys.tolist(), document_ids.tolist()):
+                if key not in self._pending:
+                    self._pending[key] = [document_id]
+                else:
+                    self._pending[key].append(document_id)
+            self._nr_pending += len(keys)
+            return
+
+        pending_keys, pending_document_ids = self._pending_arrays()
+        self._insert(
+            np.concatenate((pending_keys, keys)),
+            np.concatenate((pending_document_ids, document_ids)),
+        )
+
+    def _pending_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Removes the pending documents, and returns them as arrays.
+
+        :return: A tuple containing the bucket keys and the document IDs.
+        """
+        keys = np.empty(self._nr_pending, dtype=np.uint64)
+        document_ids = np.empty(self._nr_pending, dtype=np.int64)
+        position = 0
+        for key, bucket in self._pending.items():
+            keys[position : position + len(bucket)] = key
+            document_ids[position : position + len(bucket)] = bucket
+            position += len(bucket)
+
+        self._pending = {}
+        self._nr_pending = 0
+        return keys, document_ids
+
+    def _insert(self, keys: np.ndarray, document_ids: np.ndarray) -> None:
+        """
+        Inserts documents into the sorted arrays. Only the new documents are
+        sorted; they are then merged into the arrays in linear time.
+
+        :param keys: The bucket keys of the documents.
+
+        :param document_ids: The IDs of the documents, in the same order.
+        """
+        order = np.lexsort((document_ids, keys))
+        keys = keys[order]
+        positions = np.searchsorted(self.keys, keys, "right")
+        self.keys = np.insert(self.keys, positions, keys)
+        self.document_ids = np.insert(self.document_ids, positions, document_ids[order])
+
+    def merge(self) -> None:
+        """
+        Merges the pending documents into the sorted arrays.
+        """
+        if self._pending:
+            self._insert(*self._pending_arrays())
+
+    def _bucket(self, hash_value: Union[bytes, int]) -> np.ndarray:
+        document_ids = super()._bucket(hash_value)
+        pending = self._pending.get(band_key(hash_value))
+        if pending:
+            document_ids = np.concatenate((document_ids, pending))
+        return document_ids
+
+    def __iter__(self) -> Iterator[int]:
+        self.merge()
+        return super().__iter__()
+
+    def __len__(self) -> int:
+        self.merge()
+        return super().__len__()
+
+    def values(self) -> Generator[set[int], None, None]:
+        self.merge()
+        return super().values()
+
+    def items(self) -> Generator[tuple[int, set[int]], None, None]:
+        self.merge()
+        return super().items()
+
+
+def collision_probability(
+    similarity: Union[float, np.ndarray],
+    nr_bands: int,
+    rows_per_band: int,
+    probes: int = 0,
+) -> Union[float, np.ndarray]:
+    """
+    Computes the probability that two documents share a bucket in at least one
+    band, i.e. the S-curve `1 - (1 - s^r)^b`.
+
+    :param similarity: The Jaccard similarity `s` of the documents.
+
+    :param nr_bands: The number of bands `b`.
+
+    :param rows_per_band: The number of rows per band `r`.
+
+    :param probes: The number of rows `k` of each band that may differ, as in a
+    `MultiProbeLSH`. The probability that a band matches is then
+    `s^r + k * s^(r - 1) * (1 - s)` instead of `s^r`.
+
+    :return: The probability that the documents are a candidate pair.
+    """
+    band_probability = similarity ** rows_per_band
+    if probes > 0:
+        band_probability = band_probability + min(probes, rows_per_band) * (
+            similarity ** (rows_per_band - 1) * (1 - similarity)
+        )
+    return 1 - (1 - band_probability) ** nr_bands
+
+
+def _similarity_density(
+    similarities: np.ndarray, histogram: Optional[list[int]]
+) -> np.ndarray:
+    """
+    Computes the density of the pairs' similarities, either uniformly or from
+    histogram data.
+
+    :param similarities: The similarities at which the density is computed.
+
+    :param histogram: The counts of each bar, i.e. as returned by
+    `main.generate_histogram()`, or `None` for a uniform distribution.
+
+    :return: The density at each of the similarities.
+    """
+    if histogram is None:
+        return np.ones_like(similarities)
+
+    counts = np.asarray(histogram, dtype=np.float64)
+    bars = np.minimum((len(counts) * similarities).astype(np.int64), len(counts) - 1)
+    return counts[bars] * len(counts) / counts.sum()
+
+
+def error_probabilities(
+    threshold: float,
+    nr_bands: int,
+    rows_per_band: int,
+    histogram: Optional[list[int]] = None,
+    probes: int = 0,
+    nr_steps: int = 1000,
+) -> tuple[float, float]:
+    """
+    Computes the probabilities of false positives and false negatives, by
+    integrating the S-curve below and above the threshold.
+
+    :param threshold: The similarity threshold; pairs with a similarity of at
+    least this value should be candidates.
+
+    :param nr_bands: The number of bands.
+
+    :param rows_per_band: The number of rows per band.
+
+    :param histogram: The histogram of the pairs' similarities, as returned by
+    `main.generate_histogram()`, which weighs the similarities by how common
+    they are. By default, all similarities are equally likely.
+
+    :param probes: The number of probed rows per band, see
+    `collision_probability()`.
+
+    :param nr_steps: The number of steps of the numerical integration.
+
+    :return: A tuple containing the (weighted) areas of the false positives,
+    i.e. under the S-curve below the threshold, and of the false negatives,
+    i.e. above the S-curve above the threshold.
+    """
+    # The midpoints of `nr_steps` equally wide steps on both sides
+    below = (np.arange(nr_steps) + 0.5) * threshold / nr_steps
+    above = threshold + (np.arange(nr_steps) + 0.5) * (1 - threshold) / nr_steps
+
+    probability = collision_probability(below, nr_bands, rows_per_band, probes)
+    false_positives = np.sum(probability * _similarity_density(below, histogram))
+    probability = collision_probability(above, nr_bands, rows_per_band, probes)
+    false_negatives = np.sum((1 - probability) * _similarity_density(above, histogram))
+
+    return (
+        float(false_positives * threshold / nr_steps),
+        float(false_negatives * (1 - threshold) / nr_steps),
+    )
+
+
+def optimal_parameters(
+    threshold: float,
+    false_positive_weight: float = 0.5,
+    false_negative_weight: float = 0.5,
+    max_permutations: int = 128,
+    histogram: Optional[list[int]] = None,
+    max_false_positives: Optional[float] = None,
+    max_false_negatives: Optional[float] = None,
+    probes: int = 0,
+) -> tuple[int, int]:
+    """
+    Chooses the number of bands and rows per band for a similarity threshold,
+    by minimising the weighted sum of the false positive and false negative
+    probabilities (see `error_probabilities()`). These assume that a pair is a
+    candidate as soon as it shares a bucket in any band, so the candidates
+    should be `candidate_pairs(0.0)`, re-scored by `verify_candidates()`.
+    Filtering them on the fraction of shared bands instead (i.e. with
+    `candidate_pairs(threshold)`) misses most similar pairs, since few bands of
+    many rows rarely agree.
+
+    :param threshold: The similarity threshold.
+
+    :param false_positive_weight:
+    :param false_negative_weight: The weights of both kinds of errors.
+
+    :param max_permutations: The maximal number of permutations, i.e. of
+    `nr_bands * rows_per_band`.
+
+    :param histogram: The histogram of the pairs' similarities, e.g. of a sample
+    of the documents, as returned by `main.generate_histogram()`. This
+    calibrates the error probabilities to the actual data.
+
+    :param max_false_positives:
+    :param max_false_negatives: If either is given, the cheapest parameters
+    (i.e. with the fewest permutations) whose error probabilities are at most
+    these values are chosen instead, using the weighted error to break ties. If
+    no parameters meet these goals, the weighted error is minimised.
+
+    :param probes: The number of probed rows per band of a `MultiProbeLSH`.
+    More probes reach the same recall with fewer permutations, at the cost of
+    more buckets per document. The bands then have more rows than probes.
+
+    :return: A tuple `(nr_bands, rows_per_band)`.
+    """
+    has_goals = max_false_positives is not None or max_false_negatives is not None
+    best_cost = None
+    best_parameters = (1, probes + 1)
+    meets_goals = False
+
+    for nr_bands in range(1, max_permutations + 1):
+        for rows_per_band in range(probes + 1, max_permutations // nr_bands + 1):
+            false_positives, false_negatives = error_probabilities(
+                threshold, nr_bands, rows_per_band, histogram, probes
+            )
+            error = (
+                false_positive_weight * false_positives
+                + false_negative_weight * false_negatives
+            )
+
+            if has_goals and (
+                (max_false_positives is None or false_positives <= max_false_positives)
+                and (
+                    max_false_negatives is None
+                    or false_negatives <= max_false_negatives
+                )
+            ):
+                cost = (nr_bands * rows_per_band, error)
+                if not meets_goals or cost < best_cost:
+                    meets_goals = True
+                    best_cost = cost
+                    best_parameters = (nr_bands, rows_per_band)
+            elif not meets_goals and (best_cost is None or error < best_cost[1]):
+                best_cost = (nr_bands * rows_per_band, error)
+                best_parameters = (nr_bands, rows_per_band)
+
+    return best_parameters
 
 
 class LSH:
@@ -22,14 +492,24 @@ class LSH:
 
     nr_bands: int
     rows_per_band: int
-    bands: list[dict[bytes, int]]
+    bands: list[Mapping[bytes, set[int]]]
     hash_function: Callable[[bytes], bytes]
+    fast_hashing: bool
+
+    # The band hashes of each document, in order of addition, if the documents
+    # can be removed (see `remove_document()`)
+    _document_hashes: Optional[OrderedDict[int, Union[list, np.ndarray]]]
+    # The time at which each document was added, in the same order
+    _timestamps: Optional[OrderedDict[int, float]]
 
     def __init__(
         self,
         nr_bands: int,
         rows_per_band: int,
         hash_function: Callable[[bytes], bytes] = sha1,
+        storage: str = "dict",
+        fast_hashing: bool = False,
+        removable: bool = False,
     ) -> None:
         """
         Initialises the data structure.
@@ -41,12 +521,86 @@ class LSH:
         `nr_bands` the number of rows of the matrix M can be determined.
 
         :param hash_function: The hash function that is used in the algorithm.
+
+        :param storage: How the buckets of each band are stored. With `"dict"`,
+        each band is a dictionary that maps band hashes to sets of document IDs.
+        With `"array"`, each band is an `ArrayBand`, which stores 64-bit keys
+        and document IDs in sorted arrays and uses far less memory per document.
+        Both give the same query results.
+
+        :param fast_hashing: Whether the bands are hashed with the vectorised
+        64-bit `hash_bands()` function instead of `hash_function`. This is much
+        faster, especially when adding many documents with `add_documents()`,
+        and gives the same query results except for (rare) hash collisions.
+
+        :param removable: Whether the documents can be removed again, with
+        `remove_document()` or `evict()`. The band hashes of each document are
+        then kept, so that it can be removed from its buckets without visiting
+        any others. This requires the `"dict"` storage.
         """
         self.nr_bands = nr_bands
         self.rows_per_band = rows_per_band
-        self.bands = [{} for _ in range(nr_bands * rows_per_band)]
+        if removable and storage != "dict":
+            raise ValueError("Only documents in dict storage can be removed")
+        if storage == "dict":
+            self.bands = [{} for _ in range(nr_bands)]
+        elif storage == "array":
+            self.bands = [ArrayBand() for _ in range(nr_bands)]
+        else:
+            raise ValueError(f"Unknown storage type: {storage}")
         self.hash_function = hash_function
+        self.fast_hashing = fast_hashing
         self._next_doc_id = 0
+        self._document_hashes = OrderedDict() if removable else None
+        self._timestamps = OrderedDict() if removable else None
+
+    @classmethod
+    def from_threshold(
+        cls,
+        threshold: float,
+        max_permutations: int = 128,
+        false_positive_weight: float = 0.5,
+        false_negative_weight: float = 0.5,
+        histogram: Optional[list[int]] = None,
+        max_false_positives: Optional[float] = None,
+        max_false_negatives: Optional[float] = None,
+        **kwargs,
+    ) -> "LSH":
+        """
+        Creates a data structure whose number of bands and rows per band are
+        chosen for a similarity threshold by `optimal_parameters()`. The number
+        of permutations of the signatures should then be `lsh.nr_rows`.
+
+        :param threshold: The similarity threshold.
+
+        :param max_permutations: The maximal number of permutations.
+
+        :param false_positive_weight:
+        :param false_negative_weight: The weights of both kinds of errors.
+
+        :param histogram: The histogram to calibrate the error probabilities.
+
+        :param max_false_positives:
+        :param max_false_negatives: The error probabilities to meet with as few
+        permutations as possible, see `optimal_parameters()`.
+
+        :param kwargs: The other arguments of `LSH.__init__()`, including the
+        number of `probes` of a `MultiProbeLSH`, which is taken into account
+        when choosing the parameters.
+
+        :return: The new data structure.
+        """
+        nr_bands, rows_per_band = optimal_parameters(
+            threshold,
+            false_positive_weight,
+            false_negative_weight,
+            max_permutations,
+            histogram,
+            max_false_positives,
+            max_false_negatives,
+            kwargs.get("probes", 0),
+        )
+        return cls(nr_bands, rows_per_band, **kwargs)
 
     @property
     def nr_rows(self) -> int:
@@ -55,7 +609,57 @@ class LSH:
         """
         return self.nr_bands * self.rows_per_band
 
-    def add_document(self, minhash_values: Iterable[int]) -> int:
+    @property
+    def removable(self) -> bool:
+        """
+        Returns whether the documents can be removed, see `__init__()`.
+        """
+        return self._document_hashes is not None
+
+    def band_hashes(self, minhash_values: Iterable[int]) -> list[Union[bytes, int]]:
+        """
+        Computes the hash values of each band of a document's signature. These
+        are the keys of the buckets the document belongs to.
+
+        :param minhash_values: The hash values computed by the minhash
+        algorithm, i.e. a single column of the signature matrix M.
+
+        :return: A list of `self.nr_bands` hash values, one for each band. These
+        are digests of `self.hash_function`, or integers if `self.fast_hashing`
+        is set.
+        """
+        if self.fast_hashing:
+            signature = np.asarray(minhash_values, dtype=np.uint64)
+            return self._hash_signatures(signature.reshape(1, -1))[0].tolist()
+
+        hash_values = []
+        for band in range(self.nr_bands):
+            values = minhash_values[
+                self.rows_per_band * band : self.rows_per_band * (band + 1)
+            ]
+
+            byte_string = b"".join(int(value).to_bytes(8, "big") for value in values)
+            hash_values.append(self.hash_function(byte_string).digest())
+        return hash_values
+
+    def _hash_signatures(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        Computes the 64-bit band hashes of several documents, as used when
+        `self.fast_hashing` is set.
+
+        :param signatures: The signature matrix, with one row per document.
+
+        :return: A `uint64` array with one row per document, and one column per
+        element of `self.bands`.
+        """
+        return hash_bands(signatures, self.nr_bands, self.rows_per_band)
+
+    def add_document(
+        self,
+        minhash_values: Iterable[int],
+        document_id: Optional[int] = None,
+        timestamp: Optional[float] = None,
+    ) -> int:
         """
         Adds a document to the matrix as a column. This function will compute
         the `self.nr_bands` hashes, one for each band, and add them to the end
@@ -66,44 +670,880 @@ class LSH:
         Calls to this function of the same object should have hash values of the
         same minhash object/algorithm as well.
 
-        :return: The document's ID within the LSH data structure. This is simply
-        the column number (starting with 0) that contains the document's
-        signature.
+        :param document_id: The ID of the document, e.g. its `News_ID`. By
+        default, the next unused column number is used. If the documents are
+        removable, a document that is added again replaces the old one.
+
+        :param timestamp: The time at which the document was added, for
+        `evict()`. By default, the current time is used.
+
+        :return: The document's ID within the LSH data structure. Unless given,
+        this is simply the column number (starting with 0) that contains the
+        document's signature.
         """
-        document_id = self._next_doc_id
-        self._next_doc_id += 1
+        return self._add_band_hashes(
+            self.band_hashes(minhash_values), document_id, timestamp
+        )
 
-        for band in range(self.nr_bands):
-            values = minhash_values[
-                self.rows_per_band * band : self.rows_per_band * (band + 1)
-            ]
+    def add_documents(
+        self,
+        signatures: np.ndarray,
+        document_ids: Optional[Iterable[int]] = None,
+        timestamp: Optional[float] = None,
+    ) -> Union[range, np.ndarray]:
+        """
+        Adds several documents at once. With `self.fast_hashing` set, all bands
+        of all documents are hashed in one vectorised operation, and with array
+        storage, each band is sorted only once.
 
-            byte_string = b"".join(int(value).to_bytes(8, "big") for value in values)
-            hash_value = self.hash_function(byte_string).digest()
+        :param signatures: The signature matrix, with one row per document.
+
+        :param document_ids: The IDs of the documents, e.g. the `News_ID` column
+        of a batch of `main.read_csv_batches()`. By default, the next unused
+        column numbers are used. If the documents are removable, a repeated ID
+        replaces the earlier documents with that ID, as separate calls would.
+
+        :param timestamp: The time at which the documents were added, see
+        `add_document()`.
+
+        :return: The IDs of the new documents, in the same order: a range of
+        column numbers, or the given IDs as an array.
+        """
+        first_id = self._next_doc_id
+        if document_ids is None:
+            result = range(first_id, first_id + len(signatures))
+            document_ids = np.arange(first_id, first_id + len(signatures))
+        else:
+            document_ids = result = np.asarray(document_ids, dtype=np.int64)
+            if len(document_ids) != len(signatures):
+                raise ValueError("There should be one document ID per signature")
+
+            if self._document_hashes is not None:
+                # Only the last document with each ID is kept
+                _, last = np.unique(document_ids[::-1], return_index=True)
+                if len(last) < len(document_ids):
+                    keep = np.sort(len(document_ids) - 1 - last)
+                    signatures = np.asarray(signatures)[keep]
+                    document_ids = document_ids[keep]
+
+        with metrics.timed("index"):
+            if self.fast_hashing:
+                hash_values = self._hash_signatures(signatures).T
+            else:
+                hash_values = list(
+                    zip(*(self.band_hashes(signature) for signature in signatures))
+                )
+
+            if self._document_hashes is not None:
+                self._remember_documents(
+                    document_ids.tolist(),
+                    # Copied, so that each can be freed on its own
+                    [row.copy() for row in hash_values.T]
+                    if self.fast_hashing
+                    else list(zip(*hash_values)),
+                    timestamp,
+                )
+
+            for band, band_hash_values in zip(self.bands, hash_values):
+                if not isinstance(band, dict):
+                    band.add_many(band_hash_values, document_ids)
+                    continue
 
-            band_dict = self.bands[band]
-            if hash_value not in band_dict:
-                band_dict[hash_value] = {document_id}
+                if isinstance(band_hash_values, np.ndarray):
+                    band_hash_values = band_hash_values.tolist()
+                for hash_value, document_id in zip(
+                    band_hash_values, document_ids.tolist()
+                ):
+                    if hash_value not in band:
+                        band[hash_value] = {document_id}
+                    else:
+                        band[hash_value].add(document_id)
+        metrics.count("indexed_documents", len(document_ids))
+
+        if len(document_ids) > 0:
+            self._next_doc_id = max(self._next_doc_id, int(document_ids.max()) + 1)
+        return result
+
+    def _add_band_hashes(
+        self,
+        hash_values: list[Union[bytes, int]],
+        document_id: Optional[int] = None,
+        timestamp: Optional[float] = None,
+    ) -> int:
+        """
+        Adds a document to the buckets of its band hashes.
+
+        :param hash_values: The document's band hashes, i.e. as returned by
+        `band_hashes()`.
+
+        :param document_id: The ID of the document, by default the next unused
+        column number.
+
+        :param timestamp: The time at which the document was added.
+
+        :return: The document's ID within the LSH data structure.
+        """
+        if document_id is None:
+            document_id = self._next_doc_id
+        if self._document_hashes is not None:
+            self._remember_documents([document_id], [hash_values], timestamp)
+
+        for band, hash_value in zip(self.bands, hash_values):
+            if not isinstance(band, dict):
+                band.add(hash_value, document_id)
+            elif hash_value not in band:
+                band[hash_value] = {document_id}
             else:
-                band_dict[hash_value].add(document_id)
+                band[hash_value].add(document_id)
 
+        self._next_doc_id = max(self._next_doc_id, document_id + 1)
+        metrics.count("indexed_documents")
         return document_id
 
+    def _remember_documents(
+        self,
+        document_ids: list[int],
+        hash_values: Iterable[Union[list, np.ndarray]],
+        timestamp: Optional[float],
+    ) -> None:
+        """
+        Keeps the band hashes of new documents, so that they can be removed
+        again. Documents with the same IDs are removed first.
+
+        :param document_ids: The IDs of the new documents.
+
+        :param hash_values: The band hashes of each new document.
+
+        :param timestamp: The time at which the documents were added, by
+        default the current time.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        for document_id, document_hashes in zip(document_ids, hash_values):
+            if document_id in self._document_hashes:
+                self.remove_document(document_id)
+            self._document_hashes[document_id] = document_hashes
+            self._timestamps[document_id] = timestamp
+
+    def remove_document(self, document_id: int) -> bool:
+        """
+        Removes a document from its buckets, and removes the buckets that become
+        empty. Only the document's own buckets are visited, so this takes
+        `O(b)` time. The IDs of removed documents aren't reused by default.
+
+        :param document_id: The ID of the document.
+
+        :return: Whether the document was indexed.
+        """
+        if self._document_hashes is None:
+            raise ValueError("The documents aren't removable, see `removable`")
+
+        hash_values = self._document_hashes.pop(document_id, None)
+        if hash_values is None:
+            return False
+        del self._timestamps[document_id]
+
+        if isinstance(hash_values, np.ndarray):
+            hash_values = hash_values.tolist()
+        for band, hash_value in zip(self.bands, hash_values):
+            bucket = band.get(hash_value)
+            if bucket is None:
+                continue
+            bucket.discard(document_id)
+            if not bucket:
+                del band[hash_value]
+
+        metrics.count("removed_documents")
+        return True
+
+    def evict(
+        self,
+        max_documents: Optional[int] = None,
+        max_age: Optional[float] = None,
+        now: Optional[float] = None,
+    ) -> list[int]:
+        """
+        Removes the oldest documents, to keep a sliding window of documents.
+        The documents are removed in order of addition, so each call only
+        visits the documents that are removed.
+
+        :param max_documents: If given, the oldest documents are removed until
+        at most this many remain.
+
+        :param max_age: If given, the documents that were added more than this
+        many seconds before `now` are removed. Documents that were added with
+        an earlier timestamp than a previous document are only removed after
+        the previous one.
+
+        :param now: The current time, by default `time.time()`.
+
+        :return: The IDs of the removed documents, oldest first.
+        """
+        if self._timestamps is None:
+            raise ValueError("The documents aren't removable, see `removable`")
+        if now is None:
+            now = time.time()
+
+        removed = []
+        for document_id, timestamp in self._timestamps.items():
+            too_many = max_documents is not None and (
+                len(self._timestamps) - len(removed) > max_documents
+            )
+            too_old = max_age is not None and timestamp < now - max_age
+            if not too_many and not too_old:
+                break
+            removed.append(document_id)
+
+        for document_id in removed:
+            self.remove_document(document_id)
+        return removed
+
+    def query_document(
+        self,
+        minhash_values: Iterable[int],
+        min_similarity: float = 0.0,
+        max_bucket_size: Optional[int] = None,
+    ) -> dict[int, float]:
+        """
+        Finds the indexed documents that are similar to a new document, without
+        adding it. Only the document's own buckets are visited, so the cost
+        depends on the sizes of those buckets rather than on the number of
+        indexed documents.
+
+        :param minhash_values: The new document's minhash signature.
+
+        :param min_similarity: The minimal approximated Jaccard similarity of
+        the documents that are returned.
+
+        :param max_bucket_size: If given, the buckets with more documents than
+        this are ignored (see `candidate_pairs()`).
+
+        :return: A mapping of the IDs of the similar documents to their
+        approximated Jaccard similarity with the new document.
+        """
+        matches = self._query_band_hashes(
+            self.band_hashes(minhash_values), min_similarity, max_bucket_size
+        )
+        metrics.count("queries")
+        metrics.count("query_matches", len(matches))
+        return matches
+
+    def _query_band_hashes(
+        self,
+        hash_values: list[bytes],
+        min_similarity: float,
+        max_bucket_size: Optional[int],
+    ) -> dict[int, float]:
+        """
+        Counts the documents in the buckets of a list of band hashes.
+
+        :param hash_values: The band hashes, i.e. as returned by `band_hashes()`.
+
+        :param min_similarity: The minimal approximated Jaccard similarity.
+
+        :param max_bucket_size: The size above which buckets are ignored.
+
+        :return: A mapping of document IDs to their approximated similarities.
+        """
+        min_count = self.min_band_count(min_similarity)
+
+        counts = {}
+        for band_dict, hash_value in zip(self.bands, hash_values):
+            document_ids = band_dict.get(hash_value)
+            if not document_ids:
+                continue
+            if max_bucket_size is not None and len(document_ids) > max_bucket_size:
+                continue
+            for document_id in document_ids:
+                if document_id in counts:
+                    counts[document_id] += 1
+                else:
+                    counts[document_id] = 1
+
+        return {
+            document_id: count / self.nr_bands
+            for document_id, count in counts.items()
+            if count >= min_count
+        }
+
+    def add_and_query(
+        self,
+        minhash_values: Iterable[int],
+        min_similarity: float = 0.0,
+        max_bucket_size: Optional[int] = None,
+        document_id: Optional[int] = None,
+        timestamp: Optional[float] = None,
+    ) -> tuple[int, dict[int, float]]:
+        """
+        Finds the indexed documents that are similar to a new document, and then
+        adds the new document. The band hashes are only computed once.
+
+        :param minhash_values: The new document's minhash signature.
+
+        :param min_similarity: The minimal approximated Jaccard similarity of
+        the documents that are returned.
+
+        :param max_bucket_size: If given, the buckets with more documents than
+        this are ignored (see `candidate_pairs()`).
+
+        :param document_id:
+        :param timestamp: The ID of the new document and the time at which it
+        was added, see `add_document()`.
+
+        :return: A tuple containing the new document's ID, and the mapping of
+        similar documents as returned by `query_document()`. The new document
+        itself is not part of this mapping.
+        """
+        hash_values = self.band_hashes(minhash_values)
+        matches = self._query_band_hashes(hash_values, min_similarity, max_bucket_size)
+        metrics.count("queries")
+        metrics.count("query_matches", len(matches))
+        return self._add_band_hashes(hash_values, document_id, timestamp), matches
+
+    def save(
+        self,
+        directory: str,
+        signatures: Optional[Union[np.ndarray, SignatureStore]] = None,
+    ) -> None:
+        """
+        Writes the data structure to a directory, so that it can be loaded with
+        `LSH.load()`. Each band is converted to the arrays of a `SortedBand`,
+        and all of the bands are stored in two NumPy files, which can be
+        memory-mapped when loading.
+
+        :param directory: The directory to write to; it is created if it
+        doesn't exist yet. Existing files are overwritten, and signatures that
+        were saved before are removed if none are given.
+
+        :param signatures: The signature matrix of the documents, which is
+        stored alongside the bands if given. It can be loaded again with
+        `LSH.load_signatures()`. A `SignatureStore` is stored in its packed
+        form, with its number of bits.
+        """
+        makedirs(directory, exist_ok=True)
+
+        nr_documents = sum(len(ids) for ids in self.bands[0].values())
+        keys = np.empty((len(self.bands), nr_documents), dtype=np.uint64)
+        document_ids = np.empty((len(self.bands), nr_documents), dtype=np.int64)
+
+        for index, band in enumerate(self.bands):
+            position = 0
+            for hash_value, bucket in band.items():
+                keys[index, position : position + len(bucket)] = band_key(hash_value)
+                document_ids[index, position : position + len(bucket)] = list(bucket)
+                position += len(bucket)
+
+            order = np.lexsort((document_ids[index], keys[index]))
+            keys[index] = keys[index, order]
+            document_ids[index] = document_ids[index, order]
+
+        np.save(path.join(directory, "band_keys.npy"), keys)
+        np.save(path.join(directory, "band_document_ids.npy"), document_ids)
+        signature_bits = None
+        if isinstance(signatures, SignatureStore):
+            np.save(path.join(directory, "signatures.npy"), signatures.packed)
+            signature_bits = signatures.bits
+        elif signatures is not None:
+            np.save(path.join(directory, "signatures.npy"), signatures)
+        elif path.exists(path.join(directory, "signatures.npy")):
+            remove(path.join(directory, "signatures.npy"))
+
+        parameters = {
+            "nr_bands": self.nr_bands,
+            "rows_per_band": self.rows_per_band,
+            "next_document_id": self._next_doc_id,
+            "hash_function": getattr(self.hash_function(b""), "name", None),
+            "fast_hashing": self.fast_hashing,
+            "signature_bits": signature_bits,
+            "nr_permutations": getattr(signatures, "nr_permutations", None),
+        }
+        with open(path.join(directory, "parameters.json"), "w") as parameter_file:
+            json.dump(parameters, parameter_file)
+
+    @classmethod
+    def load(
+        cls,
+        directory: str,
+        hash_function: Optional[Callable[[bytes], bytes]] = None,
+        mmap_mode: Optional[str] = "r",
+    ) -> "LSH":
+        """
+        Loads a data structure that was written by `LSH.save()`. The bands are
+        `SortedBand` objects, so the loaded data structure can be queried
+        (e.g. with `query_document()` or `candidate_pairs()`), but no new
+        documents can be added to it.
+
+        :param directory: The directory the data structure was saved to.
+
+        :param hash_function: The hash function used by the saved data
+        structure. By default, the `hashlib` function with the saved name is
+        used. A custom function without a name has to be given again, unless
+        the data structure uses `fast_hashing`.
+
+        :param mmap_mode: The mode in which the arrays are memory-mapped, see
+        `numpy.load()`. With the default read-only mode, several processes can
+        share the same data. If `None`, the arrays are read into memory.
+
+        :return: The loaded data structure.
+        """
+        with open(path.join(directory, "parameters.json")) as parameter_file:
+            parameters = json.load(parameter_file)
+
+        if hash_function is None:
+            if parameters["hash_function"] is not None:
+                hash_function = partial(new, parameters["hash_function"])
+            elif parameters["fast_hashing"]:
+                # The hash function isn't used for the band hashes
+                hash_function = sha1
+            else:
+                raise ValueError(
+                    "The saved hash function has no name; pass it as the "
+                    "`hash_function` argument"
+                )
+
+        lsh = cls(
+            parameters["nr_bands"],
+            parameters["rows_per_band"],
+            hash_function,
+            fast_hashing=parameters["fast_hashing"],
+        )
+        lsh._next_doc_id = parameters["next_document_id"]
+
+        keys = np.load(path.join(directory, "band_keys.npy"), mmap_mode)
+        document_ids = np.load(path.join(directory, "band_document_ids.npy"), mmap_mode)
+        lsh.bands = [
+            SortedBand(band_keys, band_document_ids)
+            for band_keys, band_document_ids in zip(keys, document_ids)
+        ]
+        return lsh
+
+    @staticmethod
+    def load_signatures(
+        directory: str, mmap_mode: Optional[str] = "r"
+    ) -> Optional[Union[np.ndarray, SignatureStore]]:
+        """
+        Loads the signature matrix that was written by `LSH.save()`.
+
+        :param directory: The directory the data structure was saved to.
+
+        :param mmap_mode: The mode in which the matrix is memory-mapped, see
+        `numpy.load()`.
+
+        :return: The signature matrix, a `SignatureStore` if one was saved, or
+        `None` if neither was saved.
+        """
+        filename = path.join(directory, "signatures.npy")
+        if not path.exists(filename):
+            return None
+        signatures = np.load(filename, mmap_mode)
+
+        with open(path.join(directory, "parameters.json")) as parameter_file:
+            parameters = json.load(parameter_file)
+        if parameters.get("signature_bits") is None:
+            return signatures
+        return SignatureStore.from_packed(
+            parameters["nr_permutations"], parameters["signature_bits"], signatures
+        )
+
+    def min_band_count(self, min_similarity: float) -> int:
+        """
+        Returns the number of bands two documents should share a bucket in for
+        their approximated similarity to be at least `min_similarity`.
+
+        :param min_similarity: The minimal approximated Jaccard similarity.
+
+        :return: The smallest count `c` for which `c / self.nr_bands` is at least
+        `min_similarity`, but always at least 1.
+        """
+        count = max(1, ceil(min_similarity * self.nr_bands))
+        # Correcting for floating point errors, e.g. `0.7 * 10 > 7`
+        if count > 1 and (count - 1) / self.nr_bands >= min_similarity:
+            count -= 1
+        return count
+
+    def candidate_pairs(
+        self, min_similarity: float = 0.0, max_bucket_size: Optional[int] = None
+    ) -> Generator[tuple[tuple[int, int], float], None, None]:
+        """
+        Yields the pairs of similar documents one by one. Instead of counting
+        all pairs at once, the candidates are counted for one document at a
+        time, so only the candidates of a single document are kept in memory.
+
+        :param min_similarity: The minimal approximated Jaccard similarity of
+        the pairs that are yielded. Since a pair that shares at most `c` buckets
+        can't reach this similarity, new candidates for a document are only
+        gathered from its first `nr_bands - c + 1` buckets (c.f.
+        `min_band_count()`), and are only counted in the remaining ones.
+
+        :param max_bucket_size: If given, the buckets with more documents than
+        this are ignored entirely, as if none of their documents shared the
+        bucket. This avoids the quadratic number of pairs of a few very large
+        buckets (e.g. boilerplate articles), at the cost of lowering the
+        approximated similarity of the pairs in those buckets.
+
+        :return: A generator that yields tuples `((id_1, id_2), similarity)`,
+        with `id_1 < id_2`. The pairs are ordered by `id_1`, and then by `id_2`.
+        """
+        min_count = self.min_band_count(min_similarity)
+        nr_pairs = 0
+        try:
+            for pair, count in self.pair_counts(min_count, max_bucket_size):
+                nr_pairs += 1
+                yield pair, count / self.nr_bands
+        finally:
+            # Counted once at the end, also if the generator isn't exhausted
+            metrics.count("candidate_pairs", nr_pairs)
+
+    def pair_counts(
+        self, min_count: int = 1, max_bucket_size: Optional[int] = None
+    ) -> Generator[tuple[tuple[int, int], int], None, None]:
+        """
+        Yields the pairs of documents that share at least `min_count` buckets,
+        with the number of buckets they share. This is what `candidate_pairs()`
+        is based on, and what `ShardedLSH` adds up over its shards.
+
+        :param min_count: The minimal number of shared buckets. New candidates
+        for a document are only gathered from its first `nr_bands - c + 1`
+        buckets, and are only counted in the remaining ones.
+
+        :param max_bucket_size: The size above which buckets are ignored (see
+        `candidate_pairs()`).
+
+        :return: A generator that yields tuples `((id_1, id_2), count)`, with
+        `id_1 < id_2`, ordered by `id_1` and then by `id_2`.
+        """
+        document_buckets = self._document_buckets(max_bucket_size)
+
+        for document_id in sorted(document_buckets):
+            buckets = document_buckets[document_id]
+            nr_candidate_buckets = len(buckets) - min_count + 1
+
+            counts = {}
+            for index, bucket in enumerate(buckets):
+                new_candidates = index < nr_candidate_buckets
+                for other_id in bucket:
+                    if other_id <= document_id:
+                        continue
+                    if other_id in counts:
+                        counts[other_id] += 1
+                    elif new_candidates:
+                        counts[other_id] = 1
+
+            for other_id in sorted(counts):
+                if counts[other_id] >= min_count:
+                    yield (document_id, other_id), counts[other_id]
+
+    def cluster(
+        self,
+        pairs: Optional[Iterable[tuple[tuple[int, int], float]]] = None,
+        min_similarity: float = 0.0,
+        max_bucket_size: Optional[int] = None,
+    ) -> UnionFind:
+        """
+        Groups the documents into clusters of near-duplicates, by streaming
+        similar pairs into a `UnionFind` structure. Only the structure itself is
+        kept in memory, not the pairs.
+
+        :param pairs: The similar pairs, e.g. candidate pairs that were verified
+        by `verify_candidates()`. By default, the pairs of `candidate_pairs()`
+        are used.
+
+        :param min_similarity:
+        :param max_bucket_size: The arguments of `candidate_pairs()`, if `pairs`
+        isn't given.
+
+        :return: The clusters, see `UnionFind.labels()` for the cluster ID of
+        each document and `UnionFind.clusters()` for the clusters themselves.
+        The documents are those of the first band, in order of their IDs.
+        """
+        if pairs is None:
+            pairs = self.candidate_pairs(min_similarity, max_bucket_size)
+
+        # Each document is in exactly one bucket of each band
+        document_ids = np.fromiter(
+            (
+                document_id
+                for bucket in self.bands[0].values()
+                for document_id in bucket
+            ),
+            dtype=np.int64,
+        )
+        document_ids.sort()
+        if np.array_equal(document_ids, np.arange(len(document_ids))):
+            clusters = UnionFind(len(document_ids))
+        else:
+            clusters = UnionFind(document_ids.tolist())
+        clusters.union_pairs(pairs)
+        return clusters
+
+    def _document_buckets(
+        self, max_bucket_size: Optional[int]
+    ) -> dict[int, list[set[int]]]:
+        """
+        Gathers the buckets with more than one document for each document.
+
+        :param max_bucket_size: The size above which buckets are ignored.
+
+        :return: A mapping of document IDs to the buckets they belong to, in
+        order of the bands.
+        """
+        document_buckets: dict[int, list[set[int]]] = {}
+        for band in self.bands[: self.nr_bands]:
+            for document_ids in band.values():
+                if len(document_ids) < 2:
+                    continue
+                if max_bucket_size is not None and len(document_ids) > max_bucket_size:
+                    continue
+                for document_id in document_ids:
+                    if document_id not in document_buckets:
+                        document_buckets[document_id] = [document_ids]
+                    else:
+                        document_buckets[document_id].append(document_ids)
+        return document_buckets
+
     def query(self) -> dict[tuple[int, int], float]:
         """
         Returns the IDs of the similar documents.
 
         :return: A mapping of tuples of similar documents, and their
-        approximated Jaccard similarity.
+        approximated Jaccard similarity. The tuples are ordered, i.e. the first
+        document ID is the smallest. See `candidate_pairs()` for a version that
+        doesn't keep all of the pairs in memory.
         """
-        matches = {}
+        with metrics.timed("query"):
+            return dict(self.candidate_pairs())
 
-        for band in self.bands:
-            for document_ids in band.values():
-                for group in combinations(document_ids, 2):
-                    if group in matches:
-                        matches[group] += 1
-                    else:
-                        matches[group] = 1
+    def record_metrics(self) -> None:
+        """
+        Records the distribution of the bucket sizes of each band, and the
+        number of pairs within the buckets of each band, if metrics are enabled
+        (see `metrics.enable()`). Large buckets are the main cost of
+        `candidate_pairs()`, so these show which bands (or documents) need a
+        `max_bucket_size`.
+        """
+        if not metrics.is_enabled():
+            return
+
+        for index, band in enumerate(self.bands):
+            sizes = np.fromiter(
+                (len(document_ids) for document_ids in band.values()), dtype=np.int64
+            )
+            metrics.observe("bucket_size", sizes, band=index)
+            metrics.count(
+                "bucket_pairs", int((sizes * (sizes - 1) // 2).sum()), band=index
+            )
+
+
+class MultiProbeLSH(LSH):
+    """
+    A variant of LSH in which two documents also share a band if their
+    signatures differ in a single row of it. Besides the bucket of its band
+    hash, each document is added to `probes` extra buckets per band, each of
+    which leaves out one of the band's first `probes` rows. Each band then
+    matches with a higher probability (see `collision_probability()`), so the
+    same recall is reached with fewer bands, i.e. with fewer permutations to
+    compute and fewer bands to hash for each document. In exchange, each
+    document is stored in (and each query probes) `probes + 1` buckets per
+    band.
+
+    The buckets of the exact band hashes are `self.bands[:self.nr_bands]`, and
+    those of the `i`-th probe are `self.bands[i * self.nr_bands:]`.
+    """
+
+    probes: int
+
+    def __init__(
+        self,
+        nr_bands: int,
+        rows_per_band: int,
+        hash_function: Callable[[bytes], bytes] = sha1,
+        storage: str = "dict",
+        fast_hashing: bool = False,
+        probes: int = 1,
+        removable: bool = False,
+    ) -> None:
+        """
+        Initialises the data structure.
+
+        :param nr_bands:
+        :param rows_per_band:
+        :param hash_function:
+        :param storage:
+        :param fast_hashing: See `LSH.__init__()`.
+
+        :param probes: The number of rows of each band that may differ, between
+        0 (which is equivalent to `LSH`) and `rows_per_band - 1`. A single probe
+        is equivalent to a band of `rows_per_band - 1` rows, so more probes
+        (with more rows per band) are needed to benefit from them. With as many
+        probes as rows, a probe's bucket would hold every document.
+
+        :param removable: See `LSH.__init__()`.
+        """
+        if not 0 <= probes < rows_per_band:
+            raise ValueError("The number of probes should be below rows_per_band")
+
+        super().__init__(
+            nr_bands, rows_per_band, hash_function, storage, fast_hashing, removable
+        )
+        self.probes = probes
+        band_type = type(self.bands[0])
+        self.bands += [band_type() for _ in range(nr_bands * probes)]
+
+    def band_hashes(self, minhash_values: Iterable[int]) -> list[Union[bytes, int]]:
+        """
+        Computes the hash values of each band of a document's signature, and of
+        each band with one of its probed rows left out.
+
+        :param minhash_values: A single column of the signature matrix M.
+
+        :return: A list of `(self.probes + 1) * self.nr_bands` hash values, in
+        the same order as `self.bands`.
+        """
+        hash_values = super().band_hashes(minhash_values)
+        if self.fast_hashing:
+            return hash_values
+
+        for probe in range(self.probes):
+            for band in range(self.nr_bands):
+                values = list(
+                    minhash_values[
+                        self.rows_per_band * band : self.rows_per_band * (band + 1)
+                    ]
+                )
+                del values[probe]
+
+                byte_string = b"".join(
+                    int(value).to_bytes(8, "big") for value in values
+                )
+                hash_values.append(self.hash_function(byte_string).digest())
+        return hash_values
+
+    def _hash_signatures(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        Computes the 64-bit band hashes of several documents, including those
+        of the bands with a probed row left out.
+
+        :param signatures: The signature matrix, with one row per document.
+
+        :return: A `uint64` array with one row per document, and one column per
+        element of `self.bands`.
+        """
+        signatures = np.asarray(signatures, dtype=np.uint64)
+        bands = signatures[:, : self.nr_rows].reshape(
+            len(signatures), self.nr_bands, self.rows_per_band
+        )
+
+        hash_values = [hash_bands(signatures, self.nr_bands, self.rows_per_band)]
+        for probe in range(self.probes):
+            remaining = np.delete(bands, probe, axis=2).reshape(len(signatures), -1)
+            hash_values.append(
+                hash_bands(remaining, self.nr_bands, self.rows_per_band - 1)
+            )
+        return np.hstack(hash_values)
+
+    def _query_band_hashes(
+        self,
+        hash_values: list[Union[bytes, int]],
+        min_similarity: float,
+        max_bucket_size: Optional[int],
+    ) -> dict[int, float]:
+        """
+        Counts the documents in the buckets of a list of band hashes. Each
+        document is counted at most once per band, even if it shares several of
+        the band's buckets.
+
+        :param hash_values: The band hashes, i.e. as returned by `band_hashes()`.
+
+        :param min_similarity: The minimal approximated Jaccard similarity.
+
+        :param max_bucket_size: The size above which buckets are ignored.
+
+        :return: A mapping of document IDs to the fraction of the bands in which
+        they match the document.
+        """
+        min_count = self.min_band_count(min_similarity)
+
+        counts = {}
+        for band in range(self.nr_bands):
+            matches = set()
+            for index in range(band, len(self.bands), self.nr_bands):
+                document_ids = self.bands[index].get(hash_values[index])
+                if not document_ids:
+                    continue
+                if max_bucket_size is not None and len(document_ids) > max_bucket_size:
+                    continue
+                matches.update(document_ids)
+
+            for document_id in matches:
+                if document_id in counts:
+                    counts[document_id] += 1
+                else:
+                    counts[document_id] = 1
+
+        return {
+            document_id: count / self.nr_bands
+            for document_id, count in counts.items()
+            if count >= min_count
+        }
+
+    def _document_buckets(
+        self, max_bucket_size: Optional[int]
+    ) -> dict[int, list[set[int]]]:
+        """
+        Gathers the buckets with more than one document for each document. The
+        buckets of the same band are merged, so that each pair of documents is
+        counted at most once per band.
+
+        :param max_bucket_size: The size above which buckets are ignored.
+
+        :return: A mapping of document IDs to the merged buckets they belong
+        to, in order of the bands.
+        """
+        document_buckets: dict[int, list[set[int]]] = {}
+        # The last band each document was added to
+        last_bands: dict[int, int] = {}
+
+        for band in range(self.nr_bands):
+            for index in range(band, len(self.bands), self.nr_bands):
+                for document_ids in self.bands[index].values():
+                    if len(document_ids) < 2:
+                        continue
+                    if (
+                        max_bucket_size is not None
+                        and len(document_ids) > max_bucket_size
+                    ):
+                        continue
+                    for document_id in document_ids:
+                        if document_id not in document_buckets:
+                            document_buckets[document_id] = [document_ids]
+                        elif last_bands[document_id] != band:
+                            document_buckets[document_id].append(document_ids)
+                        else:
+                            buckets = document_buckets[document_id]
+                            buckets[-1] = buckets[-1] | document_ids
+                        last_bands[document_id] = band
+        return document_buckets
 
-        return {group: count / self.nr_bands for group, count in matches.items()}
+    @classmethod
+    def load(
+        cls,
+        directory: str,
+        hash_function: Optional[Callable[[bytes], bytes]] = None,
+        mmap_mode: Optional[str] = "r",
+    ) -> "MultiProbeLSH":
+        """
+        Loads a data structure that was written by `save()`, see `LSH.load()`.
+        The buckets of the probes are saved as extra bands, so the number of
+        probes follows from the number of saved bands.
+
+        :param directory: The directory the data structure was saved to.
+
+        :param hash_function: The hash function used by the saved data structure.
+
+        :param mmap_mode: The mode in which the arrays are memory-mapped.
+
+        :return: The loaded data structure.
+        """
+        lsh = super().load(directory, hash_function, mmap_mode)
+        lsh.probes = len(lsh.bands) // lsh.nr_bands - 1
+        return lsh
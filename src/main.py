@@ -1,17 +1,33 @@
 #!/usr/bin/env python3.9
 
-from jaccard import jaccard
-from lsh import LSH
-from minhash import create_minhash
-from shingle import ShingleSetGenerator, convert_shingles_to_bytes
+from cache import SignatureCache
+from cluster import UnionFind
+from forest import LSHForest
+from jaccard import jaccard, to_sorted_array, verify_candidates
+from lsh import LSH, MultiProbeLSH, optimal_parameters
+from minhash import MinHasher, OnePermutationHasher, WeightedMinHasher
+from shingle import HashedShingler, ShingleSetGenerator
+from store import SignatureStore
 
 from collections.abc import Generator, Iterable
+from concurrent.futures import Future, ProcessPoolExecutor
 from csv import reader
+from itertools import islice
+from os import cpu_count, path
 from re import split
+from typing import Optional, Union
 
+from scipy.sparse import csr_matrix
+
+import metrics
+import numpy as np
 import time
 
 
+# A batch of rows, as a mapping of column names to the values in that column
+Batch = dict[str, Union[np.ndarray, list[str]]]
+
+
 def read_csv(filename: str) -> Generator[dict[str, str], None, None]:
     """
     Reads a file as a CSV file, assuming that the first row is the header.
@@ -30,6 +46,101 @@ def read_csv(filename: str) -> Generator[dict[str, str], None, None]:
             yield dict(zip(header, row))
 
 
+def _make_batch(columns: Iterable[str], values: Iterable[Iterable]) -> Batch:
+    """
+    Combines the values of the columns into a batch, as yielded by
+    `read_csv_batches()`.
+
+    :param columns: The column names.
+
+    :param values: The values of each column.
+
+    :return: A mapping of the column names to their values. The `"News_ID"`
+    column is converted to an `int64` array, the others are lists of strings.
+    """
+    batch = {}
+    for column, column_values in zip(columns, values):
+        if column == "News_ID":
+            batch[column] = np.asarray(column_values, dtype=np.int64)
+        else:
+            batch[column] = list(column_values)
+    return batch
+
+
+def read_csv_batches(
+    filename: str,
+    batch_size: int = 10000,
+    columns: tuple[str, ...] = ("News_ID", "article"),
+    engine: str = "csv",
+) -> Generator[Batch, None, None]:
+    """
+    Reads a CSV file in batches of rows, and only keeps the requested columns.
+    Each batch is column-oriented, so it can be passed to the next stages as a
+    whole, e.g. the `"article"` column to a `HashedShingler`, and the
+    `"News_ID"` column as the document IDs to `LSH.add_documents()`.
+
+    :param filename: The name of the CSV file, whose first row is the header.
+
+    :param batch_size: The (maximal) number of rows in each batch.
+
+    :param columns: The names of the columns to keep.
+
+    :param engine: The CSV parser: `"csv"` for Python's `csv` module, or
+    `"pandas"` or `"pyarrow"` for the (faster) parsers of those libraries,
+    which have to be installed separately.
+
+    :return: A generator that yields each batch as a mapping of the column names
+    to their values (see `_make_batch()`).
+    """
+    if engine == "csv":
+        with open(filename, newline="") as csv_file:
+            csv_reader = reader(csv_file)
+            header = next(csv_reader)
+            indices = [header.index(column) for column in columns]
+
+            while rows := list(islice(csv_reader, batch_size)):
+                yield _make_batch(columns, ([row[i] for row in rows] for i in indices))
+
+    elif engine == "pandas":
+        from pandas import read_csv as pandas_read_csv
+
+        chunks = pandas_read_csv(
+            filename,
+            usecols=list(columns),
+            chunksize=batch_size,
+            dtype=str,
+            keep_default_na=False,
+        )
+        for chunk in chunks:
+            yield _make_batch(columns, (chunk[column] for column in columns))
+
+    elif engine == "pyarrow":
+        from pyarrow import csv as arrow_csv, string
+
+        convert_options = arrow_csv.ConvertOptions(
+            include_columns=list(columns),
+            column_types={column: string() for column in columns},
+        )
+        with arrow_csv.open_csv(filename, convert_options=convert_options) as batches:
+            # The parser's batches are split by size in bytes, so the rows are
+            # regrouped into batches of `batch_size` rows
+            pending = {column: [] for column in columns}
+            for record_batch in batches:
+                for column in columns:
+                    pending[column] += record_batch.column(column).to_pylist()
+                while len(pending[columns[0]]) >= batch_size:
+                    yield _make_batch(
+                        columns, (pending[column][:batch_size] for column in columns)
+                    )
+                    for column in columns:
+                        del pending[column][:batch_size]
+            if pending[columns[0]]:
+                yield _make_batch(columns, (pending[column] for column in columns))
+
+    else:
+        raise ValueError(f"Unknown CSV engine: {engine}")
+
+
 def read_data(data: Iterable[dict[str, str]]) -> Generator[list[str], None, None]:
     """
     Extracts the required data from the data rows read from the CSV file, and
@@ -46,6 +157,138 @@ def read_data(data: Iterable[dict[str, str]]) -> Generator[list[str], None, None
         yield [word.lower() for word in words]
 
 
+def compute_signatures(
+    articles: list[str],
+    n: int,
+    minhasher: Union[MinHasher, WeightedMinHasher],
+    cache: Optional[SignatureCache] = None,
+) -> np.ndarray:
+    """
+    Computes the signatures of a chunk of articles. The shingles are computed
+    by the `HashedShingler`, which identifies them by their hashes, so that the
+    result doesn't depend on any other chunk. This function is run by the worker
+    processes of `generate_signatures_parallel()`.
+
+    :param articles: The texts of the articles.
+
+    :param n: The size of the n-grams.
+
+    :param minhasher: The object that computes the signatures. A
+    `WeightedMinHasher` weighs each shingle by its number of occurrences.
+
+    :param cache: If given, only the signatures of the articles that aren't in
+    this cache are computed, and then added to it.
+
+    :return: The signature matrix of the chunk, with one row per article.
+    """
+    if cache is not None:
+        return cache.signatures(articles, n, minhasher, compute_signatures)
+
+    shingler = HashedShingler(n)
+    if isinstance(minhasher, WeightedMinHasher):
+        return minhasher.signature_matrix(
+            shingler.shingle_counts(shingler.tokenize(article)) for article in articles
+        )
+    return minhasher.signature_matrix(shingler(articles))
+
+
+def document_rows(
+    pairs: Iterable[tuple[tuple[int, int], float]], document_ids: Optional[np.ndarray]
+) -> Generator[tuple[tuple[int, int], float], None, None]:
+    """
+    Translates the document IDs of pairs, e.g. as yielded by
+    `LSH.candidate_pairs()`, to the row numbers of the documents, which index
+    their signatures and shingle sets.
+
+    :param pairs: The pairs of document IDs, with their similarity.
+
+    :param document_ids: The document ID of each row, or `None` if the document
+    IDs are the row numbers.
+
+    :return: A generator that yields tuples `((row_1, row_2), similarity)`.
+    """
+    if document_ids is None:
+        yield from pairs
+        return
+
+    rows = {document_id: row for row, document_id in enumerate(document_ids.tolist())}
+    for (id_1, id_2), similarity in pairs:
+        yield (rows[id_1], rows[id_2]), similarity
+
+
+def find_similar_articles(
+    texts: Iterable[str],
+    forest: LSHForest,
+    minhasher: Union[MinHasher, WeightedMinHasher],
+    n: int = 2,
+    k: int = 10,
+) -> list[list[tuple[int, float]]]:
+    """
+    Finds the `k` most similar indexed articles of several texts. The texts
+    are shingled and minhashed like the articles, so the forest should contain
+    signatures computed with the `HashedShingler` and the same `minhasher`, e.g.
+    by `generate_signatures_parallel()` or from `read_csv_batches()`.
+
+    :param texts: The texts to search for.
+
+    :param forest: The forest that contains the articles' signatures.
+
+    :param minhasher: The object that computed the articles' signatures.
+
+    :param n: The size of the n-grams.
+
+    :param k: The number of results per text.
+
+    :return: For each text, a list of at most `k` tuples `(document_id,
+    similarity)`, see `LSHForest.query_many()`.
+    """
+    return forest.query_many(compute_signatures(texts, n, minhasher), k)
+
+
+def generate_signatures_parallel(
+    data: Iterable[dict[str, str]],
+    n: int,
+    minhasher: Union[MinHasher, WeightedMinHasher],
+    nr_workers: Optional[int] = None,
+    chunk_size: int = 1000,
+) -> Generator[np.ndarray, None, None]:
+    """
+    Computes the signatures of the documents in a pool of worker processes. The
+    rows are split into chunks that are sent to the workers, and only the
+    signature matrices are sent back. The number of chunks being processed at
+    the same time is bounded, so that the input isn't read into memory at once.
+
+    :param data: An iterable of dictionary objects, i.e. as returned by
+    `read_csv()`. These dictionaries should contain the key `"article"`.
+
+    :param n: The size of the n-grams.
+
+    :param minhasher: The object that computes the signatures.
+
+    :param nr_workers: The number of worker processes. By default, this is the
+    number of processors.
+
+    :param chunk_size: The number of documents in each chunk.
+
+    :return: A generator that yields the signature matrices of the chunks, in
+    the same order as the input. The result doesn't depend on the number of
+    workers or the chunk size.
+    """
+    articles = (entry["article"] for entry in data)
+
+    with ProcessPoolExecutor(nr_workers) as executor:
+        max_pending = 2 * (nr_workers or cpu_count() or 1)
+        pending: list[Future] = []
+
+        while chunk := list(islice(articles, chunk_size)):
+            pending.append(executor.submit(compute_signatures, chunk, n, minhasher))
+            if len(pending) >= max_pending:
+                yield pending.pop(0).result()
+
+        for future in pending:
+            yield future.result()
+
+
 def generate_histogram(data: list[set[int]], nr_bars: int = 10) -> list[int]:
     """
     Generates histogram data for the Jaccard similarities between the data sets.
@@ -78,6 +321,176 @@ def generate_histogram(data: list[set[int]], nr_bars: int = 10) -> list[int]:
     return buckets
 
 
+def shingle_matrix(data: Iterable[Iterable[int]]) -> csr_matrix:
+    """
+    Builds a sparse binary matrix with one row per document and one column per
+    distinct shingle.
+
+    :param data: The shingle sets (or arrays) representing the documents.
+
+    :return: A CSR matrix of `int32` values, where the element at `(i, j)` is 1
+    if document `i` contains shingle `j`.
+    """
+    shingle_arrays = [np.unique(np.fromiter(shingles, np.uint64)) for shingles in data]
+    sizes = [len(shingles) for shingles in shingle_arrays]
+
+    all_shingles = np.concatenate(shingle_arrays + [np.empty(0, dtype=np.uint64)])
+    # Renumbering the shingles to consecutive column indices
+    _, columns = np.unique(all_shingles, return_inverse=True)
+
+    row_starts = np.concatenate(([0], np.cumsum(sizes)))
+    values = np.ones(len(columns), dtype=np.int32)
+    return csr_matrix(
+        (values, columns, row_starts),
+        shape=(len(sizes), int(columns.max(initial=-1)) + 1),
+    )
+
+
+# The shingle matrix of the worker processes of `generate_histogram_sparse()`
+_histogram_matrix: Optional[csr_matrix] = None
+
+
+def _set_histogram_matrix(matrix: csr_matrix) -> None:
+    """
+    Initialises a worker process of `generate_histogram_sparse()`.
+
+    :param matrix: The shingle matrix.
+    """
+    global _histogram_matrix
+    _histogram_matrix = matrix
+
+
+def _histogram_chunk(
+    start: int, end: int, nr_bars: int, matrix: Optional[csr_matrix] = None
+) -> np.ndarray:
+    """
+    Computes the histogram counts of the pairs of documents `(i, j)` with
+    `start <= i < end` and `j < i`.
+
+    :param start:
+    :param end: The range of documents.
+
+    :param nr_bars: The number of bars of the histogram.
+
+    :param matrix: The shingle matrix. By default, the worker's matrix is used.
+
+    :return: The counts of each bar.
+    """
+    if matrix is None:
+        matrix = _histogram_matrix
+
+    sizes = np.diff(matrix.indptr)
+    # The intersection sizes of all pairs that have at least one shingle in common
+    intersections = (matrix[start:end] @ matrix[:end].T).tocoo()
+    rows = intersections.row + start
+    columns = intersections.col
+    mask = columns < rows
+
+    intersection = intersections.data[mask].astype(np.float64)
+    union = sizes[rows[mask]] + sizes[columns[mask]] - intersection
+    similarities = intersection / union
+
+    # Computing bucket numbers as `floor(nr_bars * similarity)`, and putting
+    # similarities of 1.0 in the last bucket, just like `generate_histogram()`
+    bars = np.minimum((nr_bars * similarities).astype(np.int64), nr_bars - 1)
+    counts = np.bincount(bars, minlength=nr_bars)
+
+    # The pairs without any shingle in common have a similarity of 0.0
+    nr_pairs = sum(range(start, end))
+    counts[0] += nr_pairs - len(similarities)
+    return counts
+
+
+def generate_histogram_sparse(
+    data: Iterable[Iterable[int]],
+    nr_bars: int = 10,
+    chunk_size: int = 1000,
+    nr_workers: int = 1,
+) -> list[int]:
+    """
+    Generates the same histogram data as `generate_histogram()`, but computes
+    the intersection sizes of all pairs with sparse matrix products instead of
+    comparing each pair of sets. Only the pairs that share at least one shingle
+    are ever materialised, and the documents are processed in chunks, so the
+    memory usage is bounded by the size of a chunk's product.
+
+    :param data: The shingle sets representing the documents.
+
+    :param nr_bars: The number of bars the histogram will consist of, see
+    `generate_histogram()`.
+
+    :param chunk_size: The number of documents whose pairs are computed at once.
+
+    :param nr_workers: The number of processes that compute the chunks.
+
+    :return: The counts for each bar of the histogram, see
+    `generate_histogram()`.
+    """
+    matrix = shingle_matrix(data)
+    starts = range(0, matrix.shape[0], chunk_size)
+    ends = [min(start + chunk_size, matrix.shape[0]) for start in starts]
+
+    counts = np.zeros(nr_bars, dtype=np.int64)
+    if nr_workers > 1:
+        with ProcessPoolExecutor(
+            nr_workers, initializer=_set_histogram_matrix, initargs=(matrix,)
+        ) as executor:
+            for chunk_counts in executor.map(
+                _histogram_chunk, starts, ends, [nr_bars] * len(ends)
+            ):
+                counts += chunk_counts
+    else:
+        for start, end in zip(starts, ends):
+            counts += _histogram_chunk(start, end, nr_bars, matrix)
+    return counts.tolist()
+
+
+def generate_histogram_sampled(
+    signatures: np.ndarray,
+    nr_bars: int = 10,
+    nr_samples: int = 100000,
+    seed: int = 1,
+    batch_size: int = 10000,
+) -> list[int]:
+    """
+    Approximates the histogram data of `generate_histogram()` by sampling random
+    pairs of documents, and estimating their similarity from their signatures.
+    The counts are scaled to the total number of pairs.
+
+    :param signatures: The signature matrix, with one row per document.
+
+    :param nr_bars: The number of bars the histogram will consist of, see
+    `generate_histogram()`.
+
+    :param nr_samples: The number of pairs that are sampled (with replacement).
+
+    :param seed: The seed of the random number generator choosing the pairs.
+
+    :param batch_size: The number of pairs that are compared at once.
+
+    :return: The estimated counts for each bar of the histogram, see
+    `generate_histogram()`.
+    """
+    nr_documents = len(signatures)
+    nr_pairs = nr_documents * (nr_documents - 1) // 2
+    counts = np.zeros(nr_bars, dtype=np.int64)
+    if nr_pairs == 0:
+        return counts.tolist()
+
+    generator = np.random.RandomState(seed)
+    for batch_start in range(0, nr_samples, batch_size):
+        size = min(batch_size, nr_samples - batch_start)
+        # Choosing two distinct documents for each pair
+        first = generator.randint(0, nr_documents, size)
+        second = (first + generator.randint(1, nr_documents, size)) % nr_documents
+
+        similarities = np.mean(signatures[first] == signatures[second], axis=1)
+        bars = np.minimum((nr_bars * similarities).astype(np.int64), nr_bars - 1)
+        counts += np.bincount(bars, minlength=nr_bars)
+
+    return np.rint(counts * (nr_pairs / nr_samples)).astype(np.int64).tolist()
+
+
 def generate_statistics(
     query: dict[tuple[int, int], float], range1: int, range2: int, sim: float
 ):
@@ -121,34 +534,200 @@ if __name__ == "__main__":
     data_reader = read_data(csv_reader)
     shingle_set_generator = ShingleSetGenerator(data_reader, 2)
 
-    # Uncomment if you want to generate histogram.
+    # Uncomment if you want to generate histogram. For more than a few thousand
+    # documents, use `generate_histogram_sparse()` instead.
 
     # buckets = generate_histogram(list(shingle_set_generator), 10)
     # for index, count in enumerate(buckets):
     #     print(f"[{index / 10}, {(1 + index) / 10}{']' if index == 9 else '['} :", count)
 
-    byte_string_generator = (
-        convert_shingles_to_bytes(shingle_set) for shingle_set in shingle_set_generator
+    min_similarity = 0.8
+    # The number of bands and rows per band are chosen for `min_similarity`,
+    # with at most this many permutations. Set `calibration_size` to calibrate
+    # them on the similarities of a sample of this many documents instead of
+    # assuming that all similarities are equally likely.
+    max_permutations = 125
+    # With at least 1 probe, the bands also match if the signatures differ in
+    # one of their first `probes` rows, which needs fewer permutations
+    probes = 0
+    calibration_size = None
+    histogram = None
+    if calibration_size is not None:
+        sample = islice(read_data(read_csv(filename)), calibration_size)
+        histogram = generate_histogram_sparse(ShingleSetGenerator(sample, 2), 100)
+    nr_bands, rows_per_band = optimal_parameters(
+        min_similarity,
+        max_permutations=max_permutations,
+        histogram=histogram,
+        probes=probes,
     )
+    print(f"Using {nr_bands} bands of {rows_per_band} rows.")
+    seed = 1
+    # Set this to more than 1 to compute the signatures in worker processes
+    nr_workers = 1
+    # If set (and with a single worker), the CSV file is read in batches of this
+    # many rows with the `csv_engine` parser, the batches are shingled by the
+    # `HashedShingler`, and the documents keep their `News_ID` as their ID
+    batch_size = None
+    csv_engine = "csv"
+    # If set, the index is loaded from this directory if it has been saved to it
+    # before, and it is built and saved to it otherwise
+    index_directory = None
+    # The candidates (the pairs that share a bucket in any band, as assumed by
+    # `optimal_parameters()`) are re-scored before the threshold is applied,
+    # either with their exact Jaccard similarity ("jaccard") or with the
+    # similarity of their full signatures ("minhash"). With `None`, the fraction
+    # of shared bands is used instead, which only suits many bands of few rows.
+    verification = "minhash"
+    # If set, the shingles are weighted by their number of occurrences in each
+    # article, using weighted minhash signatures (see `WeightedMinHasher`)
+    weighted = False
+    # If set (and `weighted` isn't), the cheaper one-permutation signatures are
+    # used instead (see `OnePermutationHasher`)
+    one_permutation = False
+    # If set, the stage timings, counts and bucket sizes are written to this
+    # file, as JSON if it ends with ".json" and in the Prometheus text format
+    # otherwise (see `metrics.write()`)
+    metrics_file = None
+    if metrics_file is not None:
+        metrics.enable()
+    # If set (with `batch_size` or `weighted`), the signatures are cached in
+    # this file, so that later runs only compute those of new articles
+    signature_cache = None
+    cache = None if signature_cache is None else SignatureCache(signature_cache)
+    # If set, only this many bits of each minhash value are kept in memory (see
+    # `SignatureStore`); 32 bits are lossless for the `MinHasher`
+    signature_bits = None
+
+    shingle_arrays = None
+    # The document ID of each row, if they aren't the row numbers
+    document_ids = None
+    if index_directory is not None and path.isdir(index_directory):
+        lsh = (MultiProbeLSH if probes > 0 else LSH).load(index_directory)
+        signatures = LSH.load_signatures(index_directory)
+        if path.exists(path.join(index_directory, "document_ids.npy")):
+            document_ids = np.load(path.join(index_directory, "document_ids.npy"))
+        print("It took %s seconds to load LSH." % (time.time() - start))
+    else:
+        if weighted:
+            minhasher = WeightedMinHasher(nr_bands * rows_per_band, seed)
+        elif one_permutation:
+            minhasher = OnePermutationHasher(nr_bands * rows_per_band, seed)
+        else:
+            minhasher = MinHasher(nr_bands * rows_per_band, seed)
+        # The chunks of signatures, and their document IDs (`None` for the
+        # column numbers)
+        if nr_workers > 1:
+            signature_chunks = (
+                (None, signature_chunk)
+                for signature_chunk in generate_signatures_parallel(
+                    read_csv(filename), 2, minhasher, nr_workers
+                )
+            )
+        elif batch_size is not None:
+            signature_chunks = (
+                (
+                    batch["News_ID"],
+                    compute_signatures(batch["article"], 2, minhasher, cache),
+                )
+                for batch in read_csv_batches(filename, batch_size, engine=csv_engine)
+            )
+        elif weighted:
+            articles = [row["article"] for row in read_csv(filename)]
+            signature_chunks = [
+                (None, compute_signatures(articles, 2, minhasher, cache))
+            ]
+        else:
+            shingle_arrays = [
+                to_sorted_array(shingles) for shingles in shingle_set_generator
+            ]
+            signature_chunks = [(None, minhasher.signature_matrix(shingle_arrays))]
+
+        if probes > 0:
+            lsh = MultiProbeLSH(
+                nr_bands, rows_per_band, fast_hashing=True, probes=probes
+            )
+        else:
+            lsh = LSH(nr_bands, rows_per_band, fast_hashing=True)
+        if signature_bits is None:
+            signatures = []
+        else:
+            signatures = SignatureStore(nr_bands * rows_per_band, signature_bits)
+        id_chunks = []
+        for chunk_ids, signature_chunk in signature_chunks:
+            lsh.add_documents(signature_chunk, chunk_ids)
+            signatures.append(signature_chunk)
+            if chunk_ids is not None:
+                id_chunks.append(chunk_ids)
+        if signature_bits is None:
+            signatures = np.vstack(signatures)
+        if id_chunks:
+            document_ids = np.concatenate(id_chunks)
+        print("It took %s seconds to build LSH." % (time.time() - start))
+
+        if index_directory is not None:
+            lsh.save(index_directory, signatures)
+            if document_ids is not None:
+                np.save(path.join(index_directory, "document_ids.npy"), document_ids)
 
-    nr_bands = 25
-    rows_per_band = 5
+    # generate_statistics(lsh.query(), 1000, 1050, 0.8)
 
-    lsh = LSH(nr_bands, rows_per_band)
-    for minhash in create_minhash(byte_string_generator, nr_bands * rows_per_band):
-        lsh.add_document(minhash.hashvalues)
-    print("It took %s seconds to build LSH." % (time.time() - start))
+    # Uncomment to find the articles that are most similar to a text. This
+    # requires the signatures to be computed with the `HashedShingler`, i.e.
+    # with `nr_workers` above 1, or with `batch_size` or `weighted` set, and the
+    # same `minhasher` as the one that built the index.
 
-    # generate_statistics(lsh.query(), 1000, 1050, 0.8)
+    # forest = LSHForest(nr_bands, rows_per_band)
+    # forest.add_documents(signatures)
+    # for document_id, similarity in find_similar_articles(["..."], forest, minhasher)[0]:
+    #     print(f"{document_id:4} : {similarity}")
 
-    min_similarity = 0.8
-    results = sorted(
-        (sorted(doc_ids), similarity)
-        for doc_ids, similarity in lsh.query().items()
-        if similarity >= min_similarity
-    )
+    # Buckets with more documents than this are ignored (`None` for no limit)
+    max_bucket_size = None
 
-    with open("result.csv", "w") as result_file:
-        for doc_ids, similarity in results:
+    # The pairs are verified and clustered by the row numbers of the documents,
+    # and only translated back to their IDs when they're written
+    if verification is None:
+        results = document_rows(
+            lsh.candidate_pairs(min_similarity, max_bucket_size), document_ids
+        )
+    elif verification == "jaccard":
+        if shingle_arrays is None:
+            shingle_arrays = [
+                to_sorted_array(shingles)
+                for shingles in ShingleSetGenerator(read_data(read_csv(filename)), 2)
+            ]
+        results = verify_candidates(
+            document_rows(lsh.candidate_pairs(0.0, max_bucket_size), document_ids),
+            documents=shingle_arrays,
+            min_similarity=min_similarity,
+        )
+    else:
+        results = verify_candidates(
+            document_rows(lsh.candidate_pairs(0.0, max_bucket_size), document_ids),
+            signatures=signatures,
+            min_similarity=min_similarity,
+        )
+    row_ids = range(len(signatures)) if document_ids is None else document_ids.tolist()
+
+    # The pairs are also grouped into clusters while they're written
+    clusters = UnionFind(len(signatures))
+    with open("result.csv", "w") as result_file, metrics.timed("pairs"):
+        for rows, similarity in results:
+            clusters.union(rows[0], rows[1])
+            doc_ids = sorted((row_ids[rows[0]], row_ids[rows[1]]))
             result_file.write(f"{doc_ids[0]}, {doc_ids[1]}\n")
             print(f"{doc_ids[0]:4} - {doc_ids[1]:4} : {similarity}")
+
+    # Each document in a cluster of near-duplicates, with its cluster ID (i.e.
+    # the smallest document ID in the cluster)
+    with open("clusters.csv", "w") as cluster_file:
+        for cluster in clusters.clusters():
+            cluster_ids = [row_ids[row] for row in cluster.tolist()]
+            cluster_id = min(cluster_ids)
+            for document_id in cluster_ids:
+                cluster_file.write(f"{document_id}, {cluster_id}\n")
+
+    if metrics_file is not None:
+        lsh.record_metrics()
+        metrics.write(metrics_file)
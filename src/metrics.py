@@ -0,0 +1,305 @@
+#!/usr/bin/env python3.9
+
+from collections.abc import Iterable
+from contextlib import nullcontext
+from resource import getrusage, RUSAGE_SELF
+from typing import Any, ContextManager, Union
+
+import json
+import numpy as np
+import sys
+import time
+
+
+# The metrics are only recorded while this is set, see `enable()`
+_enabled = False
+
+# The timings of each stage: the number of calls, the total and maximal number
+# of seconds, and the peak memory usage after the stage's last call
+_stages: dict[str, dict[str, float]] = {}
+# The counters, by name and labels
+_counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+# The histograms of observed values, by name and labels
+_histograms: dict[tuple[str, tuple[tuple[str, str], ...]], dict[str, Any]] = {}
+
+# The upper bounds of the histograms' buckets: the powers of 2 up to 2^20
+HISTOGRAM_BOUNDS = [2 ** exponent for exponent in range(21)]
+
+# The context manager that is returned by `timed()` when disabled
+_NULL_CONTEXT = nullcontext()
+
+
+def enable() -> None:
+    """
+    Starts recording metrics. Until this is called, all recording functions
+    return immediately.
+    """
+    global _enabled
+    _enabled = True
+
+
+def disable() -> None:
+    """
+    Stops recording metrics. The recorded metrics are kept until `reset()`.
+    """
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    """
+    Returns whether metrics are being recorded, e.g. to skip computing values
+    that are only needed for metrics.
+    """
+    return _enabled
+
+
+def reset() -> None:
+    """
+    Removes all recorded metrics.
+    """
+    _stages.clear()
+    _counters.clear()
+    _histograms.clear()
+
+
+def peak_memory() -> int:
+    """
+    Returns the peak resident set size of this process so far, in bytes.
+    """
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class _Timer:
+    """
+    A context manager that adds its duration to the timings of a stage.
+    """
+
+    # The name of the stage
+    _name: str
+    # The value of `time.perf_counter()` when the stage started
+    _start: float
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception: Any) -> None:
+        record_stage(self._name, time.perf_counter() - self._start)
+
+
+def record_stage(name: str, seconds: float) -> None:
+    """
+    Adds a duration to the timings of a stage, e.g. for a stage that measures
+    its own duration.
+
+    :param name: The name of the stage.
+
+    :param seconds: The duration of the stage.
+    """
+    if not _enabled:
+        return
+    stage = _stages.get(name)
+    if stage is None:
+        stage = _stages[name] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+    stage["calls"] += 1
+    stage["seconds"] += seconds
+    stage["max_seconds"] = max(stage["max_seconds"], seconds)
+    stage["peak_rss_bytes"] = peak_memory()
+
+
+def timed(name: str) -> ContextManager:
+    """
+    Times a stage of the pipeline, e.g. `with metrics.timed("minhash"): ...`.
+
+    :param name: The name of the stage. Stages with the same name are added up.
+
+    :return: A context manager that records the stage's duration, or one that
+    does nothing if metrics are disabled.
+    """
+    if not _enabled:
+        return _NULL_CONTEXT
+    return _Timer(name)
+
+
+def _key(name: str, labels: dict[str, Any]) -> tuple[str, tuple[tuple[str, str], ...]]:
+    """
+    Combines a metric's name and labels into a dictionary key.
+    """
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def count(name: str, value: Union[int, float] = 1, **labels: Any) -> None:
+    """
+    Increases a counter, e.g. the number of processed documents.
+
+    :param name: The name of the counter.
+
+    :param value: The amount to add.
+
+    :param labels: The labels that distinguish the counter from others with the
+    same name, e.g. `band=3`.
+    """
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, values: Iterable[Union[int, float]], **labels: Any) -> None:
+    """
+    Adds values to a histogram, e.g. the sizes of the buckets of a band. The
+    histogram counts the values up to each power of 2 in `HISTOGRAM_BOUNDS`.
+
+    :param name: The name of the histogram.
+
+    :param values: The values to add.
+
+    :param labels: The labels that distinguish the histogram from others with
+    the same name.
+    """
+    if not _enabled:
+        return
+
+    values = np.asarray(values if isinstance(values, np.ndarray) else list(values))
+    key = _key(name, labels)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = {
+            "counts": [0] * (len(HISTOGRAM_BOUNDS) + 1),
+            "count": 0,
+            "sum": 0.0,
+            "max": None,
+        }
+    if values.size == 0:
+        return
+
+    # The index of the smallest bound that is at least each value
+    indices = np.searchsorted(HISTOGRAM_BOUNDS, values, side="left")
+    counts = np.bincount(indices, minlength=len(HISTOGRAM_BOUNDS) + 1)
+    histogram["counts"] = [a + int(b) for a, b in zip(histogram["counts"], counts)]
+    histogram["count"] += int(values.size)
+    histogram["sum"] += float(values.sum())
+    maximum = values.max().item()
+    histogram["max"] = (
+        maximum if histogram["max"] is None else max(histogram["max"], maximum)
+    )
+
+
+def _format_key(name: str, labels: tuple[tuple[str, str], ...]) -> str:
+    """
+    Formats a metric's name and labels like Prometheus does, e.g.
+    `bucket_size{band="3"}`.
+    """
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+def snapshot() -> dict[str, Any]:
+    """
+    Returns all recorded metrics.
+
+    :return: A JSON-serialisable dictionary containing the timings of the
+    stages, the counters and the histograms (each by their name and labels, see
+    `_format_key()`), and the peak memory usage of the process.
+    """
+    return {
+        "stages": {name: dict(stage) for name, stage in _stages.items()},
+        "counters": {_format_key(*key): value for key, value in _counters.items()},
+        "histograms": {
+            _format_key(*key): {
+                "bounds": HISTOGRAM_BOUNDS,
+                "counts": list(histogram["counts"]),
+                "count": histogram["count"],
+                "sum": histogram["sum"],
+                "max": histogram["max"],
+            }
+            for key, histogram in _histograms.items()
+        },
+        "peak_rss_bytes": peak_memory(),
+    }
+
+
+def to_json() -> str:
+    """
+    Exports all recorded metrics as JSON, see `snapshot()`.
+    """
+    return json.dumps(snapshot(), indent=2)
+
+
+def to_prometheus(prefix: str = "lsh") -> str:
+    """
+    Exports all recorded metrics in the Prometheus text format.
+
+    :param prefix: The prefix of the metrics' names.
+
+    :return: The text dump, with one sample per line. The stage timings are
+    labelled by stage, and the histograms have cumulative `_bucket` samples.
+    """
+    lines = []
+
+    def add(name: str, kind: str, samples: list[tuple[str, Any]]) -> None:
+        lines.append(f"# TYPE {prefix}_{name} {kind}")
+        lines.extend(f"{prefix}_{sample} {value}" for sample, value in samples)
+
+    stages = sorted(_stages.items())
+    for field, suffix, kind in [
+        ("calls", "stage_calls_total", "counter"),
+        ("seconds", "stage_seconds_total", "counter"),
+        ("max_seconds", "stage_max_seconds", "gauge"),
+        ("peak_rss_bytes", "stage_peak_rss_bytes", "gauge"),
+    ]:
+        if stages:
+            add(
+                suffix,
+                kind,
+                [
+                    (f'{suffix}{{stage="{name}"}}', stage[field])
+                    for name, stage in stages
+                ],
+            )
+
+    names = sorted({name for name, _ in _counters})
+    for name in names:
+        samples = [
+            (_format_key(f"{name}_total", labels), value)
+            for (other, labels), value in sorted(_counters.items())
+            if other == name
+        ]
+        add(f"{name}_total", "counter", samples)
+
+    names = sorted({name for name, _ in _histograms})
+    for name in names:
+        samples = []
+        for (other, labels), histogram in sorted(_histograms.items()):
+            if other != name:
+                continue
+            cumulative = np.cumsum(histogram["counts"]).tolist()
+            bounds = [str(bound) for bound in HISTOGRAM_BOUNDS] + ["+Inf"]
+            for bound, total in zip(bounds, cumulative):
+                bucket_labels = labels + (("le", bound),)
+                samples.append((_format_key(f"{name}_bucket", bucket_labels), total))
+            samples.append((_format_key(f"{name}_sum", labels), histogram["sum"]))
+            samples.append((_format_key(f"{name}_count", labels), histogram["count"]))
+        add(name, "histogram", samples)
+
+    add("peak_rss_bytes", "gauge", [("peak_rss_bytes", peak_memory())])
+    return "\n".join(lines) + "\n"
+
+
+def write(filename: str) -> None:
+    """
+    Writes all recorded metrics to a file, as JSON if its name ends with
+    `.json`, and in the Prometheus text format otherwise.
+
+    :param filename: The name of the file.
+    """
+    output = to_json() if filename.endswith(".json") else to_prometheus()
+    with open(filename, "w") as metrics_file:
+        metrics_file.write(output)
@@ -2,6 +2,8 @@
 
 from shingle import ShingleSetGenerator
 
+import metrics
+
 from collections.abc import Generator, Iterable
 from csv import reader
 from re import split
@@ -12,6 +14,14 @@ import numpy as np
 
 # All functions here are based on https://github.com/ekzhu/datasketch
 
+# The Mersenne prime `2^61 - 1`, the modulus of the universal hash functions
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+# The largest possible minhash value; the hash values are truncated to 32 bits
+MAX_HASH = np.uint64((1 << 32) - 1)
+# The constants of the 64-bit mixing function `mix_bits()`
+_MIX_MULTIPLIER_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_MULTIPLIER_2 = np.uint64(0x94D049BB133111EB)
+
 
 # Should be replaced with Shingle Generator, currently only able to generate unigrams
 def preprocess(text) -> list[str]:
@@ -47,9 +57,361 @@ def create_minhash(data: Iterable[Iterable[bytes]], perm: int) -> list[MinHash]:
         for shingle in tokens:
             m.update(shingle)
         minhash.append(m)
-    print('It took %s seconds to build minhash.' % (time.time() - start))
+    seconds = time.time() - start
+    metrics.record_stage("create_minhash", seconds)
+    metrics.count("documents", len(minhash))
+    print('It took %s seconds to build minhash.' % seconds)
     return minhash
 
+
+class MinHasher:
+    """
+    A vectorised MinHash implementation that works on integer shingle IDs, i.e.
+    as produced by the `ShingleSetGenerator`. Each permutation is a universal
+    hash function `(a * x + b) mod p`, and all permutations are applied to all
+    of a document's shingles in a single NumPy operation. The signatures only
+    depend on the seed, and are thus reproducible across runs.
+    """
+
+    # The number of permutations, i.e. the length of each signature
+    nr_permutations: int
+    # The seed of the random number generator that chose the permutations
+    seed: int
+    # The coefficients `a` and `b` of each of the universal hash functions
+    _a: np.ndarray
+    _b: np.ndarray
+
+    def __init__(self, nr_permutations: int, seed: int = 1) -> None:
+        """
+        Initialises the object by choosing the permutations.
+
+        :param nr_permutations: The number of permutations, which is equal to
+        the number of rows of the signature matrix. For use with `LSH`, this
+        should be `nr_bands * rows_per_band`.
+
+        :param seed: The seed for choosing the permutations. Two objects with
+        the same seed and number of permutations compute the same signatures.
+        """
+        self.nr_permutations = nr_permutations
+        self.seed = seed
+
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, MERSENNE_PRIME, nr_permutations, dtype=np.uint64)
+        self._b = generator.randint(0, MERSENNE_PRIME, nr_permutations, dtype=np.uint64)
+
+    def signature(self, shingle_ids: Iterable[int]) -> np.ndarray:
+        """
+        Computes the minhash signature of a single document.
+
+        :param shingle_ids: The document's shingle IDs, preferably as a `uint64`
+        array. Other iterables of integers (e.g. sets) are converted first.
+
+        :return: A `uint64` array of length `self.nr_permutations` with the
+        minimum hash value for each permutation. An empty document gets the
+        maximum hash value `MAX_HASH` for each permutation.
+        """
+        if isinstance(shingle_ids, np.ndarray):
+            shingle_ids = shingle_ids.astype(np.uint64, copy=False)
+        else:
+            shingle_ids = np.fromiter(shingle_ids, dtype=np.uint64)
+
+        if shingle_ids.size == 0:
+            return np.full(self.nr_permutations, MAX_HASH, dtype=np.uint64)
+
+        # One row per shingle, one column per permutation; the multiplication
+        # wraps around modulo 2^64 just like datasketch's implementation
+        hash_values = np.outer(shingle_ids, self._a)
+        hash_values += self._b
+        hash_values %= MERSENNE_PRIME
+        hash_values &= MAX_HASH
+        return hash_values.min(axis=0)
+
+    def signature_matrix(self, documents: Iterable[Iterable[int]]) -> np.ndarray:
+        """
+        Computes the minhash signatures of a collection of documents.
+
+        :param documents: The documents, each of which is an iterable of shingle
+        IDs (see `signature()`).
+
+        :return: A 2-D `uint64` array with one row per document and one column
+        per permutation. Each row can be passed to `LSH.add_document()`.
+        """
+        with metrics.timed("signatures"):
+            signatures = [self.signature(document) for document in documents]
+        metrics.count("documents", len(signatures))
+        if not signatures:
+            return np.empty((0, self.nr_permutations), dtype=np.uint64)
+        return np.vstack(signatures)
+
+
+def mix_bits(values: np.ndarray) -> np.ndarray:
+    """
+    Applies the finaliser of the SplitMix64 generator to an array, which mixes
+    the bits of each 64-bit value.
+
+    :param values: A `uint64` array, which is modified in place.
+
+    :return: The same array.
+    """
+    values ^= values >> np.uint64(30)
+    values *= _MIX_MULTIPLIER_1
+    values ^= values >> np.uint64(27)
+    values *= _MIX_MULTIPLIER_2
+    values ^= values >> np.uint64(31)
+    return values
+
+
+class OnePermutationHasher:
+    """
+    A drop-in replacement for `MinHasher` that uses one-permutation hashing:
+    each shingle is hashed only once, and the hash determines both the bin
+    (i.e. row of the signature) it belongs to and its value within the bin. The
+    signature contains the minimum value of each bin. Bins without shingles are
+    filled by optimal densification: each empty bin copies the value of a bin
+    that is chosen by a hash of the empty bin's index and an attempt counter,
+    retrying until a non-empty bin is found. Since these choices only depend on
+    the seed, equal bins of two documents stay equal, and the signatures can be
+    banded by `LSH` like those of `MinHasher`.
+
+    Computing a signature thus takes `O(shingles + permutations)` time instead
+    of `O(shingles * permutations)`.
+    """
+
+    # The number of bins, i.e. the length of each signature
+    nr_permutations: int
+    # The seed of the random number generator that chose the salts
+    seed: int
+    # The salt of the shingles' hash function
+    _salt: np.uint64
+    # The salt of the densification's hash function
+    _densification_salt: np.uint64
+
+    def __init__(self, nr_permutations: int, seed: int = 1) -> None:
+        """
+        Initialises the object by choosing the hash functions.
+
+        :param nr_permutations: The number of bins, which is equal to the
+        number of rows of the signature matrix.
+
+        :param seed: The seed for choosing the hash functions.
+        """
+        self.nr_permutations = nr_permutations
+        self.seed = seed
+
+        generator = np.random.RandomState(seed)
+        self._salt, self._densification_salt = generator.randint(
+            0, 2 ** 63, 2, dtype=np.uint64
+        )
+
+    def _densify(self, signature: np.ndarray, empty: np.ndarray) -> None:
+        """
+        Fills the empty bins of a signature by optimal densification.
+
+        :param signature: The signature, which is modified in place.
+
+        :param empty: A boolean array that indicates which bins are empty. At
+        least one bin should be non-empty.
+        """
+        filled = ~empty
+        bins = np.flatnonzero(empty).astype(np.uint64)
+        nr_bins = np.uint64(self.nr_permutations)
+
+        attempt = 0
+        while bins.size > 0:
+            attempt += 1
+            keys = bins * nr_bins + np.uint64(attempt) + self._densification_salt
+            sources = (mix_bits(keys) >> np.uint64(32)) * nr_bins >> np.uint64(32)
+            found = filled[sources]
+            signature[bins[found]] = signature[sources[found]]
+            bins = bins[~found]
+
+    def signature(self, shingle_ids: Iterable[int]) -> np.ndarray:
+        """
+        Computes the one-permutation minhash signature of a single document.
+
+        :param shingle_ids: The document's shingle IDs, see
+        `MinHasher.signature()`.
+
+        :return: A `uint64` array of length `self.nr_permutations` containing
+        the (densified) minimum hash value of each bin. An empty document gets
+        the maximum hash value `MAX_HASH` for each bin.
+        """
+        if isinstance(shingle_ids, np.ndarray):
+            hash_values = shingle_ids.astype(np.uint64)
+        else:
+            hash_values = np.fromiter(shingle_ids, dtype=np.uint64)
+
+        signature = np.full(self.nr_permutations, MAX_HASH, dtype=np.uint64)
+        if hash_values.size == 0:
+            return signature
+
+        # The upper 32 bits choose the bin, and the lower 32 bits are the value
+        hash_values ^= self._salt
+        mix_bits(hash_values)
+        bins = (hash_values >> np.uint64(32)) * np.uint64(self.nr_permutations)
+        bins >>= np.uint64(32)
+        np.minimum.at(signature, bins.astype(np.intp), hash_values & MAX_HASH)
+
+        empty = np.ones(self.nr_permutations, dtype=bool)
+        empty[bins.astype(np.intp)] = False
+        if empty.any():
+            self._densify(signature, empty)
+        return signature
+
+    def signature_matrix(self, documents: Iterable[Iterable[int]]) -> np.ndarray:
+        """
+        Computes the one-permutation minhash signatures of a collection of
+        documents.
+
+        :param documents: The documents, each of which is an iterable of shingle
+        IDs.
+
+        :return: A 2-D `uint64` array with one row per document and one column
+        per bin.
+        """
+        with metrics.timed("signatures"):
+            signatures = [self.signature(document) for document in documents]
+        metrics.count("documents", len(signatures))
+        if not signatures:
+            return np.empty((0, self.nr_permutations), dtype=np.uint64)
+        return np.vstack(signatures)
+
+
+class WeightedMinHasher:
+    """
+    A vectorised weighted MinHash implementation, using Ioffe's Improved
+    Consistent Weighted Sampling (ICWS). Each document is a set of integer
+    shingle IDs with a positive weight each, e.g. the number of times the
+    shingle occurs (see `HashedShingler.shingle_counts()`). The probability
+    that two signatures are equal in a row is the weighted Jaccard similarity
+    `sum(min(w_1, w_2)) / sum(max(w_1, w_2))` of the documents, so repeated
+    shingles count more than shingles that occur once.
+
+    The random variables of each shingle and permutation are derived from a
+    hash of the shingle ID, so no vocabulary is needed. Each row of a signature
+    combines the selected shingle and its quantised weight into a single 64-bit
+    value, so the signatures can be banded by `LSH` like those of `MinHasher`.
+    """
+
+    # The number of permutations, i.e. the length of each signature
+    nr_permutations: int
+    # The seed of the random number generator that chose the salts
+    seed: int
+    # The salts of the five random variables of each permutation, with shape
+    # `(5, 1, nr_permutations)` so that they broadcast over the shingles
+    _salts: np.ndarray
+
+    def __init__(self, nr_permutations: int, seed: int = 1) -> None:
+        """
+        Initialises the object by choosing the permutations.
+
+        :param nr_permutations: The number of permutations, which is equal to
+        the number of rows of the signature matrix.
+
+        :param seed: The seed for choosing the permutations.
+        """
+        self.nr_permutations = nr_permutations
+        self.seed = seed
+
+        generator = np.random.RandomState(seed)
+        self._salts = generator.randint(
+            0, 2 ** 63, (5, 1, nr_permutations), dtype=np.uint64
+        )
+
+    def _uniforms(self, shingle_hashes: np.ndarray, variable: int) -> np.ndarray:
+        """
+        Computes a uniform random variable in `(0, 1)` for each shingle and
+        permutation.
+
+        :param shingle_hashes: The mixed shingle IDs, as a column vector.
+
+        :param variable: The index of the random variable.
+
+        :return: A `float64` array with one row per shingle and one column per
+        permutation.
+        """
+        bits = mix_bits(shingle_hashes + self._salts[variable]) >> np.uint64(11)
+        return (bits.astype(np.float64) + 0.5) * 2.0 ** -53
+
+    def signature(
+        self, shingle_ids: Iterable[int], weights: Iterable[float]
+    ) -> np.ndarray:
+        """
+        Computes the weighted minhash signature of a single document.
+
+        :param shingle_ids: The document's distinct shingle IDs.
+
+        :param weights: The weight of each shingle, in the same order. Shingles
+        with a weight of zero are ignored.
+
+        :return: A `uint64` array of length `self.nr_permutations`. An empty
+        document gets the value `MAX_HASH` for each permutation.
+        """
+        shingle_ids = np.asarray(shingle_ids, dtype=np.uint64)
+        weights = np.asarray(weights, dtype=np.float64)
+        shingle_ids = shingle_ids[weights > 0]
+        weights = weights[weights > 0]
+        if shingle_ids.size == 0:
+            return np.full(self.nr_permutations, MAX_HASH, dtype=np.uint64)
+
+        hashes = mix_bits(shingle_ids.reshape(-1, 1))
+        # r and c follow a Gamma(2, 1) distribution, and beta a uniform one
+        r = -np.log(self._uniforms(hashes, 0) * self._uniforms(hashes, 1))
+        c = -np.log(self._uniforms(hashes, 2) * self._uniforms(hashes, 3))
+        beta = self._uniforms(hashes, 4)
+
+        t = np.floor(np.log(weights).reshape(-1, 1) / r + beta)
+        log_a = np.log(c) - r * (t - beta) - r
+        selected = np.argmin(log_a, axis=0)
+
+        columns = np.arange(self.nr_permutations)
+        steps = t[selected, columns].astype(np.int64).astype(np.uint64)
+        return mix_bits(hashes[selected, 0] ^ mix_bits(steps))
+
+    def signature_matrix(
+        self, documents: Iterable[tuple[Iterable[int], Iterable[float]]]
+    ) -> np.ndarray:
+        """
+        Computes the weighted minhash signatures of a collection of documents.
+
+        :param documents: The documents, each of which is a tuple of shingle IDs
+        and their weights (see `signature()`).
+
+        :return: A 2-D `uint64` array with one row per document and one column
+        per permutation.
+        """
+        with metrics.timed("signatures"):
+            signatures = [
+                self.signature(shingle_ids, weights)
+                for shingle_ids, weights in documents
+            ]
+        metrics.count("documents", len(signatures))
+        if not signatures:
+            return np.empty((0, self.nr_permutations), dtype=np.uint64)
+        return np.vstack(signatures)
+
+
+def create_signatures(
+    data: Iterable[Iterable[int]], perm: int, seed: int = 1
+) -> np.ndarray:
+    """
+    Creates the signature matrix of a collection of documents using the
+    vectorised `MinHasher`, as a faster alternative to `create_minhash()`.
+
+    :param data: The documents, each of which is represented by its shingle IDs.
+
+    :param perm: The amount of permutations we want to use to create the minhash
+
+    :param seed: The seed used to choose the permutations.
+
+    :return: The signature matrix, with one row per document.
+    """
+    start = time.time()
+    signatures = MinHasher(perm, seed).signature_matrix(data)
+    print("It took %s seconds to build minhash." % (time.time() - start))
+    return signatures
+
+
 # This function can be used to query top k-results but is currently not needed, may be interesting to use for analysis
 def get_minforest(data, perm):
     """
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3.9
+
+from lsh import LSH
+from main import compute_signatures
+from minhash import MinHasher, WeightedMinHasher
+
+from argparse import ArgumentParser
+from asyncio import (
+    Future,
+    get_running_loop,
+    Queue,
+    StreamReader,
+    StreamWriter,
+    Task,
+    wait_for,
+)
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Optional, Union
+
+import asyncio
+import json
+import metrics
+import numpy as np
+import time
+
+
+class DedupService:
+    """
+    A long-running deduplication service, which indexes articles as they
+    arrive and returns the indexed articles that are near-duplicates of each.
+    The articles of concurrent requests are gathered into micro-batches, so
+    that the shingles and signatures of a whole batch are computed at once (by
+    `main.compute_signatures()`, in an executor), after which each article of
+    the batch is queried and added to the in-memory `LSH` in order of arrival.
+
+    The number of articles waiting for a batch is bounded by `max_pending`.
+    When the queue is full, `enqueue()` waits until there's room again, so that
+    the connections stop being read and their clients are slowed down (i.e.
+    backpressure), instead of the queue growing without bounds.
+    """
+
+    lsh: LSH
+    minhasher: Union[MinHasher, WeightedMinHasher]
+    n: int
+    min_similarity: float
+    max_bucket_size: Optional[int]
+    max_batch_size: int
+    max_delay: float
+    max_pending: int
+    executor: Optional[Executor]
+    max_documents: Optional[int]
+    max_age: Optional[float]
+
+    # The articles that wait for a batch, with their document IDs, their
+    # futures and their arrival times
+    _queue: Optional[Queue]
+    # The items of the batch that is being gathered or processed
+    _batch: list[tuple[str, Optional[int], Future, float]]
+    # The task that processes the batches
+    _task: Optional[Task]
+    # The latencies of the most recent requests, in seconds
+    _latencies: deque
+    # The number of processed requests and batches
+    _nr_requests: int
+    _nr_batches: int
+    # The number of requests that had to wait for room in the queue
+    _nr_waits: int
+
+    def __init__(
+        self,
+        lsh: LSH,
+        minhasher: Union[MinHasher, WeightedMinHasher],
+        n: int = 2,
+        min_similarity: float = 0.8,
+        max_bucket_size: Optional[int] = None,
+        max_batch_size: int = 64,
+        max_delay: float = 0.005,
+        max_pending: int = 1024,
+        executor: Optional[Executor] = None,
+        nr_latencies: int = 10000,
+        max_documents: Optional[int] = None,
+        max_age: Optional[float] = None,
+    ) -> None:
+        """
+        Initialises the service. It only processes requests after `start()`.
+
+        :param lsh: The data structure that the articles are added to. Its
+        number of rows should be the number of permutations of `minhasher`.
+
+        :param minhasher: The object that computes the signatures.
+
+        :param n: The size of the n-grams.
+
+        :param min_similarity: The minimal approximated Jaccard similarity of
+        the matches that are returned.
+
+        :param max_bucket_size: If given, the buckets with more documents than
+        this are ignored (see `LSH.candidate_pairs()`).
+
+        :param max_batch_size: The maximal number of articles per batch.
+
+        :param max_delay: The maximal number of seconds that the first article
+        of a batch waits for more articles.
+
+        :param max_pending: The maximal number of articles that wait for a
+        batch.
+
+        :param executor: The executor that computes the signatures, e.g. a
+        `ProcessPoolExecutor`. By default, the event loop's default executor
+        (i.e. a thread pool) is used.
+
+        :param nr_latencies: The number of recent latencies that the percentiles
+        of `stats()` are computed from.
+
+        :param max_documents:
+        :param max_age: If given, the index only keeps the most recent articles,
+        up to this number of articles or of seconds (see `LSH.evict()`). The
+        `LSH` should then be removable.
+        """
+        if (max_documents is not None or max_age is not None) and not lsh.removable:
+            raise ValueError("Only a removable LSH can keep the most recent articles")
+
+        self.lsh = lsh
+        self.minhasher = minhasher
+        self.n = n
+        self.min_similarity = min_similarity
+        self.max_bucket_size = max_bucket_size
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.executor = executor
+        self.max_documents = max_documents
+        self.max_age = max_age
+        self._queue = None
+        self._batch = []
+        self._task = None
+        self._latencies = deque(maxlen=nr_latencies)
+        self._nr_requests = 0
+        self._nr_batches = 0
+        self._nr_waits = 0
+
+    async def start(self) -> None:
+        """
+        Starts processing batches, in a task of the running event loop.
+        """
+        self._queue = Queue(self.max_pending)
+        self._task = get_running_loop().create_task(self._process_batches())
+
+    async def stop(self) -> None:
+        """
+        Stops processing batches. The requests that are still waiting fail,
+        including those of a batch whose signatures are being computed.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+        self._fail_requests(RuntimeError("The service was stopped"))
+
+    def _fail_requests(self, exception: Exception) -> None:
+        """
+        Fails the requests of the current batch, and those that are still
+        waiting in the queue.
+
+        :param exception: The exception that the requests fail with.
+        """
+        futures = [future for _, _, future, _ in self._batch]
+        self._batch = []
+        while self._queue is not None and not self._queue.empty():
+            futures.append(self._queue.get_nowait()[2])
+        for future in futures:
+            if not future.done():
+                future.set_exception(exception)
+
+    async def enqueue(self, article: str, document_id: Optional[int] = None) -> Future:
+        """
+        Adds an article to the queue, waiting for room if it's full.
+
+        :param article: The text of the article.
+
+        :param document_id: The ID of the article, by default the next unused
+        document ID of the `LSH`.
+
+        :return: A future that is resolved by the article's batch, with a tuple
+        containing the article's document ID and its matches (see `submit()`).
+        """
+        if self._queue is None:
+            raise RuntimeError("The service hasn't been started")
+
+        future = get_running_loop().create_future()
+        item = (article, document_id, future, time.perf_counter())
+        if self._queue.full():
+            self._nr_waits += 1
+        await self._queue.put(item)
+        return future
+
+    async def submit(
+        self, article: str, document_id: Optional[int] = None
+    ) -> tuple[int, dict[int, float]]:
+        """
+        Deduplicates and indexes an article.
+
+        :param article: The text of the article.
+
+        :param document_id: The ID of the article.
+
+        :return: A tuple containing the article's document ID, and a mapping of
+        the IDs of the earlier articles that are near-duplicates of it to their
+        approximated Jaccard similarity.
+        """
+        return await (await self.enqueue(article, document_id))
+
+    async def _next_batch(self) -> list[tuple[str, Optional[int], Future, float]]:
+        """
+        Waits for the next batch: the first article in the queue, and the
+        articles that arrive within `max_delay` seconds after it. The batch is
+        kept in `_batch` until it has been processed, so that `stop()` can fail
+        its requests.
+
+        :return: The queue's items, in order of arrival.
+        """
+        loop = get_running_loop()
+        batch = self._batch = []
+        batch.append(await self._queue.get())
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _process_batches(self) -> None:
+        """
+        Processes the batches one by one, until the task is cancelled.
+        """
+        loop = get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            articles = [article for article, _, _, _ in batch]
+            metrics.observe("batch_size", [len(batch)])
+            try:
+                signatures = await loop.run_in_executor(
+                    self.executor, compute_signatures, articles, self.n, self.minhasher
+                )
+            except Exception as exception:
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(exception)
+                continue
+
+            for (_, document_id, future, arrival), signature in zip(batch, signatures):
+                if future.done():
+                    continue
+                try:
+                    result = self.lsh.add_and_query(
+                        signature,
+                        self.min_similarity,
+                        self.max_bucket_size,
+                        document_id,
+                    )
+                except Exception as exception:
+                    future.set_exception(exception)
+                    continue
+                future.set_result(result)
+                self._latencies.append(time.perf_counter() - arrival)
+
+            self._batch = []
+            self._nr_requests += len(batch)
+            self._nr_batches += 1
+            if self.max_documents is not None or self.max_age is not None:
+                try:
+                    self.lsh.evict(self.max_documents, self.max_age)
+                except Exception as exception:
+                    self._fail_requests(exception)
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns the statistics of the service.
+
+        :return: A JSON-serialisable dictionary containing the number of
+        processed requests and batches, the mean batch size, the current and
+        maximal number of waiting articles, the number of requests that had to
+        wait for room in the queue, and the 50th, 90th and 99th percentiles and
+        the maximum of the recent latencies (in seconds).
+        """
+        latencies = np.array(self._latencies)
+        if len(latencies) > 0:
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99]).tolist()
+            percentiles = {
+                "p50": p50,
+                "p90": p90,
+                "p99": p99,
+                "max": float(latencies.max()),
+            }
+        else:
+            percentiles = {}
+
+        return {
+            "requests": self._nr_requests,
+            "batches": self._nr_batches,
+            "mean_batch_size": self._nr_requests / max(1, self._nr_batches),
+            "queue_size": 0 if self._queue is None else self._queue.qsize(),
+            "max_pending": self.max_pending,
+            "waits": self._nr_waits,
+            "latency_seconds": percentiles,
+        }
+
+    async def _respond(
+        self, writer: StreamWriter, request_id: Any, future: Future
+    ) -> None:
+        """
+        Writes the response to a request once its article has been processed.
+
+        :param writer: The connection's writer.
+
+        :param request_id: The ID of the request, which is sent back with it.
+
+        :param future: The future that was returned by `enqueue()`.
+        """
+        try:
+            document_id, matches = await future
+        except Exception as exception:
+            response = {"id": request_id, "error": str(exception)}
+        else:
+            response = {
+                "id": request_id,
+                "document_id": document_id,
+                "matches": sorted(matches.items(), key=lambda match: -match[1]),
+            }
+        writer.write(json.dumps(response).encode() + b"\n")
+
+    async def handle_connection(
+        self, reader: StreamReader, writer: StreamWriter
+    ) -> None:
+        """
+        Handles the requests of a single connection. Each request is a line of
+        JSON, either `{"id": ..., "article": ..., "document_id": ...}` (with an
+        optional ID and document ID) or `{"id": ..., "command": "stats"}`. The
+        responses are lines of JSON with the same `"id"`, either with the
+        `"document_id"` and `"matches"` of the article (a list of `[id,
+        similarity]` pairs, by decreasing similarity) or with the statistics.
+        Several requests can be sent without waiting for their responses, which
+        are then written in the order in which the articles are processed.
+        Invalid requests get a response with an `"error"`.
+
+        :param reader:
+        :param writer: The streams of the connection.
+        """
+        responses = []
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    request_id = request.get("id")
+                    if request.get("command") == "stats":
+                        response = {"id": request_id, "stats": self.stats()}
+                        writer.write(json.dumps(response).encode() + b"\n")
+                        continue
+                    future = await self.enqueue(
+                        request["article"], request.get("document_id")
+                    )
+                except (ValueError, KeyError, TypeError, AttributeError) as exception:
+                    response = {"error": f"Invalid request: {exception!r}"}
+                    writer.write(json.dumps(response).encode() + b"\n")
+                    continue
+
+                responses.append(
+                    get_running_loop().create_task(
+                        self._respond(writer, request_id, future)
+                    )
+                )
+                responses = [task for task in responses if not task.done()]
+                await writer.drain()
+
+            for task in responses:
+                await task
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(
+    service: DedupService,
+    socket_path: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+) -> asyncio.AbstractServer:
+    """
+    Starts a service and a server for it, on a Unix socket or on a TCP port.
+
+    :param service: The service.
+
+    :param socket_path: The path of the Unix socket. If not given, the server
+    listens on `host` and `port` instead.
+
+    :param host:
+    :param port: The address to listen on, e.g. localhost.
+
+    :return: The server, which is already accepting connections.
+    """
+    await service.start()
+    if socket_path is not None:
+        return await asyncio.start_unix_server(service.handle_connection, socket_path)
+    return await asyncio.start_server(service.handle_connection, host, port)
+
+
+def main(arguments: Optional[list[str]] = None) -> None:
+    """
+    Runs the service from the command line, until it's interrupted.
+
+    :param arguments: The command line arguments, by default `sys.argv[1:]`.
+    """
+    parser = ArgumentParser(description="Runs the deduplication service.")
+    parser.add_argument("--socket", help="The Unix socket to listen on.")
+    parser.add_argument("--host", default="127.0.0.1", help="The host to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="The port.")
+    parser.add_argument("--n", type=int, default=2, help="The size of the n-grams.")
+    parser.add_argument("--bands", type=int, default=25, help="The number of bands.")
+    parser.add_argument("--rows", type=int, default=5, help="The rows per band.")
+    parser.add_argument("--seed", type=int, default=1, help="The minhash seed.")
+    parser.add_argument(
+        "--min-similarity", type=float, default=0.8, help="The similarity threshold."
+    )
+    parser.add_argument(
+        "--max-batch-size", type=int, default=64, help="The articles per batch."
+    )
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=0.005,
+        help="The seconds that a batch waits for more articles.",
+    )
+    parser.add_argument(
+        "--max-pending", type=int, default=1024, help="The size of the queue."
+    )
+    parser.add_argument(
+        "--window-documents", type=int, help="The number of articles to keep."
+    )
+    parser.add_argument(
+        "--window-seconds", type=float, help="The age of the oldest articles to keep."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="The number of processes that compute the signatures.",
+    )
+    options = parser.parse_args(arguments)
+
+    async def run() -> None:
+        with ProcessPoolExecutor(options.workers) as executor:
+            windowed = (
+                options.window_documents is not None
+                or options.window_seconds is not None
+            )
+            service = DedupService(
+                LSH(options.bands, options.rows, fast_hashing=True, removable=windowed),
+                MinHasher(options.bands * options.rows, options.seed),
+                options.n,
+                options.min_similarity,
+                max_batch_size=options.max_batch_size,
+                max_delay=options.max_delay,
+                max_pending=options.max_pending,
+                executor=executor,
+                max_documents=options.window_documents,
+                max_age=options.window_seconds,
+            )
+            server = await serve(service, options.socket, options.host, options.port)
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                await service.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
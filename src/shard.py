@@ -0,0 +1,398 @@
+#!/usr/bin/env python3.9
+
+from lsh import LSH
+
+from collections.abc import Generator, Iterable
+from itertools import islice
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from os import cpu_count
+from typing import Any, Optional, Union
+
+import numpy as np
+
+
+def _serve_shard(
+    connection: Connection, nr_bands: int, rows_per_band: int, kwargs: dict[str, Any]
+) -> None:
+    """
+    Runs a shard in a worker process: an `LSH` data structure with a subset of
+    the bands, which handles the commands it receives until it's closed.
+
+    :param connection: The worker's end of the pipe to the coordinator. Each
+    command is a tuple `(name, arguments)`, and each is answered with a tuple
+    `(result, exception)`.
+
+    :param nr_bands:
+    :param rows_per_band: The shape of the shard's bands.
+
+    :param kwargs: The other arguments of `LSH.__init__()`.
+    """
+    lsh = LSH(nr_bands, rows_per_band, **kwargs)
+    # The pairs of the current `candidate_pairs()` call, which are sent in chunks
+    pairs = iter(())
+    while True:
+        command, arguments = connection.recv()
+        if command == "close":
+            connection.close()
+            return
+
+        try:
+            if command == "add_documents":
+                lsh.add_documents(*arguments)
+                result = None
+            elif command == "pair_counts":
+                pairs = lsh.pair_counts(*arguments)
+                result = None
+            elif command == "next_pair_counts":
+                chunk = [
+                    (pair[0], pair[1], count)
+                    for pair, count in islice(pairs, arguments[0])
+                ]
+                result = np.array(chunk, dtype=np.int64).reshape(-1, 3)
+            elif command == "query_document":
+                result = lsh.query_document(arguments[0], 0.0, arguments[1])
+            else:
+                raise ValueError(f"Unknown command: {command}")
+        except Exception as exception:
+            connection.send((None, exception))
+        else:
+            connection.send((result, None))
+
+
+class ShardedLSH:
+    """
+    An LSH data structure whose bands are partitioned over worker processes.
+    Each shard is an `LSH` with a contiguous range of the bands, which hashes
+    its own rows of the signatures and keeps its own buckets. A query is sent
+    to all shards at once, each shard counts the buckets that the pairs share
+    in its bands, and the coordinator adds these counts up. The results are
+    the same as those of a single `LSH` with all bands, but the work of
+    indexing and querying is spread over `nr_shards` processors.
+
+    The shards are partitioned by band rather than by document, since the
+    pairs of a band never depend on other bands, while the pairs of a document
+    range depend on all other documents.
+    """
+
+    nr_bands: int
+    rows_per_band: int
+    nr_shards: int
+    chunk_size: int
+
+    # The first band of each shard, followed by the total number of bands
+    _boundaries: list[int]
+    # The coordinator's end of the pipe to each shard
+    _connections: list[Connection]
+    # The worker process of each shard
+    _processes: list[Process]
+    # The next unused document ID
+    _next_doc_id: int
+
+    def __init__(
+        self,
+        nr_bands: int,
+        rows_per_band: int,
+        nr_shards: Optional[int] = None,
+        chunk_size: int = 100000,
+        **kwargs,
+    ) -> None:
+        """
+        Starts the worker processes, each with an empty shard.
+
+        :param nr_bands:
+        :param rows_per_band: The number of bands and of rows per band, as for
+        `LSH`.
+
+        :param nr_shards: The number of shards, i.e. of worker processes. By
+        default, this is the number of processors, but never more than the
+        number of bands.
+
+        :param chunk_size: The number of pairs that a shard sends at once in
+        `candidate_pairs()`.
+
+        :param kwargs: The other arguments of `LSH.__init__()`, e.g.
+        `fast_hashing=True`, which are used by each shard.
+        """
+        self.nr_bands = nr_bands
+        self.rows_per_band = rows_per_band
+        self.nr_shards = min(nr_shards or cpu_count() or 1, nr_bands)
+        self.chunk_size = chunk_size
+        self._boundaries = [
+            band * nr_bands // self.nr_shards for band in range(self.nr_shards + 1)
+        ]
+        self._next_doc_id = 0
+
+        self._connections = []
+        self._processes = []
+        for start, end in zip(self._boundaries, self._boundaries[1:]):
+            connection, worker_connection = Pipe()
+            process = Process(
+                target=_serve_shard,
+                args=(worker_connection, end - start, rows_per_band, kwargs),
+                daemon=True,
+            )
+            process.start()
+            worker_connection.close()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+    # The minimal number of shared bands, see `LSH.min_band_count()`
+    min_band_count = LSH.min_band_count
+
+    def __enter__(self) -> "ShardedLSH":
+        return self
+
+    def __exit__(self, *exception: Any) -> None:
+        self.close()
+
+    @property
+    def nr_rows(self) -> int:
+        """
+        Returns the number of rows of the matrix.
+        """
+        return self.nr_bands * self.rows_per_band
+
+    def close(self) -> None:
+        """
+        Stops the worker processes. The data structure can't be used afterwards.
+        """
+        for connection in self._connections:
+            connection.send(("close", ()))
+            connection.close()
+        for process in self._processes:
+            process.join()
+        self._connections = []
+        self._processes = []
+
+    def _broadcast(
+        self, command: str, arguments: list[tuple], shards: Optional[list[int]] = None
+    ) -> list[Any]:
+        """
+        Sends a command to several shards, and waits until they have all
+        answered.
+
+        :param command: The name of the command.
+
+        :param arguments: The arguments of the command, for each shard.
+
+        :param shards: The indices of the shards. By default, the command is
+        sent to all shards.
+
+        :return: The result of each shard.
+        """
+        if shards is None:
+            connections = self._connections
+        else:
+            connections = [self._connections[shard] for shard in shards]
+        for connection, shard_arguments in zip(connections, arguments):
+            connection.send((command, shard_arguments))
+
+        results = []
+        for connection in connections:
+            results.append(connection.recv())
+        for _, exception in results:
+            if exception is not None:
+                raise exception
+        return [result for result, _ in results]
+
+    def add_documents(
+        self, signatures: np.ndarray, document_ids: Optional[Iterable[int]] = None
+    ) -> Union[range, np.ndarray]:
+        """
+        Adds several documents, by sending each shard the rows of its bands.
+
+        :param signatures: The signature matrix, with one row per document.
+
+        :param document_ids: The IDs of the documents. By default, the next
+        unused column numbers are used.
+
+        :return: The IDs of the new documents, see `LSH.add_documents()`.
+        """
+        signatures = np.asarray(signatures, dtype=np.uint64)
+        first_id = self._next_doc_id
+        if document_ids is None:
+            result = range(first_id, first_id + len(signatures))
+            document_ids = np.arange(first_id, first_id + len(signatures))
+        else:
+            document_ids = result = np.asarray(document_ids, dtype=np.int64)
+            if len(document_ids) != len(signatures):
+                raise ValueError("There should be one document ID per signature")
+
+        rows = [band * self.rows_per_band for band in self._boundaries]
+        self._broadcast(
+            "add_documents",
+            [
+                (np.ascontiguousarray(signatures[:, start:end]), document_ids)
+                for start, end in zip(rows, rows[1:])
+            ],
+        )
+
+        if len(document_ids) > 0:
+            self._next_doc_id = max(self._next_doc_id, int(document_ids.max()) + 1)
+        return result
+
+    def add_document(
+        self, minhash_values: Iterable[int], document_id: Optional[int] = None
+    ) -> int:
+        """
+        Adds a single document, see `add_documents()`.
+
+        :param minhash_values: The document's minhash signature.
+
+        :param document_id: The ID of the document.
+
+        :return: The document's ID.
+        """
+        signature = np.asarray(minhash_values, dtype=np.uint64).reshape(1, -1)
+        document_ids = None if document_id is None else [document_id]
+        return int(self.add_documents(signature, document_ids)[0])
+
+    def candidate_pairs(
+        self, min_similarity: float = 0.0, max_bucket_size: Optional[int] = None
+    ) -> Generator[tuple[tuple[int, int], float], None, None]:
+        """
+        Yields the pairs of similar documents, like `LSH.candidate_pairs()`. The
+        shards count the pairs of their bands in parallel. A pair that shares
+        fewer than `c - (nr_bands - shard_bands)` buckets in a shard can't
+        reach `c` buckets in total, so each shard only sends back the pairs
+        that can.
+
+        The shards send their pairs in chunks of `chunk_size`, ordered by the
+        first document. The pairs of the documents before the last one that
+        every shard has reached are complete, so these are merged and yielded
+        before the next chunks are requested. The coordinator thus only keeps
+        about `chunk_size` pairs per shard in memory (or more, if a single
+        document has more pairs in a shard). Since the shards keep the state of
+        the query, only one of these generators should be consumed at a time.
+
+        :param min_similarity: The minimal approximated Jaccard similarity of
+        the pairs that are yielded.
+
+        :param max_bucket_size: If given, the buckets with more documents than
+        this are ignored.
+
+        :return: A generator that yields tuples `((id_1, id_2), similarity)`,
+        with `id_1 < id_2`, ordered by `id_1` and then by `id_2`.
+        """
+        min_count = self.min_band_count(min_similarity)
+        self._broadcast(
+            "pair_counts",
+            [
+                (max(1, min_count - (self.nr_bands - (end - start))), max_bucket_size)
+                for start, end in zip(self._boundaries, self._boundaries[1:])
+            ],
+        )
+
+        buffers = [np.empty((0, 3), dtype=np.int64) for _ in range(self.nr_shards)]
+        # The shards that may still send pairs
+        active = list(range(self.nr_shards))
+        requested = list(active)
+        while requested:
+            chunks = self._broadcast(
+                "next_pair_counts", [(self.chunk_size,)] * len(requested), requested
+            )
+            for shard, chunk in zip(requested, chunks):
+                buffers[shard] = np.concatenate((buffers[shard], chunk))
+                if len(chunk) < self.chunk_size:
+                    active.remove(shard)
+
+            # The pairs of the documents before `bound` are complete
+            if active:
+                bound = min(buffers[shard][-1, 0] for shard in active)
+                splits = [
+                    np.searchsorted(buffer[:, 0], bound, side="left")
+                    for buffer in buffers
+                ]
+            else:
+                splits = [len(buffer) for buffer in buffers]
+            counts = np.concatenate(
+                [buffer[:split] for buffer, split in zip(buffers, splits)]
+            )
+            buffers = [buffer[split:] for buffer, split in zip(buffers, splits)]
+            yield from self._merge_counts(counts, min_count)
+
+            # Only the shards that haven't passed `bound` are asked for more
+            requested = [shard for shard in active if buffers[shard][-1, 0] == bound]
+
+    def _merge_counts(
+        self, counts: np.ndarray, min_count: int
+    ) -> Generator[tuple[tuple[int, int], float], None, None]:
+        """
+        Adds up the counts of the shards, for the pairs of a range of documents.
+
+        :param counts: An array with rows `(id_1, id_2, count)`, which contains
+        the counts of each shard for all of the pairs in the range.
+
+        :param min_count: The minimal total number of shared buckets.
+
+        :return: A generator that yields tuples `((id_1, id_2), similarity)`,
+        ordered by `id_1` and then by `id_2`.
+        """
+        if len(counts) == 0:
+            return
+        order = np.lexsort((counts[:, 1], counts[:, 0]))
+        counts = counts[order]
+        first = np.ones(len(counts), dtype=bool)
+        first[1:] = (counts[1:, :2] != counts[:-1, :2]).any(axis=1)
+        starts = np.flatnonzero(first)
+        totals = np.add.reduceat(counts[:, 2], starts)
+
+        selected = totals >= min_count
+        pairs = counts[starts[selected], :2].tolist()
+        similarities = (totals[selected] / self.nr_bands).tolist()
+        for (id_1, id_2), similarity in zip(pairs, similarities):
+            yield (id_1, id_2), similarity
+
+    def query_document(
+        self,
+        minhash_values: Iterable[int],
+        min_similarity: float = 0.0,
+        max_bucket_size: Optional[int] = None,
+    ) -> dict[int, float]:
+        """
+        Finds the indexed documents that are similar to a new document, without
+        adding it, like `LSH.query_document()`.
+
+        :param minhash_values: The new document's minhash signature.
+
+        :param min_similarity: The minimal approximated Jaccard similarity of
+        the documents that are returned.
+
+        :param max_bucket_size: If given, the buckets with more documents than
+        this are ignored.
+
+        :return: A mapping of the IDs of the similar documents to their
+        approximated Jaccard similarity with the new document.
+        """
+        signature = np.asarray(minhash_values, dtype=np.uint64)
+        rows = [band * self.rows_per_band for band in self._boundaries]
+        shard_matches = self._broadcast(
+            "query_document",
+            [
+                (signature[start:end], max_bucket_size)
+                for start, end in zip(rows, rows[1:])
+            ],
+        )
+
+        # The shards return similarities relative to their own bands
+        counts: dict[int, int] = {}
+        for (start, end), matches in zip(
+            zip(self._boundaries, self._boundaries[1:]), shard_matches
+        ):
+            for document_id, similarity in matches.items():
+                count = round(similarity * (end - start))
+                counts[document_id] = counts.get(document_id, 0) + count
+
+        min_count = self.min_band_count(min_similarity)
+        return {
+            document_id: count / self.nr_bands
+            for document_id, count in counts.items()
+            if count >= min_count
+        }
+
+    def query(self) -> dict[tuple[int, int], float]:
+        """
+        Returns the IDs of the similar documents, see `LSH.query()`.
+        """
+        return dict(self.candidate_pairs())
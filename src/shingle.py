@@ -1,7 +1,13 @@
 #!/usr/bin/env python3.9
 
+from collections import OrderedDict
 from collections.abc import Generator, Iterable
-from typing import Union, TypeVar
+from hashlib import blake2b
+from re import compile
+from typing import Optional, Union, TypeVar
+
+import metrics
+import numpy as np
 
 
 def get_ngrams(text: Iterable[str], n: int) -> Generator[tuple[str, ...], None, None]:
@@ -39,20 +45,34 @@ def get_ngrams(text: Iterable[str], n: int) -> Generator[tuple[str, ...], None,
 class ShingleSetGenerator(Iterable):
     """
     A generator class that produces a set of shingles for each list of strings
-    in a list of lists of strings. The object also keeps track of which numbers
-    are used for which n-grams. (TODO remove this?)
+    in a list of lists of strings. By default, the object also keeps track of
+    which numbers are used for which n-grams. In hashed mode, the numbers are
+    the n-grams' `hash_shingle()` hashes instead, so no vocabulary has to be
+    kept, and only a bounded cache of n-grams remains for reverse lookups.
     """
 
     # The input: an iterable of documents, which are iterables of strings
     _text: Iterable[Iterable[str]]
     # The size of the n-grams
     _n: int
+    # Whether the shingle IDs are hashes, instead of indices in `self.shingles`
+    _hashed: bool
+    # The maximal number of n-grams in `self._cache`
+    _cache_size: int
+    # The most recently used n-grams, by their ID, in hashed mode
+    _cache: OrderedDict[int, tuple[str, ...]]
     # A list of all of the n-grams, in order of insertion
     shingles: list[tuple[str, ...]]
     # A mapping of n-grams to their indices in `self.ngrams`
     inverse_shingles: dict[tuple[str, ...], int]
 
-    def __init__(self, text: Iterable[Iterable[str]], n: int) -> None:
+    def __init__(
+        self,
+        text: Iterable[Iterable[str]],
+        n: int,
+        hashed: bool = False,
+        cache_size: int = 0,
+    ) -> None:
         """
         Initialises the object, but doesn't generate any shingles yet.
 
@@ -60,9 +80,19 @@ class ShingleSetGenerator(Iterable):
         iterables of strings.
 
         :param n: The size of the n-grams.
+
+        :param hashed: Whether the shingles are identified by their hashes. The
+        IDs are then stable across runs and processes, and `self.shingles` and
+        `self.inverse_shingles` stay empty, so the memory usage is constant.
+
+        :param cache_size: In hashed mode, the number of n-grams that are kept
+        for `lookup()`. The least recently used n-grams are evicted first.
         """
         self._text = text
         self._n = n
+        self._hashed = hashed
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
         self.shingles = []
         self.inverse_shingles = {}
 
@@ -70,10 +100,15 @@ class ShingleSetGenerator(Iterable):
         """
         Returns a generator that yields the sets of shingles for our input data.
         This function adds new shingles it hasn't encountered before to the
-        internal list of shingles and to the mapping of shingles to IDs.
+        internal list of shingles and to the mapping of shingles to IDs, or, in
+        hashed mode, to the cache of recently used shingles.
 
         :return: A `Generator` object that yields sets of shingle IDs.
         """
+        if self._hashed:
+            yield from self._iter_hashed()
+            return
+
         for entry in self._text:
             shingles = set()
             for ngram in get_ngrams(entry, self._n):
@@ -86,8 +121,240 @@ class ShingleSetGenerator(Iterable):
                 else:
                     shingles.add(self.inverse_shingles[ngram])
 
+            metrics.count("shingles", len(shingles))
+            yield shingles
+
+    def _iter_hashed(self) -> Generator[set[int], None, None]:
+        """
+        Returns a generator that yields the sets of hashed shingles for our
+        input data.
+
+        :return: A `Generator` object that yields sets of shingle hashes.
+        """
+        for entry in self._text:
+            if self._cache_size <= 0:
+                shingles = get_hashed_shingle_set(entry, self._n)
+                metrics.count("shingles", len(shingles))
+                yield shingles
+                continue
+
+            shingles = set()
+            for ngram in get_ngrams(entry, self._n):
+                fingerprint = hash_shingle(ngram)
+                shingles.add(fingerprint)
+                self._remember(fingerprint, ngram)
+            metrics.count("shingles", len(shingles))
             yield shingles
 
+    def _remember(self, fingerprint: int, ngram: tuple[str, ...]) -> None:
+        """
+        Adds an n-gram to the cache, or marks it as the most recently used one,
+        and evicts the least recently used n-gram if the cache is full.
+
+        :param fingerprint: The n-gram's ID.
+
+        :param ngram: The n-gram.
+        """
+        self._cache[fingerprint] = ngram
+        self._cache.move_to_end(fingerprint)
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    def lookup(self, fingerprint: int) -> Optional[tuple[str, ...]]:
+        """
+        Returns the n-gram for a shingle ID, e.g. to inspect the shingles that
+        two matching documents have in common.
+
+        :param fingerprint: The shingle ID, as yielded by this object.
+
+        :return: The n-gram, or `None` if it is unknown. In hashed mode, this is
+        the case for the n-grams that were evicted from the cache.
+        """
+        if not self._hashed:
+            if 0 <= fingerprint < len(self.shingles):
+                return self.shingles[fingerprint]
+            return None
+
+        ngram = self._cache.get(fingerprint)
+        if ngram is not None:
+            self._cache.move_to_end(fingerprint)
+        return ngram
+
+
+def hash_shingle(shingle: tuple[str, ...]) -> int:
+    """
+    Computes a stable 64-bit ID for a shingle. Unlike the IDs handed out by the
+    `ShingleSetGenerator`, this ID doesn't depend on the order in which the
+    shingles are encountered, nor on the process computing it.
+
+    :param shingle: The shingle as a tuple of strings.
+
+    :return: The first 8 bytes of the shingle's BLAKE2b hash, as an integer.
+    """
+    digest = blake2b(convert_str_shingle_to_bytes(shingle), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def get_hashed_shingle_set(text: Iterable[str], n: int) -> set[int]:
+    """
+    Returns the set of shingles of a piece of text, with each shingle
+    represented by its `hash_shingle()` ID.
+
+    :param text: The input text as a list of words.
+
+    :param n: The size of the n-grams.
+
+    :return: The set of hashed shingle IDs.
+    """
+    return {hash_shingle(ngram) for ngram in get_ngrams(text, n)}
+
+
+class _TokenHashes(dict):
+    """
+    A cache of token hashes, which computes the hashes of missing tokens. This
+    allows looking up the hashes of a whole list of tokens with `map()`.
+    """
+
+    def __missing__(self, word: str) -> int:
+        digest = blake2b(word.encode(), digest_size=8).digest()
+        hash_value = self[word] = int.from_bytes(digest, "big")
+        return hash_value
+
+
+class HashedShingler:
+    """
+    A high-throughput alternative to `get_ngrams()` and `ShingleSetGenerator`.
+    Each token is hashed to a 64-bit integer once, and the n-gram hashes are
+    computed from the token hashes with a NumPy sliding window, i.e. without
+    creating a tuple or string for each n-gram.
+    """
+
+    # The pattern that matches a single token
+    _word = compile(r"\w+")
+
+    # The size of the n-grams
+    _n: int
+    # A cache of the hashes of the tokens that were encountered
+    _token_hashes: "_TokenHashes"
+    # The maximal number of tokens in the cache
+    _max_cached_tokens: int
+    # The multiplier of each position within an n-gram
+    _multipliers: np.ndarray
+
+    def __init__(self, n: int, max_cached_tokens: int = 1000000) -> None:
+        """
+        Initialises the object.
+
+        :param n: The size of the n-grams.
+
+        :param max_cached_tokens: The maximal number of token hashes that are
+        cached. When the cache is full, it is cleared.
+        """
+        self._n = n
+        self._token_hashes = _TokenHashes()
+        self._max_cached_tokens = max_cached_tokens
+
+        # Odd multipliers, so that each position is mapped one-to-one
+        generator = np.random.RandomState(n)
+        self._multipliers = generator.randint(0, 2 ** 63, n, dtype=np.uint64)
+        self._multipliers = self._multipliers * np.uint64(2) + np.uint64(1)
+
+    def tokenize(self, text: str) -> list[str]:
+        """
+        Splits a text into lowercase words, similar to `main.read_data()` but
+        without any empty words.
+
+        :param text: The text.
+
+        :return: The list of words.
+        """
+        return self._word.findall(text.lower())
+
+    def hash_tokens(self, words: Iterable[str]) -> np.ndarray:
+        """
+        Hashes a list of tokens.
+
+        :param words: The tokens.
+
+        :return: A `uint64` array containing the hash of each token.
+        """
+        if len(self._token_hashes) > self._max_cached_tokens:
+            self._token_hashes.clear()
+
+        words = words if isinstance(words, list) else list(words)
+        hashes = map(self._token_hashes.__getitem__, words)
+        return np.fromiter(hashes, dtype=np.uint64, count=len(words))
+
+    def _ngram_hashes(self, words: Iterable[str]) -> np.ndarray:
+        """
+        Computes the hash of each n-gram of a list of words. The hash of an
+        n-gram is the sum of its token hashes, each multiplied by a constant for
+        its position within the n-gram (modulo `2^64`).
+
+        :param words: The input text as a list of words.
+
+        :return: A `uint64` array with the hash of each n-gram, in order.
+        """
+        token_hashes = self.hash_tokens(words)
+        if self._n <= 0 or len(token_hashes) < self._n:
+            return np.empty(0, dtype=np.uint64)
+
+        # Sliding a window of n tokens over the text, one position at a time
+        length = len(token_hashes) - self._n + 1
+        ngram_hashes = token_hashes[:length] * self._multipliers[0]
+        for position in range(1, self._n):
+            window = token_hashes[position : position + length]
+            ngram_hashes += window * self._multipliers[position]
+        return ngram_hashes
+
+    def shingles(self, words: Iterable[str]) -> np.ndarray:
+        """
+        Computes the hashed shingles of a list of words.
+
+        :param words: The input text as a list of words.
+
+        :return: A sorted `uint64` array of the distinct n-gram hashes.
+        """
+        shingles = np.unique(self._ngram_hashes(words))
+        metrics.count("shingles", len(shingles))
+        return shingles
+
+    def shingle_counts(self, words: Iterable[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the hashed shingles of a list of words, and how often each of
+        them occurs, e.g. as the weights of a `WeightedMinHasher`.
+
+        :param words: The input text as a list of words.
+
+        :return: A tuple containing the sorted `uint64` array of the distinct
+        n-gram hashes, and an `int64` array with the number of occurrences of
+        each of them.
+        """
+        shingles, counts = np.unique(self._ngram_hashes(words), return_counts=True)
+        metrics.count("shingles", len(shingles))
+        return shingles, counts
+
+    def shingle_text(self, text: str) -> np.ndarray:
+        """
+        Tokenizes a text, and computes its hashed shingles.
+
+        :param text: The text.
+
+        :return: A sorted `uint64` array of the distinct n-gram hashes.
+        """
+        return self.shingles(self.tokenize(text))
+
+    def __call__(self, texts: Iterable[str]) -> Generator[np.ndarray, None, None]:
+        """
+        Computes the hashed shingles of several texts.
+
+        :param texts: The texts.
+
+        :return: A generator that yields the shingle array of each text.
+        """
+        for text in texts:
+            yield self.shingle_text(text)
+
 
 def convert_int_shingle_to_bytes(shingle: int) -> bytes:
     """
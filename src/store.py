@@ -0,0 +1,234 @@
+#!/usr/bin/env python3.9
+
+from collections.abc import Generator
+from typing import Optional, Union
+
+import numpy as np
+
+
+class SignatureStore:
+    """
+    A compact, contiguous store of minhash signatures, which keeps only the
+    lowest `bits` bits of each minhash value (i.e. b-bit minwise hashing). With
+    32 bits, the signatures of `MinHasher` (whose values are below 2^32) are
+    stored without any loss in half the memory of a `uint64` matrix. With fewer
+    bits, the memory shrinks further, but two different minhash values match
+    with a probability of `2^-bits`, so the similarities are corrected for those
+    accidental matches by `similarities()`.
+
+    Values of 8 bits or more are stored in a matrix of the smallest unsigned
+    integer type that fits them; smaller values are packed into bytes, e.g.
+    four 2-bit values per byte.
+    """
+
+    nr_permutations: int
+    bits: int
+
+    # The packed signatures, with one row per document
+    _packed: np.ndarray
+    # The packed chunks that haven't been added to `_packed` yet
+    _pending: list[np.ndarray]
+
+    # The storage type of each number of bits that is at least 8
+    _dtypes = {8: np.uint8, 16: np.uint16, 32: np.uint32}
+
+    def __init__(
+        self,
+        nr_permutations: int,
+        bits: int = 32,
+        signatures: Optional[np.ndarray] = None,
+    ) -> None:
+        """
+        Initialises the store.
+
+        :param nr_permutations: The number of minhash values per signature.
+
+        :param bits: The number of bits that are kept of each minhash value:
+        1, 2, 4, 8, 16 or 32.
+
+        :param signatures: The signature matrix to store, if any.
+        """
+        if bits not in (1, 2, 4, 8, 16, 32):
+            raise ValueError("The number of bits should be 1, 2, 4, 8, 16 or 32")
+
+        self.nr_permutations = nr_permutations
+        self.bits = bits
+        dtype = self._dtypes.get(bits, np.uint8)
+        self._packed = np.empty((0, self._packed_width), dtype=dtype)
+        self._pending = []
+        if signatures is not None:
+            self.append(signatures)
+
+    @property
+    def _packed_width(self) -> int:
+        """
+        Returns the number of columns of the packed matrix.
+        """
+        if self.bits >= 8:
+            return self.nr_permutations
+        per_byte = 8 // self.bits
+        return (self.nr_permutations + per_byte - 1) // per_byte
+
+    def _pack(self, signatures: np.ndarray) -> np.ndarray:
+        """
+        Packs the lowest bits of each value of a signature matrix.
+
+        :param signatures: The signature matrix, with one row per document.
+
+        :return: The packed matrix.
+        """
+        mask = np.uint64((1 << self.bits) - 1)
+        values = np.asarray(signatures, dtype=np.uint64) & mask
+        if self.bits >= 8:
+            return values.astype(self._dtypes[self.bits])
+
+        per_byte = 8 // self.bits
+        padding = self._packed_width * per_byte - self.nr_permutations
+        values = np.pad(values.astype(np.uint8), ((0, 0), (0, padding)))
+        values = values.reshape(len(values), self._packed_width, per_byte)
+        shifts = np.arange(per_byte, dtype=np.uint8) * np.uint8(self.bits)
+        return np.bitwise_or.reduce(values << shifts, axis=2)
+
+    def _unpack(self, packed: np.ndarray) -> np.ndarray:
+        """
+        Unpacks a packed matrix, see `_pack()`.
+
+        :param packed: The packed matrix.
+
+        :return: The `uint64` matrix of the kept bits of each value.
+        """
+        if self.bits >= 8:
+            return packed.astype(np.uint64)
+
+        per_byte = 8 // self.bits
+        shifts = np.arange(per_byte, dtype=np.uint8) * np.uint8(self.bits)
+        mask = np.uint8((1 << self.bits) - 1)
+        values = (packed[:, :, np.newaxis] >> shifts) & mask
+        values = values.reshape(len(packed), -1)[:, : self.nr_permutations]
+        return values.astype(np.uint64)
+
+    def _matrix(self) -> np.ndarray:
+        """
+        Returns the packed matrix, after adding the pending chunks to it.
+        """
+        if self._pending:
+            self._packed = np.concatenate([self._packed] + self._pending)
+            self._pending = []
+        return self._packed
+
+    @classmethod
+    def from_packed(
+        cls, nr_permutations: int, bits: int, packed: np.ndarray
+    ) -> "SignatureStore":
+        """
+        Creates a store from a packed matrix, e.g. one that was saved and is
+        memory-mapped again.
+
+        :param nr_permutations:
+        :param bits: The parameters of the store the matrix was taken from.
+
+        :param packed: The packed matrix, as returned by `packed`.
+
+        :return: The new store.
+        """
+        store = cls(nr_permutations, bits)
+        if (
+            packed.ndim != 2
+            or packed.shape[1] != store._packed_width
+            or packed.dtype != store._packed.dtype
+        ):
+            raise ValueError("The packed matrix doesn't match the parameters")
+        store._packed = packed
+        return store
+
+    @property
+    def packed(self) -> np.ndarray:
+        """
+        Returns the packed matrix, e.g. to save it (see `from_packed()`).
+        """
+        return self._matrix()
+
+    def append(self, signatures: np.ndarray) -> None:
+        """
+        Adds the signatures of several documents, whose IDs are the next row
+        numbers. This makes the store a drop-in replacement for a list of
+        signature chunks.
+
+        :param signatures: The signature matrix, with one row per document.
+        """
+        signatures = np.asarray(signatures)
+        if signatures.ndim != 2 or signatures.shape[1] != self.nr_permutations:
+            raise ValueError(
+                f"The signatures should have {self.nr_permutations} permutations"
+            )
+        self._pending.append(self._pack(signatures))
+
+    def __len__(self) -> int:
+        return len(self._packed) + sum(len(chunk) for chunk in self._pending)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Returns the number of bytes of the stored signatures.
+        """
+        return self._matrix().nbytes
+
+    def __getitem__(self, index: Union[int, slice, np.ndarray]) -> np.ndarray:
+        """
+        Returns the kept bits of some of the signatures, like indexing the
+        `uint64` signature matrix would.
+
+        :param index: A row number, a slice or an array of row numbers.
+
+        :return: The signature, or the matrix of signatures.
+        """
+        packed = self._matrix()[index]
+        if packed.ndim == 1:
+            return self._unpack(packed.reshape(1, -1))[0]
+        return self._unpack(packed)
+
+    def __array__(self, dtype: Optional[np.dtype] = None) -> np.ndarray:
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    def chunks(self, chunk_size: int = 10000) -> Generator[np.ndarray, None, None]:
+        """
+        Yields the kept bits of the signatures in chunks, e.g. to add them to
+        an `LSH` with `add_documents()` without unpacking all of them at once.
+
+        :param chunk_size: The number of signatures per chunk.
+
+        :return: A generator that yields `uint64` matrices.
+        """
+        matrix = self._matrix()
+        for start in range(0, len(matrix), chunk_size):
+            yield self._unpack(matrix[start : start + chunk_size])
+
+    def similarities(self, pairs: np.ndarray) -> np.ndarray:
+        """
+        Estimates the Jaccard similarities of pairs of documents from their
+        stored signatures. The fraction `m` of equal values overestimates the
+        similarity `s`, since `m = s + (1 - s) * 2^-bits`, so `s` is estimated
+        as `(m - 2^-bits) / (1 - 2^-bits)`, clipped to `[0, 1]`. With 32 bits,
+        the values of `MinHasher` are kept in full, so `m` is used as is, which
+        gives the same estimates as the full signature matrix.
+
+        :param pairs: An integer array of shape `(pairs, 2)` containing the
+        row numbers of the documents of each pair.
+
+        :return: The estimated similarity of each pair.
+        """
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        matrix = self._matrix()
+        if self.bits >= 8:
+            equal = matrix[pairs[:, 0]] == matrix[pairs[:, 1]]
+        else:
+            equal = self._unpack(matrix[pairs[:, 0]]) == self._unpack(
+                matrix[pairs[:, 1]]
+            )
+        matches = equal.mean(axis=1)
+
+        if self.bits == 32:
+            return matches
+        collision = 2.0 ** -self.bits
+        return np.clip((matches - collision) / (1 - collision), 0.0, 1.0)
@@ -1,19 +1,76 @@
 #!/usr/bin/env python3.9
 
-from jaccard import jaccard
-from lsh import LSH
+from benchmark import (
+    benchmark_pipeline,
+    compare_minhash_accuracy,
+    compare_signature_bits,
+    compare_signature_modes,
+    synthetic_corpus,
+    SyntheticCorpus,
+)
+from cache import SignatureCache
+from cluster import UnionFind
+from forest import LSHForest
+from jaccard import (
+    jaccard,
+    jaccard_sorted,
+    minhash_similarity,
+    to_sorted_array,
+    verify_candidates,
+    weighted_jaccard,
+)
+from lsh import (
+    ArrayBand,
+    collision_probability,
+    error_probabilities,
+    hash_bands,
+    LSH,
+    MultiProbeLSH,
+    optimal_parameters,
+    SortedBand,
+)
+from main import (
+    compute_signatures,
+    document_rows,
+    find_similar_articles,
+    generate_histogram,
+    generate_histogram_sampled,
+    generate_histogram_sparse,
+    generate_signatures_parallel,
+    read_csv,
+    read_csv_batches,
+    read_data,
+    shingle_matrix,
+)
+from minhash import MAX_HASH, MinHasher, OnePermutationHasher, WeightedMinHasher
+from service import DedupService, serve
+from shard import ShardedLSH
 from shingle import (
     convert_bytes_shingle_to_bytes,
     convert_int_shingle_to_bytes,
     convert_shingles_to_bytes,
     convert_str_shingle_to_bytes,
+    get_hashed_shingle_set,
     get_ngrams,
+    hash_shingle,
+    HashedShingler,
     ShingleSetGenerator,
 )
+from store import SignatureStore
 
+from concurrent.futures import ThreadPoolExecutor
 from hashlib import sha1
+from importlib.util import find_spec
+from os import path
+from tempfile import TemporaryDirectory
+from threading import Event
 from unittest import TestCase
 
+import asyncio
+import json
+import metrics
+import numpy as np
+
 
 class ShingleTest(TestCase):
     """
@@ -69,6 +126,114 @@ class ShingleTest(TestCase):
             self.assertIn(shingle, generator.inverse_shingles)
             self.assertEqual(index, generator.inverse_shingles[shingle])
 
+    def test_shingle_set_generator_hashed(self) -> None:
+        """
+        Tests the `ShingleSetGenerator` class in hashed mode.
+        """
+        text = [
+            ["a", "b", "c", "d", "e"],
+            ["b", "a", "b"],
+            ["d", "e", "f"],
+        ]
+
+        for cache_size in (0, 3, 100):
+            with self.subTest(cache_size=cache_size):
+                generator = ShingleSetGenerator(text, 2, True, cache_size)
+                for words, shingle_set in zip(text, generator):
+                    self.assertEqual(shingle_set, get_hashed_shingle_set(words, 2))
+
+                self.assertEqual(generator.shingles, [])
+                self.assertEqual(generator.inverse_shingles, {})
+
+                # Only the `cache_size` most recently seen n-grams are known
+                ngrams = {ngram for words in text for ngram in get_ngrams(words, 2)}
+                known = {
+                    ngram
+                    for ngram in ngrams
+                    if generator.lookup(hash_shingle(ngram)) == ngram
+                }
+                self.assertEqual(len(known), min(cache_size, len(ngrams)))
+                if cache_size == 3:
+                    self.assertEqual(known, {("a", "b"), ("d", "e"), ("e", "f")})
+
+        generator = ShingleSetGenerator(text, 2)
+        list(generator)
+        self.assertEqual(generator.lookup(0), ("a", "b"))
+        self.assertIsNone(generator.lookup(100))
+
+    def test_shingle_set_generator_lru(self) -> None:
+        """
+        Tests the eviction of the `ShingleSetGenerator` class's cache.
+        """
+        generator = ShingleSetGenerator([["a", "b", "c"], ["d", "e"]], 2, True, 2)
+        iterator = iter(generator)
+        next(iterator)
+        # Looking up ("a", "b") makes ("b", "c") the least recently used n-gram
+        self.assertEqual(generator.lookup(hash_shingle(("a", "b"))), ("a", "b"))
+        next(iterator)
+        self.assertEqual(generator.lookup(hash_shingle(("a", "b"))), ("a", "b"))
+        self.assertEqual(generator.lookup(hash_shingle(("d", "e"))), ("d", "e"))
+        self.assertIsNone(generator.lookup(hash_shingle(("b", "c"))))
+
+    def test_hash_shingle(self) -> None:
+        """
+        Tests the `hash_shingle()` function.
+        """
+        shingles = [("a", "b"), ("b", "a"), ("ab",), ("a", "b", "c")]
+        hashes = [hash_shingle(shingle) for shingle in shingles]
+
+        self.assertEqual(len(set(hashes)), len(shingles))
+        self.assertEqual(hashes, [hash_shingle(shingle) for shingle in shingles])
+        for hash_value in hashes:
+            self.assertTrue(0 <= hash_value < 2 ** 64)
+
+    def test_get_hashed_shingle_set(self) -> None:
+        """
+        Tests the `get_hashed_shingle_set()` function.
+        """
+        text = ["a", "b", "a", "b", "c"]
+        expected = {
+            hash_shingle(("a", "b")),
+            hash_shingle(("b", "a")),
+            hash_shingle(("b", "c")),
+        }
+        self.assertEqual(get_hashed_shingle_set(text, 2), expected)
+        self.assertEqual(get_hashed_shingle_set(text[:1], 2), set())
+
+    def test_hashed_shingler(self) -> None:
+        """
+        Tests the `HashedShingler` class.
+        """
+        text = "The cat saw the dog; the cat saw a bird. A bird!"
+        words = ["the", "cat", "saw", "the", "dog", "the", "cat", "saw", "a", "bird"]
+        words += ["a", "bird"]
+
+        for n in range(1, 5):
+            with self.subTest(n=n):
+                shingler = HashedShingler(n)
+                self.assertEqual(shingler.tokenize(text), words)
+
+                shingles = shingler.shingle_text(text)
+                self.assertEqual(shingles.dtype, np.uint64)
+                self.assertTrue(np.all(shingles[1:] > shingles[:-1]))
+                self.assertEqual(len(shingles), len(set(get_ngrams(words, n))))
+                self.assertTrue(np.array_equal(shingles, shingler.shingles(words)))
+                self.assertEqual(len(shingler.shingles(words[: n - 1])), 0)
+
+        shingler = HashedShingler(2)
+        self.assertTrue(
+            np.array_equal(shingler.shingles(["a", "b"]), shingler.shingles(["a", "b"]))
+        )
+        self.assertFalse(
+            np.array_equal(shingler.shingles(["a", "b"]), shingler.shingles(["b", "a"]))
+        )
+        shingle_arrays = list(shingler(["a b c", "b c d"]))
+        self.assertEqual(len(np.intersect1d(*shingle_arrays)), 1)
+
+        shingles, counts = shingler.shingle_counts(words)
+        self.assertTrue(np.array_equal(shingles, shingler.shingles(words)))
+        self.assertEqual(sorted(counts.tolist()), [1, 1, 1, 1, 1, 2, 2, 2])
+
     def test_convert_int_shingle_to_bytes(self) -> None:
         """
         Tests the `convert_int_shingle_to_bytes()` function.
@@ -138,6 +303,445 @@ class JaccardTest(TestCase):
 
         for set_1, set_2, similarity in data:
             self.assertEqual(jaccard(set_1, set_2), similarity)
+            array_1, array_2 = to_sorted_array(set_1), to_sorted_array(set_2)
+            self.assertEqual(jaccard(array_1, array_2), similarity)
+
+    def test_to_sorted_array(self) -> None:
+        """
+        Tests the `to_sorted_array()` function.
+        """
+        array = to_sorted_array([5, 3, 9, 3])
+        self.assertEqual(array.dtype, np.uint32)
+        self.assertEqual(array.tolist(), [3, 5, 9])
+
+        array = to_sorted_array({2 ** 40, 1})
+        self.assertEqual(array.dtype, np.uint64)
+        self.assertEqual(array.tolist(), [1, 2 ** 40])
+
+    def test_jaccard_sorted(self) -> None:
+        """
+        Tests the `jaccard_sorted()` function.
+        """
+        generator = np.random.RandomState(0)
+        for _ in range(20):
+            set_1 = set(generator.randint(0, 50, generator.randint(0, 30)).tolist())
+            set_2 = set(generator.randint(0, 50, generator.randint(0, 30)).tolist())
+            self.assertAlmostEqual(
+                jaccard_sorted(to_sorted_array(set_1), to_sorted_array(set_2)),
+                jaccard(set_1, set_2),
+            )
+
+    def test_minhash_similarity(self) -> None:
+        """
+        Tests the `minhash_similarity()` function.
+        """
+        self.assertEqual(minhash_similarity([1, 2, 3, 4], [1, 2, 0, 4]), 0.75)
+        self.assertEqual(minhash_similarity([1, 2], [3, 4]), 0.0)
+
+    def test_verify_candidates(self) -> None:
+        """
+        Tests the `verify_candidates()` function.
+        """
+        documents = [{1, 2, 3, 4}, {1, 2, 3, 5}, {1, 2, 3, 4}, {7, 8}]
+        signatures = np.array([[1, 2, 3, 4], [1, 2, 3, 5], [1, 2, 3, 4], [7, 8, 9, 9]])
+        candidates = [((0, 1), 1.0), ((0, 2), 0.5), ((1, 2), 0.5), ((2, 3), 0.5)]
+
+        for batch_size in (1, 3, 10):
+            with self.subTest(batch_size=batch_size):
+                arrays = [to_sorted_array(document) for document in documents]
+                self.assertEqual(
+                    list(verify_candidates(candidates, arrays, None, 0.5, batch_size)),
+                    [((0, 1), 0.6), ((0, 2), 1.0), ((1, 2), 0.6)],
+                )
+                self.assertEqual(
+                    list(
+                        verify_candidates(candidates, None, signatures, 0.5, batch_size)
+                    ),
+                    [((0, 1), 0.75), ((0, 2), 1.0), ((1, 2), 0.75)],
+                )
+
+        with self.assertRaises(ValueError):
+            list(verify_candidates(candidates))
+
+    def test_weighted_jaccard(self) -> None:
+        """
+        Tests the `weighted_jaccard()` function.
+        """
+        shingles_1 = np.array([1, 2, 3], dtype=np.uint64)
+        shingles_2 = np.array([2, 3, 4], dtype=np.uint64)
+        weights_1 = np.array([1, 2, 3])
+        weights_2 = np.array([4, 1, 1])
+        self.assertEqual(
+            weighted_jaccard(shingles_1, weights_1, shingles_2, weights_2), 3 / 9
+        )
+        self.assertEqual(
+            weighted_jaccard(shingles_1, weights_1, shingles_1, weights_1), 1.0
+        )
+        # With unit weights, this is the Jaccard similarity
+        ones = np.ones(3)
+        self.assertEqual(
+            weighted_jaccard(shingles_1, ones, shingles_2, ones),
+            jaccard_sorted(shingles_1, shingles_2),
+        )
+        empty = np.empty(0, dtype=np.uint64)
+        self.assertEqual(weighted_jaccard(empty, empty, empty, empty), 0.0)
+
+
+class MinHashTest(TestCase):
+    """
+    Tests for the functionality implemented in the `minhash` module.
+    """
+
+    def test_minhasher_signature(self) -> None:
+        """
+        Tests the `MinHasher.signature()` function.
+        """
+        minhasher = MinHasher(16, seed=3)
+        shingles = np.array([5, 17, 3, 99], dtype=np.uint64)
+        signature = minhasher.signature(shingles)
+
+        self.assertEqual(signature.shape, (16,))
+        self.assertEqual(signature.dtype, np.uint64)
+        self.assertTrue(np.all(signature <= MAX_HASH))
+        self.assertTrue(np.array_equal(signature, minhasher.signature({3, 5, 17, 99})))
+        self.assertTrue(
+            np.array_equal(signature, MinHasher(16, seed=3).signature(shingles))
+        )
+        self.assertFalse(
+            np.array_equal(signature, MinHasher(16, seed=4).signature(shingles))
+        )
+        self.assertTrue(np.all(minhasher.signature([]) == MAX_HASH))
+
+    def test_minhasher_signature_matrix(self) -> None:
+        """
+        Tests the `MinHasher.signature_matrix()` function.
+        """
+        minhasher = MinHasher(200)
+        documents = [set(range(0, 100)), set(range(50, 150)), set(range(0, 100))]
+        signatures = minhasher.signature_matrix(documents)
+
+        self.assertEqual(signatures.shape, (3, 200))
+        self.assertTrue(np.array_equal(signatures[0], signatures[2]))
+        # The true Jaccard similarity of the first two documents is 1 / 3
+        estimate = np.mean(signatures[0] == signatures[1])
+        self.assertAlmostEqual(estimate, 1 / 3, delta=0.1)
+
+        self.assertEqual(minhasher.signature_matrix([]).shape, (0, 200))
+
+    def test_one_permutation_hasher(self) -> None:
+        """
+        Tests the `OnePermutationHasher` class.
+        """
+        hasher = OnePermutationHasher(128, seed=3)
+        shingles = np.array([5, 17, 3, 99], dtype=np.uint64)
+        signature = hasher.signature(shingles)
+
+        self.assertEqual(signature.shape, (128,))
+        self.assertEqual(signature.dtype, np.uint64)
+        self.assertTrue(np.all(signature <= MAX_HASH))
+        self.assertTrue(np.array_equal(shingles, [5, 17, 3, 99]))
+        self.assertTrue(np.array_equal(signature, hasher.signature({3, 5, 17, 99})))
+        # With only 4 shingles, the densification fills all other bins
+        self.assertLessEqual(len(np.unique(signature)), 4)
+        self.assertFalse(
+            np.array_equal(signature, OnePermutationHasher(128, 4).signature(shingles))
+        )
+        self.assertTrue(np.all(hasher.signature([]) == MAX_HASH))
+
+        documents = [set(range(0, 300)), set(range(100, 400)), set(range(0, 300))]
+        signatures = hasher.signature_matrix(documents)
+        self.assertEqual(signatures.shape, (3, 128))
+        self.assertTrue(np.array_equal(signatures[0], signatures[2]))
+        # The true Jaccard similarity of the first two documents is 1 / 2
+        self.assertAlmostEqual(minhash_similarity(*signatures[:2]), 1 / 2, delta=0.1)
+        self.assertEqual(hasher.signature_matrix([]).shape, (0, 128))
+
+        lsh = LSH(32, 4)
+        for signature in signatures:
+            lsh.add_document(signature)
+        self.assertEqual(lsh.query_document(signatures[0], 0.9), {0: 1.0, 2: 1.0})
+
+    def test_weighted_minhasher(self) -> None:
+        """
+        Tests the `WeightedMinHasher` class.
+        """
+        minhasher = WeightedMinHasher(500, seed=2)
+        signature = minhasher.signature([1, 2, 3, 4], [1, 2, 3, 4])
+        self.assertEqual(signature.shape, (500,))
+        self.assertEqual(signature.dtype, np.uint64)
+        self.assertTrue(
+            np.array_equal(
+                signature, minhasher.signature([1, 2, 3, 4, 5], [1, 2, 3, 4, 0])
+            )
+        )
+        self.assertTrue(
+            np.array_equal(
+                signature,
+                WeightedMinHasher(500, seed=2).signature([1, 2, 3, 4], [1, 2, 3, 4]),
+            )
+        )
+        self.assertTrue(np.all(minhasher.signature([], []) == MAX_HASH))
+
+        # The weighted Jaccard similarity of these documents is 4 / 15
+        documents = [([1, 2, 3, 4], [1, 2, 3, 4]), ([1, 2, 3, 5], [2, 2, 1, 4])]
+        signatures = minhasher.signature_matrix(documents)
+        self.assertEqual(signatures.shape, (2, 500))
+        self.assertAlmostEqual(minhash_similarity(*signatures), 4 / 15, delta=0.06)
+
+        # Scaling the weights of a shingle changes the similarity
+        documents = [([1, 2], [1, 1]), ([1, 2], [1, 3])]
+        signatures = minhasher.signature_matrix(documents)
+        self.assertAlmostEqual(minhash_similarity(*signatures), 2 / 4, delta=0.06)
+        self.assertEqual(minhasher.signature_matrix([]).shape, (0, 500))
+
+
+class MainTest(TestCase):
+    """
+    Tests for the functionality implemented in the `main` module.
+    """
+
+    def test_document_rows(self) -> None:
+        """
+        Tests the `document_rows()` function.
+        """
+        pairs = [((105, 230), 0.5), ((7, 105), 1.0)]
+        self.assertEqual(list(document_rows(pairs, None)), pairs)
+        self.assertEqual(
+            list(document_rows(pairs, np.array([105, 7, 230]))),
+            [((0, 2), 0.5), ((1, 0), 1.0)],
+        )
+
+        # The rows index the signatures, whatever the IDs are
+        signatures = np.array([[1, 2, 3, 4], [1, 2, 3, 5], [9, 9, 9, 9]])
+        lsh = LSH(2, 2)
+        document_ids = np.array([10 ** 9, 42, 7])
+        lsh.add_documents(signatures, document_ids)
+        results = verify_candidates(
+            document_rows(lsh.candidate_pairs(), document_ids), signatures=signatures
+        )
+        self.assertEqual(list(results), [((1, 0), 0.75)])
+
+    def test_generate_signatures_parallel(self) -> None:
+        """
+        Tests the `generate_signatures_parallel()` function.
+        """
+        articles = [
+            "The quick brown fox jumps over the lazy dog.",
+            "A quick brown fox jumped over the lazy dog!",
+            "Something completely different.",
+            "",
+            "The quick brown fox jumps over the lazy dog.",
+        ]
+        rows = [
+            {"News_ID": str(index), "article": text}
+            for index, text in enumerate(articles)
+        ]
+        minhasher = MinHasher(20)
+
+        expected = compute_signatures(articles, 2, minhasher)
+        self.assertEqual(expected.shape, (5, 20))
+        self.assertTrue(np.array_equal(expected[0], expected[4]))
+
+        for nr_workers, chunk_size in [(1, 5), (2, 1), (3, 2)]:
+            with self.subTest(nr_workers=nr_workers, chunk_size=chunk_size):
+                chunks = generate_signatures_parallel(
+                    rows, 2, minhasher, nr_workers, chunk_size
+                )
+                self.assertTrue(np.array_equal(np.vstack(list(chunks)), expected))
+
+        weighted = compute_signatures(articles, 2, WeightedMinHasher(20))
+        self.assertEqual(weighted.shape, (5, 20))
+        self.assertTrue(np.array_equal(weighted[0], weighted[4]))
+        self.assertFalse(np.array_equal(weighted[0], expected[0]))
+
+    def test_find_similar_articles(self) -> None:
+        """
+        Tests the `find_similar_articles()` function.
+        """
+        articles = [
+            "The quick brown fox jumps over the lazy dog.",
+            "Something completely different.",
+            "A quick brown fox jumped over the lazy dog!",
+        ]
+        minhasher = MinHasher(32)
+        forest = LSHForest(4, 8)
+        forest.add_documents(compute_signatures(articles, 2, minhasher), [7, 8, 9])
+
+        results = find_similar_articles(
+            ["the quick brown fox jumps over the lazy dog"], forest, minhasher, k=1
+        )
+        self.assertEqual(results, [[(7, 1.0)]])
+
+    def test_read_csv_batches(self) -> None:
+        """
+        Tests the `read_csv_batches()` function.
+        """
+        engines = ["csv"] + [
+            engine for engine in ("pandas", "pyarrow") if find_spec(engine) is not None
+        ]
+
+        with TemporaryDirectory() as directory:
+            filename = path.join(directory, "articles.csv")
+            with open(filename, "w") as csv_file:
+                csv_file.write("News_ID,title,article\n")
+                for news_id in range(10, 17):
+                    csv_file.write(f'{news_id},T{news_id},"Text, {news_id}\nmore"\n')
+            rows = list(read_csv(filename))
+
+            for engine in engines:
+                with self.subTest(engine=engine):
+                    batches = list(read_csv_batches(filename, 3, engine=engine))
+                    self.assertEqual(
+                        [len(batch["article"]) for batch in batches], [3, 3, 1]
+                    )
+                    for batch in batches:
+                        self.assertEqual(set(batch), {"News_ID", "article"})
+                        self.assertEqual(batch["News_ID"].dtype, np.int64)
+
+                    self.assertEqual(
+                        np.concatenate(
+                            [batch["News_ID"] for batch in batches]
+                        ).tolist(),
+                        [int(row["News_ID"]) for row in rows],
+                    )
+                    self.assertEqual(
+                        sum((batch["article"] for batch in batches), []),
+                        [row["article"] for row in rows],
+                    )
+
+            with self.assertRaises(ValueError):
+                list(read_csv_batches(filename, engine="unknown"))
+
+    def test_shingle_matrix(self) -> None:
+        """
+        Tests the `shingle_matrix()` function.
+        """
+        matrix = shingle_matrix([{5, 2 ** 60}, set(), {5, 7, 7}])
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertEqual(matrix.toarray().tolist(), [[1, 0, 1], [0, 0, 0], [1, 1, 0]])
+
+    def test_generate_histogram_sparse(self) -> None:
+        """
+        Tests the `generate_histogram_sparse()` function.
+        """
+        generator = np.random.RandomState(0)
+        data = [
+            set(generator.randint(0, 30, generator.randint(0, 20)).tolist())
+            for _ in range(40)
+        ]
+        data += [data[3], set(), set()]
+        expected = generate_histogram(data, 10)
+
+        for chunk_size, nr_workers in [(1000, 1), (7, 1), (5, 2)]:
+            with self.subTest(chunk_size=chunk_size, nr_workers=nr_workers):
+                self.assertEqual(
+                    generate_histogram_sparse(data, 10, chunk_size, nr_workers),
+                    expected,
+                )
+
+    def test_generate_histogram_sampled(self) -> None:
+        """
+        Tests the `generate_histogram_sampled()` function.
+        """
+        signatures = np.array([[1, 2, 3, 4]] * 10 + [[5, 6, 7, 8]] * 10)
+        histogram = generate_histogram_sampled(signatures, 4, 20000)
+
+        # 90 of the 190 pairs are identical, and the others have nothing in common
+        self.assertEqual(histogram[1:3], [0, 0])
+        self.assertAlmostEqual(histogram[3], 90, delta=10)
+        self.assertAlmostEqual(sum(histogram), 190, delta=1)
+        self.assertEqual(generate_histogram_sampled(signatures[:1], 4), [0, 0, 0, 0])
+
+
+class BenchmarkTest(TestCase):
+    """
+    Tests for the functionality implemented in the `benchmark` module.
+    """
+
+    def test_synthetic_corpus(self) -> None:
+        """
+        Tests the `synthetic_corpus()` function.
+        """
+        rows = list(synthetic_corpus(50, 20, duplicate_fraction=0.5))
+        self.assertEqual(len(rows), 50)
+        self.assertEqual([row["News_ID"] for row in rows], [str(i) for i in range(50)])
+        self.assertTrue(all(len(row["article"].split()) == 20 for row in rows))
+        self.assertEqual(rows, list(synthetic_corpus(50, 20, duplicate_fraction=0.5)))
+
+    def test_benchmark_pipeline(self) -> None:
+        """
+        Tests the `benchmark_pipeline()` function.
+        """
+        rows = list(synthetic_corpus(30, 50, duplicate_fraction=0.5))
+        results = benchmark_pipeline(rows, 2, 5, 2, datasketch=False)
+
+        self.assertEqual(results["parameters"]["nr_documents"], 30)
+        self.assertNotIn("create_minhash", results["stages"])
+        self.assertNotIn("convert_shingles_to_bytes", results["stages"])
+        self.assertGreater(results["candidate_pairs"], 0)
+        for stage in ("get_ngrams", "LSH.add_document", "LSH.query", "end_to_end"):
+            self.assertGreaterEqual(results["stages"][stage]["seconds"], 0.0)
+            self.assertGreater(results["stages"][stage]["peak_bytes"], 0)
+        self.assertEqual(results["stages"]["LSH.add_document"]["items"], 30)
+
+        # The stages can run on a sample, while the pipeline streams all rows
+        corpus = SyntheticCorpus(30, words_per_document=50, duplicate_fraction=0.5)
+        self.assertEqual(list(corpus), rows)
+        results = benchmark_pipeline(
+            corpus, 2, 5, 2, datasketch=False, sample_size=10, chunk_size=7
+        )
+        self.assertEqual(results["parameters"]["nr_documents"], 30)
+        self.assertEqual(results["parameters"]["sample_size"], 10)
+        self.assertEqual(results["stages"]["LSH.add_document"]["items"], 10)
+        self.assertEqual(results["stages"]["end_to_end"]["items"], 30)
+        results = benchmark_pipeline(rows, 2, 5, 2, False, trace_memory=False)
+        self.assertIsNone(results["stages"]["end_to_end"]["peak_bytes"])
+
+    def test_compare_minhash_accuracy(self) -> None:
+        """
+        Tests the `compare_minhash_accuracy()` function.
+        """
+        rows = list(synthetic_corpus(40, 50, duplicate_fraction=0.5))
+        results = compare_minhash_accuracy(rows, 2, 64, nr_random_pairs=50)
+
+        self.assertEqual(
+            set(results), {"MinHasher", "OnePermutationHasher", "create_minhash"}
+        )
+        for result in results.values():
+            self.assertGreater(result["similar"]["pairs"], 0)
+            self.assertLess(result["similar"]["mean_absolute_error"], 0.2)
+            self.assertLess(result["random"]["root_mean_squared_error"], 0.2)
+
+    def test_compare_signature_modes(self) -> None:
+        """
+        Tests the `compare_signature_modes()` function.
+        """
+        rows = list(synthetic_corpus(40, 50, duplicate_fraction=0.5))
+        results = compare_signature_modes(rows, 2, 5, 2, 0.5)
+
+        self.assertEqual(set(results), {"set", "weighted"})
+        for result in results.values():
+            self.assertGreater(result["candidate_pairs"], 0)
+            self.assertLessEqual(result["true_positives"], result["candidate_pairs"])
+            self.assertGreater(result["precision"], 0.5)
+
+    def test_compare_signature_bits(self) -> None:
+        """
+        Tests the `compare_signature_bits()` function.
+        """
+        rows = list(synthetic_corpus(40, 50, duplicate_fraction=0.5))
+        results = compare_signature_bits(rows, 2, 5, 2, 0.5, bits=(64, 32, 4))
+
+        self.assertEqual(set(results), {"64", "32", "4"})
+        self.assertEqual(results["32"]["compression"], 2.0)
+        self.assertGreater(results["4"]["compression"], 15.0)
+        # 32 bits are lossless for the `MinHasher`
+        for key in ("candidate_pairs", "verified_pairs", "mean_absolute_error"):
+            self.assertEqual(results["32"][key], results["64"][key])
+        for result in results.values():
+            self.assertGreater(result["verified_pairs"], 0)
+            self.assertGreater(result["precision"], 0.5)
+            self.assertGreater(result["recall"], 0.5)
 
 
 class LSHTest(TestCase):
@@ -191,6 +795,1153 @@ class LSHTest(TestCase):
 
         self.assertEqual(lsh.query(), {(0, 3): 1.0})
 
+    def test_lsh_query_document(self) -> None:
+        """
+        Tests the `LSH.query_document()` function.
+        """
+        data = [
+            [1, 2, 3, 4, 5, 6],
+            [1, 2, 3, 4, 0, 0],
+            [7, 7, 7, 7, 7, 7],
+        ]
+
+        lsh = LSH(3, 2, sha1)
+        for minhash_values in data:
+            lsh.add_document(minhash_values)
+
+        self.assertEqual(lsh.query_document([1, 2, 3, 4, 5, 6]), {0: 1.0, 1: 2 / 3})
+        self.assertEqual(lsh.query_document([1, 2, 3, 4, 5, 6], 0.9), {0: 1.0})
+        self.assertEqual(lsh.query_document([8, 8, 8, 8, 8, 8]), {})
+        self.assertEqual(lsh.query_document([1, 2, 3, 4, 5, 6], 0.0, 1), {0: 1 / 3})
+        # Querying doesn't add the document
+        self.assertEqual(lsh.query(), {(0, 1): 2 / 3})
+
+    def test_lsh_add_and_query(self) -> None:
+        """
+        Tests the `LSH.add_and_query()` function.
+        """
+        lsh = LSH(3, 2, sha1)
+        self.assertEqual(lsh.add_and_query([1, 2, 3, 4, 5, 6]), (0, {}))
+        self.assertEqual(lsh.add_and_query([1, 2, 3, 4, 0, 0]), (1, {0: 2 / 3}))
+        self.assertEqual(
+            lsh.add_and_query([1, 2, 3, 4, 5, 6], 0.5), (2, {0: 1.0, 1: 2 / 3})
+        )
+        self.assertEqual(
+            lsh.query_document([1, 2, 0, 0, 0, 0]), {0: 1 / 3, 1: 2 / 3, 2: 1 / 3}
+        )
+
+    def test_array_band(self) -> None:
+        """
+        Tests the `ArrayBand` class.
+        """
+        band = ArrayBand()
+        band.MIN_PENDING = 3
+        expected = {}
+        for document_id, key in enumerate([5, 3, 5, 8, 3, 5, 1, 5]):
+            band.add(key, document_id)
+            expected.setdefault(key, set()).add(document_id)
+
+            # Both the merged and the pending documents should be found
+            for bucket_key, document_ids in expected.items():
+                self.assertIn(bucket_key, band)
+                self.assertEqual(band[bucket_key], document_ids)
+            self.assertNotIn(4, band)
+
+        self.assertEqual(dict(band.items()), expected)
+        self.assertEqual(list(band), [1, 3, 5, 8])
+        self.assertEqual(len(band), 4)
+        self.assertTrue(np.all(band.keys[1:] >= band.keys[:-1]))
+
+        # Small batches are kept pending, larger ones are merged at once
+        band.add_many(np.array([4, 5], dtype=np.uint64), np.array([8, 9]))
+        self.assertEqual(band._nr_pending, 2)
+        band.add_many([9, 4, 1], np.array([10, 11, 12]))
+        self.assertEqual(band._nr_pending, 0)
+        expected[4] = {8, 11}
+        expected[5].add(9)
+        expected[9] = {10}
+        expected[1].add(12)
+        self.assertEqual(dict(band.items()), expected)
+        self.assertTrue(np.all(band.keys[1:] >= band.keys[:-1]))
+
+    def test_lsh_array_storage(self) -> None:
+        """
+        Tests the `LSH` class with array-backed bands.
+        """
+        signatures = MinHasher(12).signature_matrix(
+            [set(range(0, 20)), set(range(2, 20)), set(range(50, 60)), set(range(20))]
+        )
+
+        lsh = LSH(4, 3)
+        array_lsh = LSH(4, 3, storage="array")
+        for signature in signatures:
+            self.assertEqual(
+                array_lsh.add_and_query(signature), lsh.add_and_query(signature)
+            )
+
+        self.assertIsInstance(array_lsh.bands[0], ArrayBand)
+        self.assertEqual(len(array_lsh.bands), 4)
+        self.assertEqual(array_lsh.query(), lsh.query())
+        with self.assertRaises(ValueError):
+            LSH(4, 3, storage="list")
+
+    def test_lsh_document_ids(self) -> None:
+        """
+        Tests the `LSH` class with given document IDs.
+        """
+        signatures = np.array([[1, 2, 3, 4], [1, 2, 5, 6], [7, 8, 5, 6]])
+
+        for storage in ("dict", "array"):
+            with self.subTest(storage=storage):
+                lsh = LSH(2, 2, storage=storage)
+                self.assertEqual(lsh.add_document(signatures[0], 100), 100)
+                self.assertEqual(
+                    lsh.add_documents(signatures[1:], [205, 42]).tolist(), [205, 42]
+                )
+                self.assertEqual(lsh.add_document(signatures[0]), 206)
+                self.assertEqual(
+                    lsh.query(),
+                    {(100, 205): 0.5, (42, 205): 0.5, (100, 206): 1.0, (205, 206): 0.5},
+                )
+                self.assertEqual(lsh.add_and_query(signatures[2], document_id=7)[0], 7)
+                with self.assertRaises(ValueError):
+                    lsh.add_documents(signatures, [1, 2])
+
+    def test_hash_bands(self) -> None:
+        """
+        Tests the `hash_bands()` function.
+        """
+        signatures = np.array(
+            [
+                [1, 2, 3, 4, 5, 6, 99],
+                [1, 2, 3, 4, 6, 5, 99],
+                [3, 4, 1, 2, 5, 6, 0],
+            ],
+            dtype=np.uint64,
+        )
+        hash_values = hash_bands(signatures, 3, 2)
+
+        self.assertEqual(hash_values.shape, (3, 3))
+        self.assertEqual(hash_values.dtype, np.uint64)
+        # Equal bands give equal hashes, regardless of the band's position
+        self.assertEqual(hash_values[0, 0], hash_values[1, 0])
+        self.assertEqual(hash_values[0, 0], hash_values[2, 1])
+        self.assertEqual(hash_values[0, 2], hash_values[2, 2])
+        # The order of the rows within a band matters
+        self.assertNotEqual(hash_values[0, 2], hash_values[1, 2])
+        self.assertTrue(
+            np.array_equal(hash_bands(signatures[1:], 3, 2), hash_values[1:])
+        )
+
+    def test_lsh_add_documents(self) -> None:
+        """
+        Tests the `LSH.add_documents()` function, and the `LSH` class with fast
+        hashing.
+        """
+        generator = np.random.RandomState(0)
+        signatures = generator.randint(0, 3, (50, 8)).astype(np.uint64)
+
+        expected = LSH(4, 2)
+        for signature in signatures:
+            expected.add_document(signature)
+        self.assertTrue(expected.query())
+
+        for storage in ("dict", "array"):
+            for fast_hashing in (False, True):
+                with self.subTest(storage=storage, fast_hashing=fast_hashing):
+                    lsh = LSH(4, 2, storage=storage, fast_hashing=fast_hashing)
+                    self.assertEqual(lsh.add_documents(signatures[:20]), range(0, 20))
+                    self.assertEqual(lsh.add_document(signatures[20]), 20)
+                    self.assertEqual(lsh.add_documents(signatures[21:]), range(21, 50))
+                    self.assertEqual(lsh.query(), expected.query())
+                    self.assertEqual(
+                        lsh.query_document(signatures[0]),
+                        expected.query_document(signatures[0]),
+                    )
+
+    def test_lsh_save_load(self) -> None:
+        """
+        Tests the `LSH.save()`, `LSH.load()` and `LSH.load_signatures()`
+        functions.
+        """
+        signatures = MinHasher(12).signature_matrix(
+            [set(range(0, 20)), set(range(2, 20)), set(range(50, 60)), set(range(20))]
+        )
+
+        lsh = LSH(4, 3)
+        for signature in signatures:
+            lsh.add_document(signature)
+
+        with TemporaryDirectory() as directory:
+            lsh.save(directory, signatures)
+            loaded = LSH.load(directory)
+
+            self.assertEqual((loaded.nr_bands, loaded.rows_per_band), (4, 3))
+            self.assertIsInstance(loaded.bands[0], SortedBand)
+            self.assertIsInstance(loaded.bands[0].keys, np.memmap)
+            self.assertEqual(loaded.query(), lsh.query())
+            for signature in signatures:
+                self.assertEqual(
+                    loaded.query_document(signature), lsh.query_document(signature)
+                )
+            for band, loaded_band in zip(lsh.bands, loaded.bands):
+                self.assertEqual(
+                    sorted(map(sorted, band.values())),
+                    sorted(map(sorted, loaded_band.values())),
+                )
+                for hash_value, document_ids in band.items():
+                    self.assertIn(hash_value, loaded_band)
+                    self.assertEqual(loaded_band[hash_value], document_ids)
+
+            loaded_signatures = LSH.load_signatures(directory)
+            self.assertTrue(np.array_equal(loaded_signatures, signatures))
+
+            with self.assertRaises(TypeError):
+                loaded.add_document(signatures[0])
+
+            # Saving a loaded data structure gives the same result
+            loaded.save(directory)
+            self.assertEqual(LSH.load(directory, mmap_mode=None).query(), lsh.query())
+
+        # A custom hash function without a name has to be given when loading
+        class ReversedSha1:
+            def __init__(self, data: bytes) -> None:
+                self._digest = sha1(data[::-1]).digest()
+
+            def digest(self) -> bytes:
+                return self._digest
+
+        lsh = LSH(4, 3, ReversedSha1)
+        lsh.add_documents(signatures)
+        with TemporaryDirectory() as directory:
+            lsh.save(directory)
+            with self.assertRaises(ValueError):
+                LSH.load(directory)
+            loaded = LSH.load(directory, ReversedSha1)
+            self.assertEqual(loaded.query(), lsh.query())
+            self.assertEqual(
+                loaded.query_document(signatures[0]), lsh.query_document(signatures[0])
+            )
+
+    def test_lsh_min_band_count(self) -> None:
+        """
+        Tests the `LSH.min_band_count()` function.
+        """
+        data = [(10, 0.0, 1), (10, 0.7, 7), (10, 0.71, 8), (25, 0.8, 20), (4, 1.0, 4)]
+        for nr_bands, min_similarity, expected in data:
+            lsh = LSH(nr_bands, 1)
+            self.assertEqual(lsh.min_band_count(min_similarity), expected)
+
+    def test_lsh_candidate_pairs(self) -> None:
+        """
+        Tests the `LSH.candidate_pairs()` function.
+        """
+        data = [
+            [1, 2, 3, 4, 5, 6],
+            [1, 2, 3, 4, 0, 0],
+            [1, 2, 0, 4, 5, 6],
+            [1, 2, 3, 4, 5, 6],
+            [7, 7, 7, 7, 7, 7],
+        ]
+
+        lsh = LSH(3, 2, sha1)
+        for minhash_values in data:
+            lsh.add_document(minhash_values)
+
+        self.assertEqual(
+            list(lsh.candidate_pairs()),
+            [
+                ((0, 1), 2 / 3),
+                ((0, 2), 2 / 3),
+                ((0, 3), 1.0),
+                ((1, 2), 1 / 3),
+                ((1, 3), 2 / 3),
+                ((2, 3), 2 / 3),
+            ],
+        )
+        self.assertEqual(
+            list(lsh.candidate_pairs(0.9)),
+            [((0, 3), 1.0)],
+        )
+        # The first band's bucket contains four documents, and is ignored
+        self.assertEqual(
+            list(lsh.candidate_pairs(0.5, max_bucket_size=3)),
+            [((0, 3), 2 / 3)],
+        )
+
+    def test_collision_probability(self) -> None:
+        """
+        Tests the `collision_probability()` function.
+        """
+        data = [(0.0, 0.0), (1.0, 1.0), (0.5, 1 - 0.75 ** 3)]
+        for similarity, expected in data:
+            self.assertAlmostEqual(collision_probability(similarity, 3, 2), expected)
+
+    def test_error_probabilities(self) -> None:
+        """
+        Tests the `error_probabilities()` function.
+        """
+        # With a single row, the S-curve is the identity
+        false_positives, false_negatives = error_probabilities(0.5, 1, 1)
+        self.assertAlmostEqual(false_positives, 0.125)
+        self.assertAlmostEqual(false_negatives, 0.125)
+
+        # Without pairs above the threshold, there can't be false negatives
+        histogram = [10, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+        false_positives, false_negatives = error_probabilities(0.5, 1, 1, histogram)
+        self.assertAlmostEqual(false_positives, 0.05)
+        self.assertEqual(false_negatives, 0.0)
+
+    def test_optimal_parameters(self) -> None:
+        """
+        Tests the `optimal_parameters()` function.
+        """
+        # The same parameters as datasketch's `MinHashLSH`
+        self.assertEqual(optimal_parameters(0.8, max_permutations=125), (9, 13))
+        self.assertEqual(optimal_parameters(0.5, max_permutations=125), (25, 5))
+
+        # Mostly very dissimilar pairs rarely collide, so false negatives matter
+        # more and fewer rows per band are used
+        histogram = [605386, 103, 0, 0, 0, 0, 0, 0, 0, 61]
+        self.assertEqual(
+            optimal_parameters(0.8, max_permutations=125, histogram=histogram),
+            (13, 9),
+        )
+
+        # The cheapest parameters that meet both goals
+        nr_bands, rows_per_band = optimal_parameters(
+            0.8, max_false_positives=0.05, max_false_negatives=0.05
+        )
+        false_positives, false_negatives = error_probabilities(
+            0.8, nr_bands, rows_per_band
+        )
+        self.assertLessEqual(false_positives, 0.05)
+        self.assertLessEqual(false_negatives, 0.05)
+        self.assertLess(nr_bands * rows_per_band, 128)
+
+        # Unreachable goals fall back to the weighted error
+        self.assertEqual(
+            optimal_parameters(0.8, max_permutations=125, max_false_positives=0.0),
+            (9, 13),
+        )
+
+    def test_lsh_from_threshold(self) -> None:
+        """
+        Tests the `LSH.from_threshold()` function.
+        """
+        lsh = LSH.from_threshold(0.8, 125, storage="array")
+        self.assertEqual((len(lsh.bands), lsh.rows_per_band), (9, 13))
+        self.assertIsInstance(lsh.bands[0], ArrayBand)
+
+    def test_optimal_parameters_recall(self) -> None:
+        """
+        Tests the recall of the `optimal_parameters()` function's parameters on
+        the bundled data, when the candidates are re-scored by their signatures.
+        """
+        filename = path.join(
+            path.dirname(__file__), "..", "data", "news_articles_small_dup.csv"
+        )
+        shingle_sets = list(ShingleSetGenerator(read_data(read_csv(filename)), 2))
+
+        # The pairs whose exact Jaccard similarity is at least 0.8
+        matrix = shingle_matrix(shingle_sets)
+        intersections = (matrix @ matrix.T).toarray()
+        sizes = np.diag(intersections)
+        similarities = intersections / (sizes[:, None] + sizes[None, :] - intersections)
+        first, second = np.nonzero(np.triu(similarities >= 0.8, k=1))
+        expected = set(zip(first.tolist(), second.tolist()))
+        self.assertGreater(len(expected), 50)
+
+        lsh = LSH.from_threshold(0.8, 125, fast_hashing=True)
+        signatures = MinHasher(lsh.nr_rows).signature_matrix(shingle_sets)
+        lsh.add_documents(signatures)
+        results = verify_candidates(
+            lsh.candidate_pairs(0.0), signatures=signatures, min_similarity=0.8
+        )
+        found = {pair for pair, _ in results}
+        self.assertGreaterEqual(len(found & expected), 0.95 * len(expected))
+        self.assertGreaterEqual(len(found & expected), 0.95 * len(found))
+
+    def test_multi_probe_lsh(self) -> None:
+        """
+        Tests the `MultiProbeLSH` class.
+        """
+        data = [
+            [1, 2, 3, 4, 5, 6],
+            [9, 2, 3, 4, 5, 0],
+            [1, 9, 3, 4, 5, 6],
+            [1, 2, 9, 9, 5, 6],
+            [7, 7, 7, 7, 7, 7],
+        ]
+
+        # Without probes, the results are the same as those of `LSH`
+        lsh = LSH(2, 3)
+        multi_probe_lsh = MultiProbeLSH(2, 3, probes=0)
+        for minhash_values in data:
+            lsh.add_document(minhash_values)
+            multi_probe_lsh.add_document(minhash_values)
+        self.assertEqual(multi_probe_lsh.query(), lsh.query())
+
+        # Differences in the first two rows of a band are allowed
+        expected = {(0, 1): 0.5, (0, 2): 1.0, (0, 3): 0.5, (2, 3): 0.5}
+        for fast_hashing in (False, True):
+            for storage in ("dict", "array"):
+                lsh = MultiProbeLSH(2, 3, sha1, storage, fast_hashing, probes=2)
+                self.assertEqual(len(lsh.bands), 6)
+                lsh.add_documents(np.array(data, dtype=np.uint64))
+                self.assertEqual(lsh.query(), expected)
+                self.assertEqual(list(lsh.candidate_pairs(0.6)), [((0, 2), 1.0)])
+                self.assertEqual(
+                    lsh.query_document(data[0]), {0: 1.0, 1: 0.5, 2: 1.0, 3: 0.5}
+                )
+
+        with TemporaryDirectory() as directory:
+            lsh.save(directory)
+            loaded = MultiProbeLSH.load(directory)
+            self.assertEqual(loaded.probes, 2)
+            self.assertEqual(loaded.query(), expected)
+            self.assertEqual(loaded.query_document(data[3]), {0: 0.5, 2: 0.5, 3: 1.0})
+
+        with self.assertRaises(ValueError):
+            MultiProbeLSH(2, 3, probes=4)
+        # A probe of a single row would match every document
+        with self.assertRaises(ValueError):
+            MultiProbeLSH(2, 1, probes=1)
+
+    def test_multi_probe_parameters(self) -> None:
+        """
+        Tests the `collision_probability()` and `optimal_parameters()` functions
+        with probes.
+        """
+        # A single probe is equivalent to one row less per band
+        self.assertAlmostEqual(
+            collision_probability(0.8, 9, 14, probes=1),
+            collision_probability(0.8, 9, 13),
+        )
+        self.assertGreater(
+            collision_probability(0.8, 9, 14, probes=2),
+            collision_probability(0.8, 9, 13),
+        )
+
+        # Probes reach the same error goals with fewer permutations
+        goals = {"max_false_positives": 0.03, "max_false_negatives": 0.03}
+        nr_bands, rows_per_band = optimal_parameters(0.8, **goals)
+        lsh = MultiProbeLSH.from_threshold(0.8, probes=8, **goals)
+        self.assertLess(lsh.nr_rows, nr_bands * rows_per_band)
+        self.assertEqual(lsh.probes, 8)
+        self.assertGreater(lsh.rows_per_band, 8)
+        for probes in range(1, 6):
+            self.assertGreater(optimal_parameters(0.3, probes=probes)[1], probes)
+
+    def test_lsh_cluster(self) -> None:
+        """
+        Tests the `LSH.cluster()` function.
+        """
+        data = [
+            [1, 2, 3, 4],
+            [5, 6, 7, 8],
+            [1, 2, 0, 0],
+            [9, 9, 7, 8],
+            [0, 0, 0, 1],
+        ]
+        lsh = LSH(2, 2)
+        lsh.add_documents(np.array(data))
+
+        clusters = lsh.cluster()
+        self.assertEqual(clusters.labels().tolist(), [0, 1, 0, 1, 4])
+        self.assertEqual(clusters.representative(2), 0)
+
+        # Only the given pairs are used
+        clusters = lsh.cluster([((3, 4), 0.5)])
+        self.assertEqual(clusters.labels().tolist(), [0, 1, 2, 3, 3])
+
+        # With large document IDs, the clusters are of those IDs
+        lsh = LSH(2, 2)
+        lsh.add_documents(np.array(data), [10 ** 9 + i for i in (4, 3, 2, 1, 0)])
+        clusters = lsh.cluster()
+        self.assertEqual(len(clusters), 5)
+        self.assertEqual(
+            [cluster.tolist() for cluster in clusters.clusters(1)],
+            [[10 ** 9], [10 ** 9 + 1, 10 ** 9 + 3], [10 ** 9 + 2, 10 ** 9 + 4]],
+        )
+
+    def test_lsh_remove_document(self) -> None:
+        """
+        Tests the `LSH.remove_document()` function.
+        """
+        generator = np.random.RandomState(0)
+        signatures = generator.randint(0, 3, (40, 6)).astype(np.uint64)
+
+        for lsh_type, kwargs in [
+            (LSH, {}),
+            (LSH, {"fast_hashing": True}),
+            (MultiProbeLSH, {"fast_hashing": True, "probes": 1}),
+        ]:
+            with self.subTest(lsh_type=lsh_type, **kwargs):
+                lsh = lsh_type(3, 2, removable=True, **kwargs)
+                self.assertTrue(lsh.removable)
+                lsh.add_documents(signatures[:30])
+                for signature in signatures[30:]:
+                    lsh.add_document(signature)
+
+                removed = set(range(0, 40, 3))
+                for document_id in sorted(removed):
+                    self.assertTrue(lsh.remove_document(document_id))
+                self.assertFalse(lsh.remove_document(0))
+                self.assertFalse(lsh.remove_document(100))
+
+                kept = [i for i in range(40) if i not in removed]
+                expected = lsh_type(3, 2, **kwargs)
+                expected.add_documents(signatures[kept], kept)
+                self.assertEqual(lsh.query(), expected.query())
+                self.assertEqual(
+                    lsh.query_document(signatures[0]),
+                    expected.query_document(signatures[0]),
+                )
+                # The empty buckets are removed
+                for band, expected_band in zip(lsh.bands, expected.bands):
+                    self.assertEqual(band, expected_band)
+
+                # A document that is added again replaces the old one
+                lsh.add_document(signatures[0], 1)
+                self.assertIn(1, lsh.query_document(signatures[0]))
+                self.assertEqual(
+                    sum(1 in bucket for band in lsh.bands for bucket in band.values()),
+                    len(lsh.bands),
+                )
+
+                # So does a repeated ID within a batch
+                lsh.add_documents(signatures[[5, 6]], [70, 70])
+                self.assertEqual(
+                    sum(70 in bucket for band in lsh.bands for bucket in band.values()),
+                    len(lsh.bands),
+                )
+                self.assertIn(70, lsh.query_document(signatures[6]))
+                self.assertTrue(lsh.remove_document(70))
+                self.assertFalse(
+                    any(70 in bucket for band in lsh.bands for bucket in band.values())
+                )
+
+        with self.assertRaises(ValueError):
+            LSH(3, 2).remove_document(0)
+        self.assertFalse(LSH(3, 2).removable)
+        with self.assertRaises(ValueError):
+            LSH(3, 2, storage="array", removable=True)
+
+    def test_lsh_evict(self) -> None:
+        """
+        Tests the `LSH.evict()` function.
+        """
+        lsh = LSH(2, 2, removable=True)
+        for document_id in range(6):
+            lsh.add_document([1, 2, 3, 4], timestamp=100.0 + document_id)
+        lsh.add_documents(np.array([[1, 2, 3, 4], [1, 2, 5, 6]]), timestamp=110.0)
+
+        self.assertEqual(lsh.evict(), [])
+        self.assertEqual(lsh.evict(max_age=3.5, now=106.0), [0, 1, 2])
+        self.assertEqual(lsh.evict(max_documents=3), [3, 4])
+        self.assertEqual(lsh.evict(max_documents=10, max_age=5.0, now=111.0), [5])
+        self.assertEqual(lsh.query(), {(6, 7): 0.5})
+        self.assertEqual(lsh.evict(max_age=0.0, now=111.0), [6, 7])
+        self.assertEqual(lsh.bands, [{}, {}])
+
+        with self.assertRaises(ValueError):
+            LSH(2, 2).evict(max_documents=1)
+
+
+class ClusterTest(TestCase):
+    """
+    Tests for the functionality implemented in the `cluster` module.
+    """
+
+    def test_union_find(self) -> None:
+        """
+        Tests the `UnionFind` class.
+        """
+        clusters = UnionFind(4)
+        self.assertEqual(clusters.labels().tolist(), [0, 1, 2, 3])
+
+        clusters.union_pairs([(3, 2), ((6, 3), 0.9), (1, 1)])
+        self.assertEqual(len(clusters), 5)
+        self.assertEqual(clusters.find(6), clusters.find(2))
+        self.assertEqual(clusters.representative(6), 2)
+        self.assertEqual(clusters.size(3), 3)
+        self.assertEqual(clusters.representative(10), 10)
+        self.assertEqual(clusters.size(10), 1)
+
+        clusters.union(0, 5)
+        clusters.union(5, 6)
+        self.assertEqual(clusters.document_ids.tolist(), [0, 1, 2, 3, 6, 5])
+        self.assertEqual(clusters.labels().tolist(), [0, 1, 0, 0, 0, 0])
+        self.assertEqual(
+            [cluster.tolist() for cluster in clusters.clusters()], [[0, 2, 3, 5, 6]]
+        )
+        self.assertEqual(
+            [cluster.tolist() for cluster in clusters.clusters(1)],
+            [[0, 2, 3, 5, 6], [1]],
+        )
+
+        # The memory usage doesn't depend on how large the document IDs are
+        clusters = UnionFind([10 ** 12, 7])
+        clusters.union_pairs([(5, 3 * 10 ** 9), (3 * 10 ** 9, 10 ** 12)])
+        self.assertEqual(len(clusters), 4)
+        self.assertEqual(clusters.representative(10 ** 12), 5)
+        self.assertEqual(clusters.labels().tolist(), [5, 7, 5, 5])
+        self.assertEqual(
+            [cluster.tolist() for cluster in clusters.clusters(1)],
+            [[5, 3 * 10 ** 9, 10 ** 12], [7]],
+        )
+
+        # The result doesn't depend on the order of the pairs
+        generator = np.random.RandomState(0)
+        pairs = generator.randint(0, 1000, (800, 2)).tolist()
+        expected = UnionFind()
+        expected.union_pairs(pairs)
+        shuffled = UnionFind(1000)
+        shuffled.union_pairs(pairs[::-1])
+        self.assertEqual(
+            [cluster.tolist() for cluster in expected.clusters()],
+            [cluster.tolist() for cluster in shuffled.clusters()],
+        )
+
+
+class ForestTest(TestCase):
+    """
+    Tests for the functionality implemented in the `forest` module.
+    """
+
+    def test_lsh_forest(self) -> None:
+        """
+        Tests the `LSHForest` class.
+        """
+        generator = np.random.RandomState(0)
+        signatures = generator.randint(0, 3, (200, 12)).astype(np.uint64)
+        forest = LSHForest(3, 4)
+        self.assertEqual(forest.query(signatures[0]), [])
+
+        forest.add_documents(signatures[:150])
+        for signature in signatures[150:]:
+            forest.add_document(signature)
+        self.assertEqual(len(forest), 200)
+
+        results = forest.query_many(signatures[:20], 5)
+        for index, result in enumerate(results):
+            self.assertEqual(len(result), 5)
+            self.assertEqual(result[0], (index, 1.0))
+            similarities = [similarity for _, similarity in result]
+            self.assertEqual(similarities, sorted(similarities, reverse=True))
+            for document_id, similarity in result:
+                self.assertAlmostEqual(
+                    similarity,
+                    minhash_similarity(signatures[document_id], signatures[index]),
+                )
+            self.assertEqual(forest.query(signatures[index], 5), result)
+
+        # With very few distinct values, the candidates are all documents, so
+        # the results are exact
+        signatures = generator.randint(0, 2, (50, 4)).astype(np.uint64)
+        forest = LSHForest(2, 2)
+        forest.add_documents(signatures, range(100, 150))
+        query = generator.randint(0, 2, 4)
+        similarities = (signatures == query).mean(axis=1)
+        best = similarities.max()
+        result = forest.query(query, 3)
+        self.assertEqual(result[0][1], best)
+        self.assertTrue(all(100 <= document_id < 150 for document_id, _ in result))
+
+        with self.assertRaises(ValueError):
+            forest.add_documents(signatures[:, :3])
+
+
+class MetricsTest(TestCase):
+    """
+    Tests for the functionality implemented in the `metrics` module.
+    """
+
+    def tearDown(self) -> None:
+        metrics.disable()
+        metrics.reset()
+
+    def test_disabled(self) -> None:
+        """
+        Tests that nothing is recorded while metrics are disabled.
+        """
+        self.assertFalse(metrics.is_enabled())
+        with metrics.timed("stage"):
+            metrics.count("documents", 5)
+            metrics.observe("bucket_size", [1, 2, 3])
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["stages"], {})
+        self.assertEqual(snapshot["counters"], {})
+        self.assertEqual(snapshot["histograms"], {})
+
+    def test_recording(self) -> None:
+        """
+        Tests the `timed()`, `count()` and `observe()` functions.
+        """
+        metrics.enable()
+        for _ in range(2):
+            with metrics.timed("stage"):
+                pass
+        metrics.record_stage("other", 1.5)
+        metrics.count("documents")
+        metrics.count("documents", 2)
+        metrics.count("pairs", 3, band=1)
+        metrics.observe("bucket_size", [1, 2, 3, 5, 2 ** 21], band=1)
+        metrics.observe("bucket_size", np.array([1]), band=1)
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["stages"]["stage"]["calls"], 2)
+        self.assertEqual(snapshot["stages"]["other"]["seconds"], 1.5)
+        self.assertEqual(snapshot["counters"], {"documents": 3, 'pairs{band="1"}': 3})
+        histogram = snapshot["histograms"]['bucket_size{band="1"}']
+        self.assertEqual(histogram["counts"][:4], [2, 1, 1, 1])
+        self.assertEqual(histogram["counts"][-1], 1)
+        self.assertEqual(histogram["count"], 6)
+        self.assertEqual(histogram["sum"], 12 + 2 ** 21)
+        self.assertEqual(histogram["max"], 2 ** 21)
+        self.assertGreater(snapshot["peak_rss_bytes"], 0)
+
+        self.assertEqual(json.loads(metrics.to_json())["counters"]["documents"], 3)
+        lines = metrics.to_prometheus().splitlines()
+        self.assertIn('lsh_stage_calls_total{stage="stage"} 2', lines)
+        self.assertIn("lsh_documents_total 3", lines)
+        self.assertIn('lsh_pairs_total{band="1"} 3', lines)
+        self.assertIn('lsh_bucket_size_bucket{band="1",le="2"} 3', lines)
+        self.assertIn('lsh_bucket_size_bucket{band="1",le="+Inf"} 6', lines)
+        self.assertIn('lsh_bucket_size_count{band="1"} 6', lines)
+
+        metrics.reset()
+        self.assertEqual(metrics.snapshot()["counters"], {})
+
+    def test_lsh_metrics(self) -> None:
+        """
+        Tests the metrics that are recorded by `LSH`.
+        """
+        signatures = np.array(
+            [[1, 2, 3, 4], [1, 2, 3, 5], [1, 2, 6, 7], [8, 9, 6, 7]], dtype=np.uint64
+        )
+        lsh = LSH(2, 2, fast_hashing=True)
+        lsh.record_metrics()
+        lsh.add_documents(signatures)
+        self.assertEqual(metrics.snapshot()["counters"], {})
+
+        metrics.enable()
+        lsh = LSH(2, 2, fast_hashing=True)
+        lsh.add_documents(signatures[:3])
+        lsh.add_document(signatures[3])
+        pairs = lsh.query()
+        lsh.query_document(signatures[0])
+        lsh.record_metrics()
+
+        snapshot = metrics.snapshot()
+        self.assertEqual(set(snapshot["stages"]), {"index", "query"})
+        counters = snapshot["counters"]
+        self.assertEqual(counters["indexed_documents"], 4)
+        self.assertEqual(counters["candidate_pairs"], len(pairs))
+        self.assertEqual(counters["queries"], 1)
+        self.assertEqual(counters["query_matches"], 3)
+        self.assertEqual(counters['bucket_pairs{band="0"}'], 3)
+        self.assertEqual(counters['bucket_pairs{band="1"}'], 1)
+        self.assertEqual(snapshot["histograms"]['bucket_size{band="0"}']["count"], 2)
+        self.assertEqual(snapshot["histograms"]['bucket_size{band="1"}']["count"], 3)
+
+        # An abandoned generator still counts the pairs it yielded
+        metrics.reset()
+        candidates = lsh.candidate_pairs()
+        next(candidates)
+        candidates.close()
+        self.assertEqual(metrics.snapshot()["counters"]["candidate_pairs"], 1)
+
+        with TemporaryDirectory() as directory:
+            filename = path.join(directory, "metrics.json")
+            metrics.write(filename)
+            with open(filename) as metrics_file:
+                self.assertIn("counters", json.load(metrics_file))
+
+
+class ShardTest(TestCase):
+    """
+    Tests for the functionality implemented in the `shard` module.
+    """
+
+    def test_sharded_lsh(self) -> None:
+        """
+        Tests that the `ShardedLSH` class gives the same results as `LSH`.
+        """
+        generator = np.random.RandomState(0)
+        signatures = np.repeat(generator.randint(0, 1000, (50, 30)), 4, axis=0)
+        mask = generator.rand(*signatures.shape) < 0.3
+        signatures[mask] = generator.randint(0, 1000, mask.sum())
+        signatures = signatures.astype(np.uint64)
+        document_ids = np.arange(1000, 1000 + len(signatures))
+
+        for fast_hashing in [False, True]:
+            lsh = LSH(10, 3, fast_hashing=fast_hashing)
+            lsh.add_documents(signatures[:150], document_ids[:150])
+            for document_id, signature in zip(document_ids[150:], signatures[150:]):
+                lsh.add_document(signature, document_id)
+
+            with ShardedLSH(10, 3, 3, fast_hashing=fast_hashing) as sharded:
+                self.assertEqual(sharded.nr_shards, 3)
+                self.assertEqual(sharded.nr_rows, 30)
+                result = sharded.add_documents(signatures[:150], document_ids[:150])
+                self.assertEqual(result.tolist(), document_ids[:150].tolist())
+                for document_id, signature in zip(document_ids[150:], signatures[150:]):
+                    sharded.add_document(signature, document_id)
+
+                self.assertEqual(sharded.query(), lsh.query())
+                # The shards send their pairs in chunks, which are merged
+                for chunk_size in [1, 7, 100000]:
+                    sharded.chunk_size = chunk_size
+                    for min_similarity in [0.2, 0.5, 0.9]:
+                        for max_bucket_size in [None, 3]:
+                            with self.subTest(
+                                chunk_size=chunk_size, min_similarity=min_similarity
+                            ):
+                                self.assertEqual(
+                                    list(
+                                        sharded.candidate_pairs(
+                                            min_similarity, max_bucket_size
+                                        )
+                                    ),
+                                    list(
+                                        lsh.candidate_pairs(
+                                            min_similarity, max_bucket_size
+                                        )
+                                    ),
+                                )
+                for signature in signatures[:10]:
+                    self.assertEqual(
+                        sharded.query_document(signature, 0.3),
+                        lsh.query_document(signature, 0.3),
+                    )
+
+                with self.assertRaises(ValueError):
+                    sharded.add_documents(signatures[:2], [1])
+
+        # There are never more shards than bands
+        with ShardedLSH(2, 3, 4) as sharded:
+            self.assertEqual(sharded.nr_shards, 2)
+            self.assertEqual(sharded.query(), {})
+
+
+class ServiceTest(TestCase):
+    """
+    Tests for the functionality implemented in the `service` module.
+    """
+
+    articles = [
+        "the quick brown fox jumps over the lazy dog near the river bank today",
+        "a completely different story about stock markets and interest rates",
+        "the quick brown fox jumps over the lazy dog near the river bank today",
+        "yet another unrelated article on football and the weather this weekend",
+    ]
+
+    def test_dedup_service(self) -> None:
+        """
+        Tests the `DedupService` class.
+        """
+
+        async def run() -> None:
+            with ThreadPoolExecutor(1) as executor:
+                service = DedupService(
+                    LSH(10, 2, fast_hashing=True),
+                    MinHasher(20, 1),
+                    min_similarity=0.5,
+                    max_delay=0.05,
+                    max_pending=2,
+                    executor=executor,
+                )
+                with self.assertRaises(RuntimeError):
+                    await service.submit(self.articles[0])
+                self.assertEqual(service.stats()["latency_seconds"], {})
+
+                await service.start()
+                results = await asyncio.gather(
+                    *(service.submit(article) for article in self.articles)
+                )
+                self.assertEqual(
+                    [document_id for document_id, _ in results], [0, 1, 2, 3]
+                )
+                self.assertEqual(results[0][1], {})
+                self.assertEqual(results[2][1], {0: 1.0})
+                self.assertEqual(results[3][1], {})
+
+                stats = service.stats()
+                self.assertEqual(stats["requests"], 4)
+                self.assertLess(stats["batches"], 4)
+                self.assertGreater(stats["waits"], 0)
+                self.assertEqual(stats["queue_size"], 0)
+                latencies = stats["latency_seconds"]
+                self.assertLessEqual(latencies["p50"], latencies["p99"])
+                self.assertLessEqual(latencies["p99"], latencies["max"])
+                await service.stop()
+
+                # With a window of a single article, the duplicate of the first
+                # article is only found right after it
+                service = DedupService(
+                    LSH(10, 2, fast_hashing=True, removable=True),
+                    MinHasher(20, 1),
+                    min_similarity=0.5,
+                    executor=executor,
+                    max_documents=1,
+                )
+                await service.start()
+                matches = [
+                    (await service.submit(article))[1]
+                    for article in self.articles + self.articles[:1]
+                ]
+                self.assertEqual(matches, [{}, {}, {}, {}, {}])
+                self.assertEqual((await service.submit(self.articles[0]))[1], {4: 1.0})
+                await service.stop()
+
+                # Only a removable LSH can keep the most recent articles
+                with self.assertRaises(ValueError):
+                    DedupService(
+                        LSH(10, 2, fast_hashing=True),
+                        MinHasher(20, 1),
+                        max_documents=1,
+                    )
+
+                # The requests of a batch whose signatures are still being
+                # computed fail when the service is stopped
+                release = Event()
+                executor.submit(release.wait)
+                service = DedupService(
+                    LSH(10, 2, fast_hashing=True),
+                    MinHasher(20, 1),
+                    max_delay=0.0,
+                    executor=executor,
+                )
+                await service.start()
+                future = await service.enqueue(self.articles[0])
+                await asyncio.sleep(0.05)
+                await service.stop()
+                release.set()
+                self.assertTrue(future.done())
+                with self.assertRaises(RuntimeError):
+                    await future
+
+        asyncio.run(run())
+
+    def test_serve(self) -> None:
+        """
+        Tests the `serve()` function, over a Unix socket.
+        """
+
+        async def run(socket_path: str) -> list[dict]:
+            with ThreadPoolExecutor(1) as executor:
+                service = DedupService(
+                    LSH(10, 2, fast_hashing=True),
+                    MinHasher(20, 1),
+                    min_similarity=0.5,
+                    executor=executor,
+                )
+                server = await serve(service, socket_path)
+                reader, writer = await asyncio.open_unix_connection(socket_path)
+                for index, article in enumerate(self.articles):
+                    request = {
+                        "id": index,
+                        "article": article,
+                        "document_id": 10 + index,
+                    }
+                    writer.write(json.dumps(request).encode() + b"\n")
+                writer.write(b"not json\n")
+                await writer.drain()
+                responses = [
+                    json.loads(await reader.readline())
+                    for _ in range(len(self.articles) + 1)
+                ]
+                writer.write(b'{"id": "stats", "command": "stats"}\n')
+                await writer.drain()
+                responses.append(json.loads(await reader.readline()))
+
+                writer.close()
+                await writer.wait_closed()
+                server.close()
+                await server.wait_closed()
+                await service.stop()
+                return responses
+
+        with TemporaryDirectory() as directory:
+            responses = asyncio.run(run(path.join(directory, "service.sock")))
+
+        # The invalid request is answered before the articles are processed
+        errors = [response for response in responses if "error" in response]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(responses[-1]["id"], "stats")
+        self.assertEqual(responses[-1]["stats"]["requests"], 4)
+        articles = sorted(
+            (response for response in responses[:-1] if "error" not in response),
+            key=lambda response: response["id"],
+        )
+        self.assertEqual(
+            [response["document_id"] for response in articles], [10, 11, 12, 13]
+        )
+        self.assertEqual(articles[2]["matches"], [[10, 1.0]])
+        self.assertEqual(articles[3]["matches"], [])
+
+
+class CacheTest(TestCase):
+    """
+    Tests for the functionality implemented in the `cache` module.
+    """
+
+    articles = [
+        "The quick brown fox jumps over the lazy dog.",
+        "A completely different story about stock markets.",
+        "the QUICK brown fox -- jumps over the lazy dog",
+        "Yet another article, on football and the weather.",
+    ]
+
+    def test_signature_cache(self) -> None:
+        """
+        Tests the `SignatureCache` class.
+        """
+        minhasher = MinHasher(16, 1)
+        expected = compute_signatures(self.articles, 2, minhasher)
+        computed = []
+
+        def compute(texts: list[str], n: int, hasher: MinHasher) -> np.ndarray:
+            computed.extend(texts)
+            return compute_signatures(texts, n, hasher)
+
+        with TemporaryDirectory() as directory:
+            filename = path.join(directory, "signatures.db")
+            with SignatureCache(filename) as cache:
+                keys = cache.keys(self.articles, 2, minhasher)
+                # The keys only depend on the normalised text
+                self.assertEqual(keys[0], keys[2])
+                self.assertEqual(len(set(keys)), 3)
+                self.assertNotEqual(
+                    cache.keys(self.articles[:1], 3, minhasher)[0], keys[0]
+                )
+                self.assertNotEqual(
+                    cache.keys(self.articles[:1], 2, MinHasher(16, 2))[0], keys[0]
+                )
+
+                signatures = cache.signatures(self.articles[:2], 2, minhasher, compute)
+                self.assertTrue(np.array_equal(signatures, expected[:2]))
+                self.assertEqual(len(cache), 2)
+
+            # Only the new articles are computed in a later run
+            computed.clear()
+            with SignatureCache(filename) as cache:
+                self.assertEqual(len(cache), 2)
+                signatures = cache.signatures(self.articles, 2, minhasher, compute)
+                self.assertTrue(np.array_equal(signatures, expected))
+                self.assertEqual(computed, [self.articles[3]])
+                self.assertEqual(len(cache), 3)
+                self.assertTrue(
+                    np.array_equal(
+                        compute_signatures(self.articles, 2, minhasher, cache), expected
+                    )
+                )
+                cache.get_many([keys[1], keys[3]])
+
+            # The least recently used signatures are evicted
+            with SignatureCache(filename, max_entries=2) as cache:
+                self.assertEqual(len(cache), 2)
+                self.assertEqual(cache.get_many(keys[:1]), {})
+                self.assertEqual(set(cache.get_many(keys[3:])), {keys[3]})
+                computed.clear()
+                cache.signatures(self.articles[:1], 2, minhasher, compute)
+                self.assertEqual(computed, self.articles[:1])
+                self.assertEqual(set(cache.get_many(keys)), {keys[0], keys[3]})
+
+
+class StoreTest(TestCase):
+    """
+    Tests for the functionality implemented in the `store` module.
+    """
+
+    def test_signature_store(self) -> None:
+        """
+        Tests the `SignatureStore` class.
+        """
+        generator = np.random.RandomState(0)
+        signatures = generator.randint(0, 2 ** 32, (30, 13)).astype(np.uint64)
+
+        for bits in (1, 2, 4, 8, 16, 32):
+            with self.subTest(bits=bits):
+                store = SignatureStore(13, bits, signatures[:10])
+                store.append(signatures[10:])
+                self.assertEqual(len(store), 30)
+
+                expected = signatures & np.uint64((1 << bits) - 1)
+                self.assertTrue(np.array_equal(np.asarray(store), expected))
+                self.assertTrue(np.array_equal(store[3], expected[3]))
+                self.assertTrue(np.array_equal(store[[4, 2]], expected[[4, 2]]))
+                self.assertTrue(
+                    np.array_equal(np.vstack(list(store.chunks(7))), expected)
+                )
+                self.assertEqual(store.nbytes, 30 * -(-13 * bits // 8))
+
+        # The estimates are corrected for accidental matches of the kept bits
+        store = SignatureStore(4, 1, np.array([[0, 1, 0, 1], [0, 1, 1, 0]]))
+        self.assertEqual(store.similarities([[0, 0], [0, 1]]).tolist(), [1.0, 0.0])
+        store = SignatureStore(4, 32, np.array([[5, 6, 7, 8], [5, 6, 0, 0]]))
+        self.assertAlmostEqual(store.similarities([[0, 1]])[0], 0.5)
+
+        with self.assertRaises(ValueError):
+            SignatureStore(4, 3)
+        with self.assertRaises(ValueError):
+            store.append(np.zeros((2, 5)))
+
+    def test_verify_candidates_store(self) -> None:
+        """
+        Tests the `verify_candidates()` function with a `SignatureStore`.
+        """
+        signatures = np.array([[1, 2, 3, 4], [1, 2, 3, 5], [1, 6, 7, 5]])
+        store = SignatureStore(4, 8, signatures)
+        candidates = [((0, 1), 0.0), ((0, 2), 0.0), ((1, 2), 0.0)]
+        self.assertEqual(
+            [
+                (pair, round(similarity, 2))
+                for pair, similarity in verify_candidates(
+                    candidates, signatures=store, min_similarity=0.3
+                )
+            ],
+            [((0, 1), 0.75), ((1, 2), 0.5)],
+        )
+
+    def test_lsh_save_load_store(self) -> None:
+        """
+        Tests the `LSH.save()` and `LSH.load_signatures()` functions with a
+        `SignatureStore`.
+        """
+        generator = np.random.RandomState(0)
+        signatures = generator.randint(0, 2 ** 32, (200, 12)).astype(np.uint64)
+        store = SignatureStore(12, 1, signatures)
+        lsh = LSH(4, 3, fast_hashing=True)
+        lsh.add_documents(signatures)
+
+        with TemporaryDirectory() as directory:
+            lsh.save(directory, store)
+            # The packed matrix is saved, with 8 1-bit values per byte
+            saved = np.load(path.join(directory, "signatures.npy"))
+            self.assertEqual((saved.dtype, saved.shape), (np.uint8, (200, 2)))
+            loaded = LSH.load_signatures(directory)
+            self.assertIsInstance(loaded, SignatureStore)
+            self.assertEqual((loaded.nr_permutations, loaded.bits), (12, 1))
+            self.assertEqual(loaded.nbytes, store.nbytes)
+            self.assertTrue(np.array_equal(np.asarray(loaded), np.asarray(store)))
+
+            # The estimates are still corrected for the 1-bit values
+            pairs = generator.randint(0, 200, (100, 2))
+            self.assertTrue(
+                np.array_equal(loaded.similarities(pairs), store.similarities(pairs))
+            )
+            self.assertLess(loaded.similarities(pairs).mean(), 0.3)
+
+            # Saving without signatures removes the old ones
+            lsh.save(directory)
+            self.assertIsNone(LSH.load_signatures(directory))
+
+        with self.assertRaises(ValueError):
+            SignatureStore.from_packed(12, 2, store.packed)
+
 
 if __name__ == "__main__":
     from unittest import main